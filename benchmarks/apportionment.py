@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Measure the split generation throughput of make_payment_splits on
+unsaved, pre-annotated payments and debts.
+
+Usage: python benchmarks/apportionment.py [entries]
+"""
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+
+import django
+django.setup()
+
+from decimal import Decimal
+
+from djmoney.money import Money
+
+from double_entry.apportionment import APPORTIONMENT_ENGINES
+from double_entry.forms.bulk_utils import make_payment_splits
+from double_entry.utils import consume_with_result
+from tests import models
+
+BASE_DATE = datetime.datetime(2019, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def make_entries(model, fk_name, count, rng):
+    entries = []
+    for pk in range(1, count + 1):
+        entry = model(**{
+            'pk': pk, fk_name: 1,
+            'total_amount': Money(
+                Decimal(rng.randrange(100, 10000)).scaleb(-2), 'EUR'
+            ),
+            'timestamp': BASE_DATE + datetime.timedelta(minutes=pk),
+        })
+        entry.spoof_matched_balance(Decimal('0.00'))
+        entries.append(entry)
+    return entries
+
+
+def run(count, exact, engine):
+    rng = random.Random(1729)
+    debts = make_entries(models.SimpleCustomerDebt, 'debtor_id', count, rng)
+    payments = make_entries(
+        models.SimpleCustomerPayment, 'creditor_id', count, rng
+    )
+    start = time.perf_counter()
+    splits, results = consume_with_result(make_payment_splits(
+        payments, debts, models.SimpleCustomerPaymentSplit,
+        prioritise_exact_amount_match=exact, engine=engine
+    ))
+    elapsed = time.perf_counter() - start
+    print(
+        '%d payments x %d debts (%s engine, exact matching %s): '
+        '%d splits in %.2f s, %.0f splits/s' % (
+            count, count, engine, 'on' if exact else 'off', len(splits),
+            elapsed, len(splits) / elapsed
+        )
+    )
+
+
+def main(count):
+    for engine in APPORTIONMENT_ENGINES:
+        for exact in (False, True):
+            # fresh entries every run, since apportioning updates the balances
+            run(count, exact, engine)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Compare TransactionPartyMixin.fetch_balance with the equivalent annotated
+queryset, on an in-memory SQLite database loaded with the test fixtures.
+
+Usage: python benchmarks/fetch_balance.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+
+import django
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import setup_test_environment
+
+from double_entry.models import TransactionPartyQuerySet, _balance_query_cache
+from tests import models
+
+
+def main(iterations):
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    call_command('loaddata', 'simple.json', 'reservations.json', verbosity=0)
+    field = TransactionPartyQuerySet.DEBT_BALANCE_FIELD
+
+    for model in (models.SimpleCustomer, models.TicketCustomer):
+        pk = model.objects.values_list('pk', flat=True).first()
+
+        def orm():
+            return model.objects.with_debt_balances().values_list(
+                field, flat=True
+            ).get(pk=pk)
+
+        def fast():
+            return model.fetch_balance(pk)
+
+        assert orm() == fast()
+        assert _balance_query_cache[(model, 'default')] is not None
+        orm_time = timeit.timeit(orm, number=iterations)
+        fast_time = timeit.timeit(fast, number=iterations)
+        print(
+            '%s: queryset %.1f us/call, fetch_balance %.1f us/call '
+            '(%.1fx)' % (
+                model._meta.label,
+                orm_time / iterations * 1e6, fast_time / iterations * 1e6,
+                orm_time / fast_time
+            )
+        )
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
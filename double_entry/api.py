@@ -9,6 +9,7 @@ from djmoney.money import Money
 
 from webauth import api_utils
 from double_entry.forms import bulk_utils
+from double_entry.routers import read_from_replica, pin_to_primary
 
 __all__ = ['register_pipeline_endpoint']
 
@@ -252,14 +253,16 @@ class PaymentPipelineAPIEndpoint(api_utils.APIEndpoint, abstract=True):
         transaction_list = list(shape_all())
 
         pipeline = bulk_utils.PaymentSubmissionPipeline(self.pipeline_spec)
-        pipeline.submit_resolved(
-            [(self.get_queryset(ix), trs) for ix, trs in enumerate(by_section)]
-        )
+        with (pin_to_primary() if commit else read_from_replica()):
+            pipeline.submit_resolved([
+                (self.get_queryset(ix), trs)
+                for ix, trs in enumerate(by_section)
+            ])
 
-        if commit:
-            pipeline.commit()
-        else:
-            pipeline.review()
+            if commit:
+                pipeline.commit()
+            else:
+                pipeline.review()
         response = self.format_total_response(
             pipeline=pipeline, faulty_transaction_responses=faulty_transactions,
             transaction_list=transaction_list, commit=commit
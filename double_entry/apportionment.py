@@ -0,0 +1,291 @@
+"""
+Engines for the FIFO phase of make_payment_splits.
+
+The Python engine walks through the debts and payments one split at a
+time. The NumPy engine treats FIFO apportionment as a merge of the
+cumulative sums of the debt balances and the payment credits: every
+split is the overlap of a debt interval and a payment interval. The rule
+that a payment may not cover a debt dated after it is enforced by
+checking all overlaps at once. The first violating overlap marks the
+point where the Python engine would give up on that payment, so the
+merge is restarted from there, without that payment.
+This makes large reconciliation runs a batch computation, and yields
+exactly the same splits as the Python engine. Only the computation of
+the split amounts is vectorised: the splits themselves are still built
+one at a time through make_split. That takes the same time with either
+engine, and accounts for a large part of the total on big batches.
+
+Select the engine through the apportionment_engine attribute of
+CreditApportionmentMixin. NumPy is optional: without it, the NumPy engine
+falls back to the Python engine.
+"""
+import logging
+
+from double_entry.utils import money_to_units, units_to_decimal
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+__all__ = [
+    'ENGINE_PYTHON', 'ENGINE_NUMPY', 'APPORTIONMENT_ENGINES',
+    'numpy_available', 'numpy_fifo_splits',
+]
+
+logger = logging.getLogger(__name__)
+
+ENGINE_PYTHON = 'python'
+ENGINE_NUMPY = 'numpy'
+APPORTIONMENT_ENGINES = (ENGINE_PYTHON, ENGINE_NUMPY)
+
+# bounds on the number of debts and payments merged in one go
+MIN_WINDOW = 64
+MAX_WINDOW = 1 << 16
+# the cumulative sums of the amounts have to fit in an int64
+INT64_BOUND = 1 << 63
+
+
+def numpy_available():
+    return np is not None
+
+
+def _timestamp_ranks(debts, payments):
+    # timestamps are compared through their rank, which avoids any
+    # precision issues in converting datetimes to numbers
+    timestamps = sorted({e.timestamp for e in debts} | {
+        e.timestamp for e in payments
+    })
+    return {ts: ix for ix, ts in enumerate(timestamps)}
+
+
+def _fifo_overlaps(debt_amounts, debt_ranks, payment_amounts, payment_ranks):
+    """
+    Compute the FIFO apportionment of the given (positive) debt balances
+    over the given (positive) payment credits.
+
+    Returns a tuple of
+     - lists of arrays with the debt indices, payment indices and
+       amounts of the splits,
+     - the set of indices of the payments that were given up on, because
+       the debt they would have to cover is more recent,
+     - the index of the payment that was being used when the debts ran
+       out and its remaining credit, or None,
+     - the index of the debt that was being paid when the payments ran
+       out and its remaining balance, or None.
+    """
+    m = len(debt_amounts)
+    n = len(payment_amounts)
+    debt_ix = []
+    payment_ix = []
+    amounts = []
+    abandoned = set()
+    i0 = j0 = 0
+    debt_remaining = int(debt_amounts[0]) if m else 0
+    credit_remaining = int(payment_amounts[0]) if n else 0
+    window = MIN_WINDOW
+    while i0 < m and j0 < n:
+        # Merge the next few debts and payments. The window grows while
+        # there are no violations, and shrinks when they are frequent.
+        dd = debt_amounts[i0:i0 + window].copy()
+        dd[0] = debt_remaining
+        pp = payment_amounts[j0:j0 + window].copy()
+        pp[0] = credit_remaining
+        last_debts = i0 + window >= m
+        last_payments = j0 + window >= n
+        debt_cumsum = np.cumsum(dd)
+        credit_cumsum = np.cumsum(pp)
+        total = min(debt_cumsum[-1], credit_cumsum[-1])
+        ends = np.union1d(
+            debt_cumsum[debt_cumsum <= total],
+            credit_cumsum[credit_cumsum <= total]
+        )
+        starts = np.concatenate(([0], ends[:-1]))
+        seg_debts = np.searchsorted(debt_cumsum, starts, side='right')
+        seg_payments = np.searchsorted(credit_cumsum, starts, side='right')
+        violations = (
+            payment_ranks[j0 + seg_payments] < debt_ranks[i0 + seg_debts]
+        )
+        if violations.any():
+            k = int(np.argmax(violations))
+        else:
+            k = len(starts)
+        debt_ix.append(i0 + seg_debts[:k])
+        payment_ix.append(j0 + seg_payments[:k])
+        amounts.append(ends[:k] - starts[:k])
+
+        if k < len(starts):
+            # give up on the payment, and skip the following payments
+            # that are also too old to cover the current debt
+            window = max(MIN_WINDOW, 2 * k)
+            i0 += int(seg_debts[k])
+            debt_remaining = int(debt_cumsum[seg_debts[k]] - starts[k])
+            j = j0 + int(seg_payments[k])
+            recent_enough = (
+                payment_ranks[j + 1:j + 1 + window] >= debt_ranks[i0]
+            )
+            if recent_enough.any():
+                j0 = j + 1 + int(np.argmax(recent_enough))
+            else:
+                j0 = min(j + 1 + window, n)
+            abandoned.update(range(j, j0))
+            if j0 < n:
+                credit_remaining = int(payment_amounts[j0])
+            continue
+
+        window = min(MAX_WINDOW, 2 * window)
+        if debt_cumsum[-1] <= credit_cumsum[-1]:
+            # out of debts in this window
+            j = int(seg_payments[-1])
+            credit_left = int(credit_cumsum[j] - total)
+            if last_debts:
+                return (
+                    debt_ix, payment_ix, amounts, abandoned,
+                    (j0 + j, credit_left), None
+                )
+            i0 += len(dd)
+            debt_remaining = int(debt_amounts[i0])
+            if credit_left:
+                j0 += j
+                credit_remaining = credit_left
+            else:
+                j0 += j + 1
+                if j0 < n:
+                    credit_remaining = int(payment_amounts[j0])
+        else:
+            # out of payments in this window
+            i = int(np.searchsorted(debt_cumsum, total, side='right'))
+            debt_left = int(debt_cumsum[i] - total)
+            if last_payments:
+                return (
+                    debt_ix, payment_ix, amounts, abandoned,
+                    None, (i0 + i, debt_left)
+                )
+            j0 += len(pp)
+            credit_remaining = int(payment_amounts[j0])
+            i0 += i
+            debt_remaining = debt_left
+
+    if i0 < m:
+        return debt_ix, payment_ix, amounts, abandoned, None, (
+            i0, debt_remaining
+        )
+    return debt_ix, payment_ix, amounts, abandoned, None, None
+
+
+def numpy_fifo_splits(payments, debts, results, make_split):
+    """
+    FIFO phase of make_payment_splits, computed with NumPy.
+    Yields the splits built by make_split(payment, debt, amount in units),
+    see money_to_units, and records the outcome in results, exactly like
+    the Python engine.
+    Returns False without yielding anything if the input can't be handled,
+    i.e. if there are negative balances, or amounts that can't be added
+    up as 64-bit integers.
+    """
+    debt_balances = [money_to_units(d.balance) for d in debts]
+    payment_credits = [money_to_units(p.credit_remaining) for p in payments]
+    if any(b < 0 for b in debt_balances) \
+            or any(c < 0 for c in payment_credits):
+        logger.debug(
+            'Negative balances found, using the Python engine instead.'
+        )
+        return False
+    amounts = debt_balances + payment_credits
+    if not all(isinstance(a, int) for a in amounts) \
+            or max(sum(debt_balances), sum(payment_credits)) >= INT64_BOUND:
+        logger.debug(
+            'Amounts out of the range of the NumPy engine, using the '
+            'Python engine instead.'
+        )
+        return False
+
+    # refunds and settled debts are skipped, as are used up payments
+    active_debts = [
+        ix for ix, (d, b) in enumerate(zip(debts, debt_balances))
+        if b and not d.is_refund
+    ]
+    active_payments = [ix for ix, c in enumerate(payment_credits) if c]
+    rank = _timestamp_ranks(debts, payments)
+    debt_ix, payment_ix, amounts, abandoned, payment_state, debt_state = \
+        _fifo_overlaps(
+            np.array([debt_balances[ix] for ix in active_debts], np.int64),
+            np.array(
+                [rank[debts[ix].timestamp] for ix in active_debts], np.int64
+            ),
+            np.array(
+                [payment_credits[ix] for ix in active_payments], np.int64
+            ),
+            np.array(
+                [rank[payments[ix].timestamp] for ix in active_payments],
+                np.int64
+            ),
+        )
+
+    if amounts:
+        # map the indices back to the input lists all at once
+        payment_ix = np.array(active_payments, np.int64)[
+            np.concatenate(payment_ix)
+        ]
+        debt_ix = np.array(active_debts, np.int64)[np.concatenate(debt_ix)]
+        splits = zip(
+            payment_ix.tolist(), debt_ix.tolist(),
+            np.concatenate(amounts).tolist()
+        )
+        for j, i, amt in splits:
+            yield make_split(payments[j], debts[i], amt)
+
+    abandoned = {active_payments[j] for j in abandoned}
+
+    def report_used_payments(upto):
+        for ix, payment in enumerate(payments[:upto]):
+            if ix in abandoned:
+                results.remaining_payments.append(payment)
+            else:
+                results.fully_used_payments.append(payment)
+                payment.spoof_matched_balance(payment.total_amount)
+
+    if debt_state is None:
+        # out of debts: all of them are paid off
+        for debt in debts:
+            results.fully_paid_debts.append(debt)
+            debt.spoof_matched_balance(debt.total_amount)
+        if payment_state is None:
+            current = 0
+        else:
+            j, credit_remaining = payment_state
+            current = active_payments[j]
+            report_used_payments(current)
+            payment = payments[current]
+            if credit_remaining:
+                payment.spoof_matched_balance(
+                    payment.total_amount.amount
+                    - units_to_decimal(credit_remaining)
+                )
+                results.remaining_payments.append(payment)
+            current += 1
+        for p in payments[current:]:
+            if p.credit_remaining:
+                results.remaining_payments.append(p)
+            else:
+                results.fully_used_payments.append(p)
+    else:
+        # out of payments
+        i, debt_remaining = debt_state
+        current = active_debts[i]
+        report_used_payments(len(payments))
+        for debt in debts[:current]:
+            results.fully_paid_debts.append(debt)
+            debt.spoof_matched_balance(debt.total_amount)
+        debt = debts[current]
+        debt.spoof_matched_balance(
+            debt.total_amount.amount
+            - units_to_decimal(debt_remaining)
+        )
+        results.remaining_debts.append(debt)
+        for d in debts[current + 1:]:
+            if d.balance:
+                results.remaining_debts.append(d)
+            else:
+                results.fully_paid_debts.append(d)
+    return True
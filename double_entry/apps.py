@@ -5,3 +5,7 @@ from django.utils.translation import ugettext_lazy as _
 class DoubleEntryAppConfig(AppConfig):
     name = 'double_entry'
     verbose_name = _('Double-entry accounting & GnuCash integration')
+
+    def ready(self):
+        from double_entry.registry import build_registry
+        build_registry()
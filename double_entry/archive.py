@@ -0,0 +1,212 @@
+"""
+Archive tier for fully matched ledger entries.
+
+Fully matched debts and fully used payments are never apportioned again,
+so they can be moved out of the live tables into archive tables with the
+same columns. A ledger model opts in by setting its archive_model
+attribute (and that of its split model) to a plain model that mirrors its
+concrete fields. Entries are only archived together with everything
+they are connected to through splits, so the live tables never refer to
+archived rows. Other rows that refer to the archived entries (e.g. through
+cascading foreign keys or multi-table inheritance) are not archived, so
+archiving is refused if there are any.
+
+Queries on the live tables no longer see archived entries. Since those are
+fully matched against each other, current balances don't change, but the
+totals of with_debt_paid() and with_payment_totals() do. For parties with
+a balance checkpoint model, a checkpoint is recorded at the cutoff before
+archiving, so as-of balances from the cutoff onwards are preserved.
+As-of balances before the cutoff only reflect the live entries.
+"""
+import logging
+from collections import defaultdict, deque
+from typing import Type, Optional, Set
+
+from django.apps import apps
+from django.db import models, transaction
+from django.db.models.deletion import Collector
+
+from double_entry.models import BaseDebtRecord
+
+__all__ = ['get_archive_model', 'archive_fully_matched']
+
+logger = logging.getLogger(__name__)
+
+
+def get_archive_model(model) -> Optional[Type[models.Model]]:
+    archive_model = model.archive_model
+    if isinstance(archive_model, str):
+        archive_model = apps.get_model(archive_model)
+    return archive_model
+
+
+def _archivable_closure(debt_model: Type[BaseDebtRecord], cutoff):
+    payment_model = debt_model.get_other_half_model()
+    split_model, debt_fk = debt_model.get_split_model()
+    __, payment_fk = payment_model.get_split_model()
+
+    def candidates(model):
+        qs = model._default_manager.fully_matched().filter(
+            timestamp__lt=cutoff
+        )
+        return set(qs.values_list('pk', flat=True))
+
+    debts: Set[int] = candidates(debt_model)
+    payments: Set[int] = candidates(payment_model)
+
+    # every split touching a candidate has at least one old half
+    debt_fk_attname = split_model._meta.get_field(debt_fk).attname
+    payment_fk_attname = split_model._meta.get_field(payment_fk).attname
+    edges = split_model._default_manager.filter(
+        models.Q(**{debt_fk + '__timestamp__lt': cutoff})
+        | models.Q(**{payment_fk + '__timestamp__lt': cutoff})
+    ).values_list(debt_fk_attname, payment_fk_attname)
+
+    debt_neighbours = defaultdict(list)
+    payment_neighbours = defaultdict(list)
+    to_discard = deque()
+    for debt_id, payment_id in edges.iterator():
+        debt_neighbours[debt_id].append(payment_id)
+        payment_neighbours[payment_id].append(debt_id)
+        debt_ok = debt_id in debts
+        payment_ok = payment_id in payments
+        if debt_ok and not payment_ok:
+            to_discard.append((True, debt_id))
+        elif payment_ok and not debt_ok:
+            to_discard.append((False, payment_id))
+
+    # anything connected to a live entry has to stay live as well
+    while to_discard:
+        is_debt, pk = to_discard.popleft()
+        if is_debt:
+            if pk not in debts:
+                continue
+            debts.discard(pk)
+            to_discard.extend((False, p) for p in debt_neighbours[pk])
+        else:
+            if pk not in payments:
+                continue
+            payments.discard(pk)
+            to_discard.extend((True, d) for d in payment_neighbours[pk])
+    return debts, payments
+
+
+def _copy(model, pks, archive_model, batch_size):
+    attnames = [f.attname for f in archive_model._meta.concrete_fields]
+    for i in range(0, len(pks), batch_size):
+        rows = model._base_manager.filter(
+            pk__in=pks[i:i + batch_size]
+        ).values(*attnames)
+        archive_model._default_manager.bulk_create(
+            archive_model(**row) for row in rows
+        )
+
+
+def _delete(model, pks, batch_size):
+    using = model._default_manager.db
+    # rows of parent models (multi-table inheritance) belong to the entry
+    own_models = {model} | set(model._meta.get_parent_list())
+    for i in range(0, len(pks), batch_size):
+        batch = set(pks[i:i + batch_size])
+        collector = Collector(using=using)
+        collector.collect(model._base_manager.filter(pk__in=batch))
+        dependents = [
+            related_model for related_model, objs in collector.data.items()
+            if related_model not in own_models
+            or any(obj.pk not in batch for obj in objs)
+        ]
+        dependents.extend(
+            related_model for related_model in collector.field_updates
+        )
+        # the batch itself may be fast deleted as well,
+        # and the splits have been deleted already
+        dependents.extend(
+            qs.model for qs in collector.fast_deletes
+            if qs.model not in own_models and qs.exists()
+        )
+        if dependents:
+            raise ValueError(
+                'Archiving %s would also delete or update rows of %s.' % (
+                    model._meta.label, ', '.join(sorted(
+                        {m._meta.label for m in dependents}
+                    ))
+                )
+            )
+        collector.delete()
+
+
+def _checkpoint_before_archiving(entries, cutoff, batch_size):
+    # a party can have archived entries on both sides of the ledger,
+    # so collect its id from both before computing its checkpoint once
+    party_ids = defaultdict(set)
+    for model, pks in entries:
+        for checkpoint_model, checkpoint_fk, attname in \
+                model.get_balance_checkpoint_targets():
+            ids = party_ids[checkpoint_model, checkpoint_fk]
+            for i in range(0, len(pks), batch_size):
+                ids.update(model._base_manager.filter(
+                    pk__in=pks[i:i + batch_size]
+                ).values_list(attname, flat=True))
+    for (checkpoint_model, checkpoint_fk), ids in party_ids.items():
+        party_model = checkpoint_model._meta.get_field(
+            checkpoint_fk
+        ).related_model
+        ids = sorted(ids - {None})
+        for i in range(0, len(ids), batch_size):
+            checkpoint_model.create_checkpoints(
+                cutoff, parties=party_model._default_manager.filter(
+                    pk__in=ids[i:i + batch_size]
+                ), batch_size=batch_size
+            )
+
+
+def archive_fully_matched(debt_model: Type[BaseDebtRecord], cutoff,
+                          batch_size=500):
+    """
+    Move the fully matched debts and payments with a timestamp before
+    cutoff to their archive tables, together with their splits.
+    Entries connected (directly or indirectly) to entries that are not
+    archivable stay in the live tables.
+    Raises ValueError (and archives nothing) if other rows refer to the
+    entries that would be archived.
+    Returns a tuple with the number of archived debts, payments and splits.
+    """
+    payment_model = debt_model.get_other_half_model()
+    split_model, debt_fk = debt_model.get_split_model()
+    archive_models = [
+        get_archive_model(m) for m in (debt_model, payment_model, split_model)
+    ]
+    if None in archive_models:
+        raise TypeError(
+            'Debts, payments and splits all need an archive_model.'
+        )
+    debt_archive, payment_archive, split_archive = archive_models
+
+    with transaction.atomic(using=debt_model._default_manager.db):
+        debts, payments = _archivable_closure(debt_model, cutoff)
+        debt_ids = sorted(debts)
+        payment_ids = sorted(payments)
+        split_ids = []
+        for i in range(0, len(debt_ids), batch_size):
+            split_ids.extend(
+                split_model._base_manager.filter(**{
+                    debt_fk + '__in': debt_ids[i:i + batch_size]
+                }).values_list('pk', flat=True)
+            )
+        # the archive tables may have foreign keys between them,
+        # so copy the splits last and delete them first
+        _copy(debt_model, debt_ids, debt_archive, batch_size)
+        _copy(payment_model, payment_ids, payment_archive, batch_size)
+        _copy(split_model, split_ids, split_archive, batch_size)
+        _checkpoint_before_archiving(
+            [(debt_model, debt_ids), (payment_model, payment_ids)],
+            cutoff, batch_size
+        )
+        _delete(split_model, split_ids, batch_size)
+        _delete(debt_model, debt_ids, batch_size)
+        _delete(payment_model, payment_ids, batch_size)
+    logger.info(
+        'Archived %d debts, %d payments and %d splits recorded before %s.',
+        len(debt_ids), len(payment_ids), len(split_ids), cutoff
+    )
+    return len(debt_ids), len(payment_ids), len(split_ids)
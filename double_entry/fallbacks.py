@@ -0,0 +1,133 @@
+"""
+Reporting of "database deluge" fallbacks.
+
+Properties such as matched_balance and debt_balance read annotations or
+prefetched relations when they are available, and otherwise fall back to
+querying the database once per instance. Every such fallback goes through
+report_fallback(), which
+
+ - counts it in the active FallbackStats object, if any
+   (see collect_fallbacks() and FallbackStatsMiddleware),
+ - raises LedgerFallbackError if DOUBLE_ENTRY_FALLBACKS is set to
+   'raise', e.g. in tests or during development,
+ - logs a performance warning at debug level otherwise.
+
+The stack of the call site is only captured if DOUBLE_ENTRY_FALLBACK_STACKS
+is set, since formatting it is expensive.
+"""
+import logging
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+__all__ = [
+    'LedgerFallbackError', 'FallbackStats', 'collect_fallbacks',
+    'report_fallback', 'FallbackStatsMiddleware',
+]
+
+logger = logging.getLogger(__name__)
+
+FALLBACKS_LOG = 'log'
+FALLBACKS_RAISE = 'raise'
+
+_current_stats = ContextVar('double_entry_fallback_stats', default=None)
+
+
+class LedgerFallbackError(RuntimeError):
+    pass
+
+
+class FallbackStats:
+    """
+    Counts the fallbacks by computation and model, and by call site if
+    stacks are captured.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.call_sites = Counter()
+
+    def record(self, what, model, stack=None):
+        self.counts[(what, model._meta.label)] += 1
+        if stack is not None:
+            self.call_sites[stack] += 1
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def summary(self):
+        return ', '.join(
+            '%s on %s: %d' % (what, label, count)
+            for (what, label), count in self.counts.most_common()
+        )
+
+
+@contextmanager
+def collect_fallbacks():
+    """
+    Count all fallbacks in this block in a fresh FallbackStats object.
+    """
+    stats = FallbackStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+def report_fallback(what, instance):
+    """
+    Report that the given computation on the given model instance falls
+    back to querying the database, see the module docstring.
+    """
+    model = instance.__class__
+    stack = None
+    if getattr(settings, 'DOUBLE_ENTRY_FALLBACK_STACKS', False):
+        # leave out this frame
+        stack = ''.join(traceback.format_stack()[:-1])
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.record(what, model, stack)
+    mode = getattr(settings, 'DOUBLE_ENTRY_FALLBACKS', FALLBACKS_LOG)
+    if mode == FALLBACKS_RAISE:
+        raise LedgerFallbackError(
+            'Falling back to database deluge for %s computation on %s '
+            'with id %s. Please review queryset usage.' % (
+                what, model._meta.label, instance.pk
+            )
+        )
+    logger.debug(
+        'PERFORMANCE WARNING: '
+        'falling back to database deluge '
+        'for %(what)s computation. '
+        'Please review queryset usage. '
+        'Object of type %(model)s with id %(pk)s',
+        {'what': what, 'model': model, 'pk': instance.pk}
+    )
+    if stack is not None:
+        logger.debug(stack)
+
+
+class FallbackStatsMiddleware:
+    """
+    Count the fallbacks of every request. The stats are available as
+    request.ledger_fallbacks, and requests with fallbacks are logged.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with collect_fallbacks() as stats:
+            request.ledger_fallbacks = stats
+            response = self.get_response(request)
+        if stats.total:
+            logger.info(
+                '%d ledger fallback(s) in %s %s: %s', stats.total,
+                request.method, request.path, stats.summary()
+            )
+        return response
@@ -3,6 +3,9 @@ Utilities for importing financial transactions in bulk.
 For now, all code in the pipeline assumes that there is one fixed party to all
 transactions (i.e. the website tenant), and one other party that may vary
 by transaction. These parties are kept track of in one or more database tables.
+When the ledger tables are sharded per tenant, the pipelines run against the
+database of the tenant that was active when they were created (see
+double_entry.routers.tenant_context).
 
 Transactions enter the pipeline as TransactionInfo objects from a CSV parser,
 and then pass through the following stages:
@@ -35,12 +38,13 @@ and then pass through the following stages:
 """
 import abc
 import dataclasses
+import heapq
 import inspect
 import logging
 import datetime
 from dataclasses import dataclass
 from decimal import Decimal
-from collections import defaultdict, deque
+from collections import defaultdict
 from enum import IntFlag
 from typing import (
     TypeVar, Sequence, Generator, Type, Tuple,
@@ -51,6 +55,7 @@ from typing import (
 import pytz
 from django import forms
 from django.conf import settings
+from django.db import connections, router
 from django.db.models import ForeignKey, QuerySet
 from django.utils import timezone
 from django.utils.translation import (
@@ -60,13 +65,22 @@ from django.utils.translation import (
 from djmoney.money import Money
 
 from double_entry.forms.csv import TransactionInfo, FinancialCSVParser
+from double_entry import registry
+from double_entry.routers import (
+    read_from_replica, pin_to_primary, tenant_context, get_current_tenant,
+    get_current_tenant_database,
+)
 from double_entry.models import (
     TransactionPartyMixin, BaseDebtPaymentSplit
 )
 from double_entry import models as accounting_base, models
+from double_entry.apportionment import (
+    ENGINE_PYTHON, ENGINE_NUMPY, APPORTIONMENT_ENGINES, numpy_available,
+    numpy_fifo_splits,
+)
 from double_entry.utils import (
-    decimal_to_money, consume_with_result,
-    _dt_fallback,
+    consume_with_result,
+    _dt_fallback, money_to_units, units_to_decimal,
 )
 from double_entry.forms.utils import (
     CSVUploadForm, ErrorMixin,
@@ -300,8 +314,11 @@ class LedgerQuerySetBuilder(Generic[TP]):
 
     @staticmethod
     def default_ledger_query_set(transaction_party_model: Type[TP]):
-        return transaction_party_model \
+        qs = transaction_party_model \
             ._default_manager.with_debts_and_payments()
+        # pin the queryset to the tenant that was active when it was built
+        alias = get_current_tenant_database()
+        return qs if alias is None else qs.using(alias)
 
 class LedgerResolver(ErrorContextWrapper, LedgerQuerySetBuilder[TP], Generic[TP, TI, RT], abc.ABC):
     transaction_info_class: ClassVar[Type[TI]] = TransactionInfo
@@ -450,28 +467,31 @@ class LedgerEntryPreparator(Generic[LE, TP, RT]):
 
     @classmethod
     def get_account_field(cls):
-        if cls.account_field is None:
-            model: Type[LE] = cls.model
-            tpm: Type[TP] = cls.transaction_party_model
-
-            def is_candidate(field):
-                if not isinstance(field, ForeignKey):
-                    return False
-                return field.related_model == tpm
-
-            try:
-                account_field, = (
-                    f for f in model._meta.get_fields() if is_candidate(f)
-                )
-            except ValueError:  # pramga: no cover
-                raise TypeError(
-                    'Could not establish a link between transaction party model '
-                    'and ledger entry model. Please set the `account_field` '
-                    'class attribute.'
-                )
-            cls.account_field = account_field.name
+        if cls.account_field is not None:
+            return cls.account_field
+        model: Type[LE] = cls.model
+        tpm: Type[TP] = cls.transaction_party_model
+        account_field = registry.get_account_field(model, tpm)
+        if account_field is not None:
+            return account_field
+
+        # the registry isn't ready yet, or the link is ambiguous
+        def is_candidate(field):
+            if not isinstance(field, ForeignKey):
+                return False
+            return field.related_model == tpm
 
-        return cls.account_field
+        try:
+            account_field, = (
+                f for f in model._meta.get_fields() if is_candidate(f)
+            )
+        except ValueError:  # pramga: no cover
+            raise TypeError(
+                'Could not establish a link between transaction party model '
+                'and ledger entry model. Please set the `account_field` '
+                'class attribute.'
+            )
+        return account_field.name
 
     def __init__(self, resolved_transactions: Iterable[Tuple[TP, RT]]):
         self.__class__._ensure_transaction_party_model_set()
@@ -558,7 +578,7 @@ class LedgerEntryPreparator(Generic[LE, TP, RT]):
         return
 
     def commit(self):
-        from django.db import connection
+        connection = connections[router.db_for_write(self.model)]
         can_bulk_save = connection.features.can_return_ids_from_bulk_insert
 
         all_ledger_entries = [
@@ -592,35 +612,62 @@ class DuplicationProtectedPreparator(LedgerEntryPreparator[LE, TP, RT]):
         'Resolution: likely duplicate, skipped processing.'
     )
 
+    # number of accounts per historical duplicate check query
+    dupcheck_account_chunk_size = 500
+
     def validate_global(self, valid_transactions: PreparedTransactionList):
         valid_transactions = list(super().validate_global(valid_transactions))
-        dates = [
-            t.transaction.timestamp.astimezone(pytz.utc).date()
-            for t in valid_transactions
-        ]
-        if not dates:
+        if not valid_transactions:
             return []
-        # create a window wide enough to accommodate timezone shenanigans
-        min_ts = _dt_fallback(
-            min(dates) - datetime.timedelta(days=2), default_timezone=pytz.utc
-        )
-        max_ts = _dt_fallback(
-            max(dates) + datetime.timedelta(days=2), default_timezone=pytz.utc,
-            use_max=True
-        )
-        historical_buckets = self.model._default_manager.dupcheck_buckets(
-            timestamp_bounds=(min_ts, max_ts)
-        )
 
+        use_hashes = issubclass(
+            self.model, accounting_base.DupcheckSignatureHashMixin
+        )
         import_buckets: Dict[Any, List[PreparedTransaction]] = defaultdict(list)
         for transaction in valid_transactions:
             # have to assert this, the typing hints aren't flexible enough
             # TODO think of a cleaner way
             e = cast(accounting_base.DuplicationProtectionMixin,
                      transaction.ledger_entry)
-            sig = e.dupcheck_signature
+            if use_hashes:
+                # same date convention as the stored hashes
+                sig = cast(accounting_base.DupcheckSignatureHashMixin, e) \
+                    .dupcheck_hash_signature
+            else:
+                sig = e.dupcheck_signature
             import_buckets[sig].append(transaction)
 
+        if use_hashes:
+            # look up the signatures in the batch directly
+            historical_buckets = self.model._default_manager \
+                .dupcheck_buckets_for(import_buckets.keys())
+        else:
+            dates = [
+                t.transaction.timestamp.astimezone(pytz.utc).date()
+                for t in valid_transactions
+            ]
+            # create a window wide enough to accommodate timezone shenanigans
+            min_ts = _dt_fallback(
+                min(dates) - datetime.timedelta(days=2),
+                default_timezone=pytz.utc
+            )
+            max_ts = _dt_fallback(
+                max(dates) + datetime.timedelta(days=2),
+                default_timezone=pytz.utc, use_max=True
+            )
+            # only look at the history of the accounts in this batch
+            account_filter = self.__class__.get_account_field() + '__in'
+            account_ids = list(self.account_ids())
+            chunk_size = self.dupcheck_account_chunk_size
+            historical_buckets = defaultdict(int)
+            for i in range(0, len(account_ids), chunk_size):
+                qs = self.model._default_manager.filter(
+                    **{account_filter: account_ids[i:i + chunk_size]}
+                )
+                buckets = qs.dupcheck_buckets(timestamp_bounds=(min_ts, max_ts))
+                for sig, count in buckets.items():
+                    historical_buckets[sig] += count
+
         def strip_duplicates():
             transactions: List[PreparedTransaction]
             for dup_sig, transactions in import_buckets.items():
@@ -656,7 +703,9 @@ class DuplicationProtectedPreparator(LedgerEntryPreparator[LE, TP, RT]):
                 
 
     def dup_error_params(self, signature_used):
-        account_id = getattr(signature_used, self.account_field + '_id')
+        account_id = getattr(
+            signature_used, self.__class__.get_account_field() + '_id'
+        )
         return {
             'date': signature_used.date,
             'amount': Money(
@@ -684,20 +733,135 @@ class ApportionmentResult:
         return self
 
 
+def _exact_match_index(debts, balances):
+    """
+    Index the debts that are eligible for exact amount matching by balance.
+    Every balance maps to a heap of (timestamp, position) pairs, so the
+    oldest debt with a given balance can be found and removed in
+    logarithmic time. Debts with the same timestamp are ordered by their
+    position in the input.
+    """
+    index = defaultdict(list)
+    for ix, (debt, balance) in enumerate(zip(debts, balances)):
+        if not debt.is_refund:
+            index[balance].append((debt.timestamp, ix))
+    for candidates in index.values():
+        heapq.heapify(candidates)
+    return index
+
+
+def bounded_subset_sum(amounts: Sequence[int], target: int, max_size: int) \
+        -> Optional[Tuple[int, ...]]:
+    """
+    Find a subset of at most max_size of the given (integer) amounts that
+    adds up to target exactly, and return the indices of its elements.
+    The smallest such subset is returned, and ties are broken in favour of
+    the earliest elements, so the result is deterministic.
+    Returns None if there is no such subset.
+
+    This is a dynamic program over the reachable sums up to target, which
+    keeps the best subset for every sum: a smaller subset (or an earlier
+    one of the same size) can always be extended in the same ways.
+    """
+    if target <= 0:
+        return None
+    best = {0: ()}
+    for ix, amount in enumerate(amounts):
+        if amount <= 0 or amount > target:
+            continue
+        for subtotal, subset in list(best.items()):
+            new_total = subtotal + amount
+            if len(subset) >= max_size or new_total > target:
+                continue
+            new_subset = subset + (ix,)
+            current = best.get(new_total)
+            if current is None \
+                    or (len(new_subset), new_subset) < (len(current), current):
+                best[new_total] = new_subset
+    return best.get(target)
+
+
+# default caps for matching payments to sets of debts
+SUBSET_MATCH_MAX_SIZE = 3
+SUBSET_MATCH_MAX_DEBTS = 20
+
+
+class _DebtSubsetMatcher:
+    """
+    Find small sets of open debts with balances that add up to the amount
+    of a payment. Only the max_debts oldest open debts dated no later than
+    the payment are considered, which assumes that the debts are ordered
+    from old to new.
+    """
+
+    def __init__(self, debts, balances, matched, max_size, max_debts):
+        self.debts = debts
+        self.balances = balances
+        self.matched = matched
+        self.max_size = max_size
+        self.max_debts = max_debts
+        self.open = [
+            ix for ix, (debt, balance) in enumerate(zip(debts, balances))
+            if balance > 0 and not debt.is_refund
+        ]
+
+    def _candidates(self, timestamp):
+        candidates = []
+        skipped = 0
+        for ix in self.open:
+            if ix in self.matched:
+                skipped += 1
+                continue
+            if len(candidates) == self.max_debts \
+                    or self.debts[ix].timestamp > timestamp:
+                break
+            candidates.append(ix)
+        if skipped > self.max_debts:
+            # drop the debts that were matched in the meantime
+            self.open = [ix for ix in self.open if ix not in self.matched]
+        return candidates
+
+    def match(self, timestamp, amount):
+        candidates = self._candidates(timestamp)
+        subset = bounded_subset_sum(
+            [self.balances[ix] for ix in candidates], amount, self.max_size
+        )
+        if subset is None:
+            return None
+        return [candidates[i] for i in subset]
+
+
 ST = TypeVar('ST', bound=BaseDebtPaymentSplit)
 def make_payment_splits(payments: Sequence[accounting_base.BasePaymentRecord],
                         debts: Sequence[accounting_base.BaseDebtRecord],
                         split_model: Type[ST],
                         prioritise_exact_amount_match=True,
                         exact_amount_match_only=False,
-                        payment_fk_name: str=None, debt_fk_name: str=None) \
+                        payment_fk_name: str=None, debt_fk_name: str=None,
+                        engine=ENGINE_PYTHON, match_debt_subsets=False,
+                        subset_max_size=SUBSET_MATCH_MAX_SIZE,
+                        subset_max_debts=SUBSET_MATCH_MAX_DEBTS) \
         -> Generator[ST, None, ApportionmentResult]:
     """
     This method assumes that there are no preexistent splits between
     the payments and debts involved in the computation.
     Ensure that the payments and debts are appropriately annotated for
     optimal results.
+
+    Internally, all balances are tracked as integer amounts of the smallest
+    unit the MoneyFields can store (see money_to_units),
+    so Money objects are only built for the splits themselves.
+
+    The engine parameter selects the implementation of the FIFO phase,
+    see double_entry.apportionment.
+
+    If match_debt_subsets is set, payments that don't match the balance of
+    a single debt are matched to a set of at most subset_max_size debts
+    with balances adding up to the amount of the payment, chosen among the
+    subset_max_debts oldest open debts (see bounded_subset_sum).
     """
+    if engine not in APPORTIONMENT_ENGINES:
+        raise ValueError('Unknown apportionment engine %r.' % engine)
 
     # use double-ledger introspection to figure out the right foreign
     # key names
@@ -707,41 +871,69 @@ def make_payment_splits(payments: Sequence[accounting_base.BasePaymentRecord],
         debt_fk_name = split_model.get_debt_column()
 
     results = ApportionmentResult()
+    currency = settings.DEFAULT_CURRENCY
+
+    def make_split(payment, debt, amt):
+        return split_model(**{
+            payment_fk_name: payment, debt_fk_name: debt,
+            'amount': Money(units_to_decimal(amt), currency)
+        })
 
-    # There might be a more efficient way, but let's not optimise prematurely
     if prioritise_exact_amount_match or exact_amount_match_only:
-        payment_list = list(payments)
-        debt_list = deque(debts)
+        debt_list = list(debts)
+        balances = [money_to_units(d.balance) for d in debt_list]
+        exact_match_index = _exact_match_index(debt_list, balances)
+        matched_debts = set()
+        if match_debt_subsets:
+            subset_matcher = _DebtSubsetMatcher(
+                debt_list, balances, matched_debts,
+                subset_max_size, subset_max_debts
+            )
         payments_todo = []
-        for payment in payment_list:
-            try:
-                amt = payment.credit_remaining
-                # attempt to find a debt matching the exact payment amount
-                index, exact_match = next(
-                    (ix, d) for ix, d in enumerate(debt_list)
-                    if d.balance == amt and d.timestamp <= payment.timestamp
-                    and not d.is_refund
-                )
-                # remove debt from the candidate list
-                # this triggers another O(n) read, which feels like
-                # it should be unnecessary, but it doesn't really matter
-                del debt_list[index]
-
-                # for consistency
+        for payment in payments:
+            amt = payment.credit_remaining
+            amt_units = money_to_units(amt)
+            # attempt to find a debt matching the exact payment amount:
+            # the oldest one is at the top of the heap
+            candidates = exact_match_index.get(amt_units)
+            # skip debts that were matched as part of a set
+            while candidates and candidates[0][1] in matched_debts:
+                heapq.heappop(candidates)
+            if not candidates or candidates[0][0] > payment.timestamp:
+                subset = None
+                if match_debt_subsets:
+                    subset = subset_matcher.match(payment.timestamp, amt_units)
+                if subset is None:
+                    # no exact match, so defer handling
+                    payments_todo.append(payment)
+                    continue
+                matched_debts.update(subset)
                 payment.spoof_matched_balance(payment.total_amount.amount)
-                exact_match.spoof_matched_balance(exact_match.total_amount.amount)
-                # yield payment split covering this transaction
-                yield split_model(**{
-                    payment_fk_name: payment, debt_fk_name: exact_match,
-                    'amount': amt
-                })
+                for ix in subset:
+                    debt = debt_list[ix]
+                    debt.spoof_matched_balance(debt.total_amount.amount)
+                    yield make_split(payment, debt, balances[ix])
+                    results.fully_paid_debts.append(debt)
                 results.fully_used_payments.append(payment)
-                results.fully_paid_debts.append(exact_match)
-            except StopIteration:
-                # no exact match, so defer handling
-                payments_todo.append(payment)
-
-        debts_iter = iter(debt_list)
+                continue
+            __, ix = heapq.heappop(candidates)
+            exact_match = debt_list[ix]
+            matched_debts.add(ix)
+
+            # for consistency
+            payment.spoof_matched_balance(payment.total_amount.amount)
+            exact_match.spoof_matched_balance(exact_match.total_amount.amount)
+            # yield payment split covering this transaction
+            yield split_model(**{
+                payment_fk_name: payment, debt_fk_name: exact_match,
+                'amount': amt
+            })
+            results.fully_used_payments.append(payment)
+            results.fully_paid_debts.append(exact_match)
+
+        debts_iter = (
+            d for ix, d in enumerate(debt_list) if ix not in matched_debts
+        )
         payments_iter = iter(payments_todo)
     else:
         payments_iter = iter(payments)
@@ -752,6 +944,17 @@ def make_payment_splits(payments: Sequence[accounting_base.BasePaymentRecord],
         results.remaining_payments.extend(payments_iter)
         return results
 
+    if engine == ENGINE_NUMPY and numpy_available():
+        payment_list = list(payments_iter)
+        debt_list = list(debts_iter)
+        handled = yield from numpy_fifo_splits(
+            payment_list, debt_list, results, make_split
+        )
+        if handled:
+            return results
+        payments_iter = iter(payment_list)
+        debts_iter = iter(debt_list)
+
     # The generic method is simple: use payments to pay off debts
     # until we either run out of debts, or of money to pay 'em
     payment = debt = None
@@ -763,7 +966,7 @@ def make_payment_splits(payments: Sequence[accounting_base.BasePaymentRecord],
     # that debts cannot be retroactively paid off by past payments.
     # By ordering the payments and debts from old to new, we can easily
     # ensure that this happens.
-    credit_remaining = debt_remaining = decimal_to_money(Decimal('0.00'))
+    credit_remaining = debt_remaining = 0
     while True:
         # noinspection DuplicatedCode
         try:
@@ -776,12 +979,13 @@ def make_payment_splits(payments: Sequence[accounting_base.BasePaymentRecord],
                     results.fully_paid_debts.append(debt)
                     debt.spoof_matched_balance(debt.total_amount)
                 debt = next(debts_iter)
-                debt_remaining = debt.balance
+                debt_remaining = money_to_units(debt.balance)
         except StopIteration:
             # all debts fully paid back, bail
             if credit_remaining:
                 payment.spoof_matched_balance(
-                    payment.total_amount.amount - credit_remaining.amount
+                    payment.total_amount.amount
+                    - units_to_decimal(credit_remaining)
                 )
                 results.remaining_payments.append(payment)
             for p in payments_iter:
@@ -804,13 +1008,16 @@ def make_payment_splits(payments: Sequence[accounting_base.BasePaymentRecord],
                         results.fully_used_payments.append(payment)
                         payment.spoof_matched_balance(payment.total_amount)
                 payment = next(payments_iter)
-                credit_remaining = payment.credit_remaining
+                credit_remaining = money_to_units(
+                    payment.credit_remaining
+                )
 
         except StopIteration:
             # no money left to pay stuff, bail
             if debt_remaining:
                 debt.spoof_matched_balance(
-                    debt.total_amount.amount - debt_remaining.amount
+                    debt.total_amount.amount
+                    - units_to_decimal(debt_remaining)
                 )
                 results.remaining_debts.append(debt)
             for d in debts_iter:
@@ -824,9 +1031,7 @@ def make_payment_splits(payments: Sequence[accounting_base.BasePaymentRecord],
         amt = min(debt_remaining, credit_remaining)
         credit_remaining -= amt
         debt_remaining -= amt
-        yield split_model(**{
-            payment_fk_name: payment, debt_fk_name: debt, 'amount': amt
-        })
+        yield make_split(payment, debt, amt)
 
     return results
 
@@ -850,9 +1055,9 @@ def refund_overpayment(
     debt_model = p.__class__.get_other_half_model()
     debt_fk_name = split_model.get_debt_column()
 
-    credit_to_refund = sum(
-        (payment.credit_remaining for payment in payments),
-        decimal_to_money(Decimal('0.00'))
+    credit_to_refund = Money(
+        sum(payment.credit_remaining.amount for payment in payments),
+        settings.DEFAULT_CURRENCY
     )
 
     if not credit_to_refund:
@@ -886,6 +1091,13 @@ class CreditApportionmentMixin(LedgerEntryPreparator[PLE, TP, RT]):
 
     prioritise_exact_amount_match = True
     exact_amount_match_only = False
+    # the NumPy engine falls back to the Python engine
+    # if NumPy isn't installed
+    apportionment_engine = ENGINE_PYTHON
+    # match payments to sets of debts, see make_payment_splits
+    match_debt_subsets = False
+    subset_match_max_size = SUBSET_MATCH_MAX_SIZE
+    subset_match_max_debts = SUBSET_MATCH_MAX_DEBTS
 
     @property
     def overpayment_fmt_string(self):
@@ -945,7 +1157,11 @@ class CreditApportionmentMixin(LedgerEntryPreparator[PLE, TP, RT]):
             payment_fk_name=self.payment_fk_name,
             debt_fk_name=self.debt_fk_name,
             prioritise_exact_amount_match=self.prioritise_exact_amount_match,
-            exact_amount_match_only=self.exact_amount_match_only
+            exact_amount_match_only=self.exact_amount_match_only,
+            engine=self.apportionment_engine,
+            match_debt_subsets=self.match_debt_subsets,
+            subset_max_size=self.subset_match_max_size,
+            subset_max_debts=self.subset_match_max_debts
         )
 
     def simulate_apportionments(self, debt_key, debts, transactions) \
@@ -992,7 +1208,7 @@ class CreditApportionmentMixin(LedgerEntryPreparator[PLE, TP, RT]):
         # will not set fk's correctly
         super().commit()
 
-        from django.db import connection
+        connection = connections[router.db_for_write(self.split_model)]
         self._trans_buckets = self.transaction_buckets()
         can_bulk_save = connection.features.can_return_ids_from_bulk_insert
         global_results = ApportionmentResult()
@@ -1143,8 +1359,12 @@ def as_submission_spec(pipeline_spec: PipelineSpec) -> SubmissionSpec:
     ]
 
 class PaymentSubmissionPipeline:
-    def __init__(self, pipeline_spec: SubmissionSpec, **kwargs):
+    def __init__(self, pipeline_spec: SubmissionSpec, *, tenant=None,
+                 **kwargs):
         super().__init__(**kwargs)
+        # defaults to the tenant that is active right now,
+        # see double_entry.routers.tenant_context
+        self.tenant = tenant if tenant is not None else get_current_tenant()
         self.pipeline_sections = [
             SubmissionPipelineSection(preparator)
             for rt_class, preparator in pipeline_spec
@@ -1187,16 +1407,21 @@ class PaymentSubmissionPipeline:
                         params={'pk': rt.transaction_party_id}
                     )
 
-        self.resolved = [
-            list(resolved_for_pipeline(qb, rt_class, transactions))
-            for rt_class, (qb, transactions) in zip(self.rt_classes, resolved)
-        ]
+        with tenant_context(self.tenant):
+            self.resolved = [
+                list(resolved_for_pipeline(qb, rt_class, transactions))
+                for rt_class, (qb, transactions)
+                in zip(self.rt_classes, resolved)
+            ]
 
     def review(self):
-        self._trigger_pipeline(commit=False)
+        with tenant_context(self.tenant), read_from_replica():
+            self._trigger_pipeline(commit=False)
 
     def commit(self):
-        self._trigger_pipeline(commit=True)
+        # duplicate checks and apportionments need up-to-date data
+        with tenant_context(self.tenant), pin_to_primary():
+            self._trigger_pipeline(commit=True)
 
     def _trigger_pipeline(self, *, commit: bool):
         if self.resolved is None:
@@ -1220,12 +1445,14 @@ class PaymentPipeline(PaymentSubmissionPipeline, ParserErrorAggregator):
         'Skipped processing.'
     )
 
-    def __init__(self, pipeline_spec: PipelineSpec, parser):
+    def __init__(self, pipeline_spec: PipelineSpec, parser, tenant=None):
         submission_spec: SubmissionSpec = [
             (res_class.resolved_transaction_class, prep_class)
             for res_class, prep_class in pipeline_spec
         ]
-        super().__init__(pipeline_spec=submission_spec, parser=parser)
+        super().__init__(
+            pipeline_spec=submission_spec, parser=parser, tenant=tenant
+        )
 
         self.pipeline_sections = [
             PaymentPipelineSection(resolver, preparator, self)
@@ -1243,6 +1470,10 @@ class PaymentPipeline(PaymentSubmissionPipeline, ParserErrorAggregator):
     def resolve(self):
         if self.resolved is not None:
             return
+        with tenant_context(self.tenant):
+            self._resolve()
+
+    def _resolve(self):
         resolvers = [p.spawn_resolver() for p in self.pipeline_sections]
         submission = [next(r) for r in resolvers]
         for info in self.parser.parsed_data:
@@ -1298,8 +1529,9 @@ class FinancialCSVUploadForm(CSVUploadForm):
         pipeline = PaymentPipeline(
             pipeline_spec=self.pipeline_spec, parser=parser
         )
-        pipeline.resolve()
-        pipeline.review()
+        with read_from_replica():
+            pipeline.resolve()
+            pipeline.review()
         # the PreparedTransactions aren't directly necessary for now
         assert pipeline.resolved is not None
         self.pipeline_final_state = pipeline
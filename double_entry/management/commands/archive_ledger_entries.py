@@ -0,0 +1,64 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date, parse_datetime
+
+from double_entry.archive import archive_fully_matched, get_archive_model
+from double_entry.models import BaseDebtRecord
+from double_entry.utils import _dt_fallback
+
+
+class Command(BaseCommand):
+    help = (
+        'Move fully matched debts and payments recorded before a cutoff, '
+        'together with their splits, to their archive tables.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*', metavar='app_label.ModelName',
+            help='Restrict to the ledgers of these debt models.'
+        )
+        parser.add_argument(
+            '--before', dest='before', required=True,
+            help=(
+                'Cutoff timestamp or date (ISO format). Only entries '
+                'recorded before the cutoff are archived.'
+            )
+        )
+
+    def handle(self, *args, models=None, before=None, **options):
+        cutoff = parse_datetime(before)
+        if cutoff is None:
+            cutoff_date = parse_date(before)
+            if cutoff_date is None:
+                raise CommandError('Could not parse date %s.' % before)
+            cutoff = _dt_fallback(cutoff_date)
+        else:
+            cutoff = _dt_fallback(cutoff)
+
+        if models:
+            try:
+                targets = [apps.get_model(label) for label in models]
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+            for model in targets:
+                if not issubclass(model, BaseDebtRecord):
+                    raise CommandError(
+                        'Model %s is not a debt model.' % model._meta.label
+                    )
+        else:
+            targets = [
+                model for model in apps.get_models()
+                if issubclass(model, BaseDebtRecord)
+                and get_archive_model(model) is not None
+            ]
+
+        for model in targets:
+            try:
+                debts, payments, splits = archive_fully_matched(model, cutoff)
+            except (TypeError, ValueError) as e:
+                raise CommandError(str(e))
+            self.stdout.write(
+                '%s: archived %d debt(s), %d payment(s) and %d split(s).'
+                % (model._meta.label, debts, payments, splits)
+            )
@@ -0,0 +1,42 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from double_entry.models import PersistedPaymentTrackingNoMixin
+
+
+class Command(BaseCommand):
+    help = (
+        'Assign stored payment tracking numbers to transaction parties '
+        'that do not have one yet.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*', metavar='app_label.ModelName',
+            help='Restrict the backfill to these models.'
+        )
+
+    def handle(self, *args, models=None, **options):
+        if models:
+            try:
+                targets = [apps.get_model(label) for label in models]
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+            for model in targets:
+                if not issubclass(model, PersistedPaymentTrackingNoMixin):
+                    raise CommandError(
+                        'Model %s does not store payment tracking numbers.'
+                        % model._meta.label
+                    )
+        else:
+            targets = [
+                model for model in apps.get_models()
+                if issubclass(model, PersistedPaymentTrackingNoMixin)
+            ]
+
+        for model in targets:
+            filled = model._default_manager.all().fill_payment_tracking_nos()
+            self.stdout.write(
+                '%s: %d payment tracking number(s) assigned.'
+                % (model._meta.label, filled)
+            )
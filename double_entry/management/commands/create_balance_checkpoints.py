@@ -0,0 +1,64 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from double_entry.models import BaseBalanceCheckpoint
+from double_entry.utils import _dt_fallback
+
+
+class Command(BaseCommand):
+    help = (
+        'Record balance checkpoints for all transaction parties, '
+        'to speed up as-of balance queries.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*', metavar='app_label.ModelName',
+            help='Restrict to these checkpoint models.'
+        )
+        parser.add_argument(
+            '--as-of', dest='as_of',
+            help=(
+                'Timestamp of the checkpoints (ISO format). A date is taken '
+                'to mean the end of that day. Defaults to the current time.'
+            )
+        )
+
+    def handle(self, *args, models=None, as_of=None, **options):
+        if as_of is None:
+            as_of_ts = timezone.now()
+        else:
+            as_of_ts = parse_datetime(as_of)
+            if as_of_ts is None:
+                as_of_date = parse_date(as_of)
+                if as_of_date is None:
+                    raise CommandError('Could not parse date %s.' % as_of)
+                as_of_ts = _dt_fallback(as_of_date, use_max=True)
+            else:
+                as_of_ts = _dt_fallback(as_of_ts)
+
+        if models:
+            try:
+                targets = [apps.get_model(label) for label in models]
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+            for model in targets:
+                if not issubclass(model, BaseBalanceCheckpoint):
+                    raise CommandError(
+                        'Model %s is not a balance checkpoint model.'
+                        % model._meta.label
+                    )
+        else:
+            targets = [
+                model for model in apps.get_models()
+                if issubclass(model, BaseBalanceCheckpoint)
+            ]
+
+        for model in targets:
+            created = model.create_checkpoints(as_of_ts)
+            self.stdout.write(
+                '%s: %d checkpoint(s) created at %s.'
+                % (model._meta.label, created, as_of_ts.isoformat())
+            )
@@ -0,0 +1,41 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from double_entry.models import PersistedBalanceMixin
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the persisted matched balances of ledger entries '
+        'from the split tables.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*', metavar='app_label.ModelName',
+            help='Restrict the rebuild to these models.'
+        )
+
+    def handle(self, *args, models=None, **options):
+        if models:
+            try:
+                targets = [apps.get_model(label) for label in models]
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+            for model in targets:
+                if not issubclass(model, PersistedBalanceMixin):
+                    raise CommandError(
+                        'Model %s does not persist its balances.'
+                        % model._meta.label
+                    )
+        else:
+            targets = [
+                model for model in apps.get_models()
+                if issubclass(model, PersistedBalanceMixin)
+            ]
+
+        for model in targets:
+            stale = model._default_manager.all().refresh_persisted_balances()
+            self.stdout.write(
+                '%s: %d stale row(s) updated.' % (model._meta.label, stale)
+            )
@@ -0,0 +1,50 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import NotSupportedError
+
+from double_entry.models import TransactionPartyMixin
+from double_entry.reconciliation import reconcile_in_database
+
+
+class Command(BaseCommand):
+    help = (
+        'Apportion the remaining credit of transaction parties to their '
+        'open debts (FIFO), in the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*', metavar='app_label.ModelName',
+            help='Restrict to these transaction party models.'
+        )
+        parser.add_argument(
+            '--party', dest='parties', action='append', metavar='PK',
+            help='Restrict to the transaction party with this primary key.'
+        )
+
+    def handle(self, *args, models=None, parties=None, **options):
+        if models:
+            try:
+                targets = [apps.get_model(label) for label in models]
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+            for model in targets:
+                if not issubclass(model, TransactionPartyMixin):
+                    raise CommandError(
+                        'Model %s is not a transaction party model.'
+                        % model._meta.label
+                    )
+        else:
+            targets = [
+                model for model in apps.get_models()
+                if issubclass(model, TransactionPartyMixin)
+            ]
+
+        for model in targets:
+            try:
+                created = reconcile_in_database(model, parties=parties)
+            except (TypeError, NotSupportedError) as e:
+                raise CommandError(str(e))
+            self.stdout.write(
+                '%s: created %d split(s).' % (model._meta.label, created)
+            )
@@ -0,0 +1,145 @@
+import os
+from collections import OrderedDict, defaultdict
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connections, migrations, models, router
+from django.db.migrations.autodetector import MigrationAutodetector
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+
+from double_entry.models import (
+    DoubleBookModel, BaseTransactionSplit, TransactionPartyMixin,
+    BaseBalanceCheckpoint,
+)
+
+
+def required_indexes():
+    """
+    Yield (model, field names, reason) for every index that the query
+    patterns of the library rely on, for all installed concrete models.
+    """
+    for model in apps.get_models():
+        if model._meta.proxy:
+            continue
+        if issubclass(model, DoubleBookModel):
+            yield model, ('timestamp',), 'duplicate check window'
+        elif issubclass(model, BaseTransactionSplit):
+            fk_1, fk_2 = model.get_double_book_models().keys()
+            yield model, (fk_1, fk_2), 'split lookups'
+        elif issubclass(model, BaseBalanceCheckpoint):
+            yield model, (model.get_party_fk(), 'timestamp'), \
+                'latest checkpoint lookups'
+        elif issubclass(model, TransactionPartyMixin):
+            debt_model = model.get_debt_model()
+            payment_model = model.get_payment_model()
+            yield debt_model, (model.get_debt_remote_fk(), 'timestamp'), \
+                'ledger of %s' % model._meta.label
+            yield payment_model, \
+                (model.get_payment_remote_fk(), 'timestamp'), \
+                'ledger of %s' % model._meta.label
+
+
+def existing_indexes(model):
+    """
+    Return the column lists of all indexes on the table of the given model.
+    """
+    connection = connections[router.db_for_write(model)]
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(
+            cursor, model._meta.db_table
+        )
+    return [
+        c['columns'] for c in constraints.values()
+        if c['index'] or c['unique'] or c['primary_key']
+    ]
+
+
+def is_covered(columns, indexes):
+    # an index covers the columns if they form a prefix of it
+    columns = list(columns)
+    return any(
+        list(index_columns[:len(columns)]) == columns
+        for index_columns in indexes
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Report indexes that the double entry query patterns rely on, '
+        'and that are missing from the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--emit-migration', action='store_true', dest='emit_migration',
+            help='Write a migration adding the missing indexes.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run',
+            help='Print the migration instead of writing it.'
+        )
+
+    def handle(self, *args, emit_migration=False, dry_run=False, **options):
+        missing = OrderedDict()
+        seen = set()
+        for model, field_names, reason in required_indexes():
+            if (model, field_names) in seen:
+                continue
+            seen.add((model, field_names))
+            columns = [
+                model._meta.get_field(name).column for name in field_names
+            ]
+            label = '%s (%s)' % (model._meta.label, ', '.join(columns))
+            if is_covered(columns, existing_indexes(model)):
+                self.stdout.write('OK: %s' % label)
+            else:
+                self.stdout.write('MISSING: %s, for %s' % (label, reason))
+                missing[(model, field_names)] = reason
+
+        if not missing:
+            self.stdout.write('No missing indexes.')
+            return
+        if emit_migration:
+            self.write_migrations(missing, dry_run)
+
+    def write_migrations(self, missing, dry_run):
+        by_app = defaultdict(list)
+        for model, field_names in missing:
+            index = models.Index(fields=list(field_names), name='')
+            index.set_name_with_model(model)
+            by_app[model._meta.app_label].append(
+                migrations.AddIndex(
+                    model_name=model._meta.model_name, index=index
+                )
+            )
+
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        for app_label, index_operations in by_app.items():
+            # only touch the database, the migration state of the
+            # models should keep matching their Meta
+            operations = [
+                migrations.SeparateDatabaseAndState(
+                    database_operations=index_operations
+                )
+            ]
+            leaves = loader.graph.leaf_nodes(app_label)
+            if leaves:
+                number = MigrationAutodetector.parse_number(leaves[-1][1])
+                number = (number or 0) + 1
+            else:
+                number = 1
+            migration = migrations.Migration(
+                '%04d_ledger_indexes' % number, app_label
+            )
+            migration.dependencies = leaves
+            migration.operations = operations
+            writer = MigrationWriter(migration)
+            if dry_run:
+                self.stdout.write(writer.as_string())
+                continue
+            with open(writer.path, 'w', encoding='utf-8') as f:
+                f.write(writer.as_string())
+            self.stdout.write(
+                'Wrote %s' % os.path.relpath(writer.path)
+            )
@@ -1,16 +1,24 @@
+import dataclasses
 import logging
 import datetime
+import hashlib
+import heapq
+import inspect
+import secrets
 from decimal import Decimal
 from collections import defaultdict, namedtuple
 from typing import Type, Tuple, cast, Optional
 
-from django.db import models
+from django.apps import apps
+from django.db import models, transaction, IntegrityError, connections, router
 from django.db.models import (
-    F, Sum, Case, When, Subquery, OuterRef,
+    F, Sum, Case, When, Subquery, OuterRef, Exists,
     Value, ExpressionWrapper,
-    Max, Prefetch,
+    Max, Prefetch, Count, Q, Expression,
 )
-from django.db.models.functions import Coalesce
+from django.db.models.sql.constants import INNER, LOUTER
+from django.db.models.functions import Coalesce, TruncDate, Greatest, Least
+from django.core.exceptions import FieldDoesNotExist, FieldError
 from django.forms import ValidationError
 from django.utils import timezone
 from django.utils.functional import cached_property
@@ -24,14 +32,22 @@ from djmoney.money import Money
 
 from double_entry.utils import (
     validated_bulk_query, make_token,
-    decimal_to_money, parse_ogm, ogm_from_prefix,
+    decimal_to_money, parse_ogm, ogm_from_prefix, iterate_by_pk,
+    supports_window_functions,
 )
+from double_entry.fallbacks import report_fallback
+from double_entry.registry import (
+    DoubleBookMetadata, SplitMetadata, TransactionPartyMetadata, get_metadata,
+)
+from double_entry.routers import replica_alias_for_read
 
 __all__ = [
     'DoubleBookModel', 'ConcreteAmountMixin', 'BaseDebtRecord',
     'BasePaymentRecord', 'BaseDebtQuerySet', 'BasePaymentQuerySet',
     'BaseTransactionSplit', 'DoubleBookQuerySet', 'nonzero_money_validator',
-    'GnuCashCategory'
+    'GnuCashCategory', 'PersistedBalanceMixin', 'DupcheckSignatureHashMixin',
+    'PersistedPaymentTrackingNoMixin', 'BaseBalanceCheckpoint',
+    'StatementLine', 'DoubleBookManager',
 ]
 
 logger = logging.getLogger(__name__)
@@ -81,6 +97,19 @@ def nonzero_money_validator(money):
         )
 
 
+class _SplitManagerName:
+    """
+    Default value of DoubleBookInterface.split_manager_name: reads the
+    reflected name from the ledger registry. Subclasses override it by
+    setting split_manager_name to the name of the split relation.
+    """
+
+    def __get__(self, instance, owner):
+        if owner._meta.abstract:
+            return None
+        return owner.get_split_manager_name()
+
+
 class DoubleBookInterface(models.Model):
     """
     One half of a ledger in a double-entry accounting system.
@@ -100,10 +129,13 @@ class DoubleBookInterface(models.Model):
         'but attempted to match %(amount)s.'
     )
 
-    split_manager_name = None
-    _split_model = None
-    _remote_target_field = None
-    _other_half_model = None
+    # name of the reverse relation to the split model, found through
+    # reflection if not set
+    split_manager_name = _SplitManagerName()
+
+    # Model (or 'app_label.ModelName') holding archived entries, see
+    # double_entry.archive
+    archive_model = None
 
     timestamp: datetime
     processed: datetime
@@ -112,17 +144,29 @@ class DoubleBookInterface(models.Model):
     class Meta:
         abstract = True
 
-    # We cannot use __init_subclas__ since we need access to the app's model
-    #  registry, which isn't avaiable at that point
-    # TODO: figure out if we can hook into the app registry preparation to
-    #  call this method at some fixed point in the process, so we don't have
-    #  to deal with ensuring it gets called in all accessor methods
-    #  same with TransactionPartyMixin
     @classmethod
-    def _prepare_split_metadata(cls):
+    def get_total_amount_annotations(cls) -> dict:
+        """
+        Annotations computing TOTAL_AMOUNT_FIELD_COLUMN, for models where
+        the total amount is not stored in a column. These are applied by
+        DoubleBookQuerySet.with_total_amount(), which all ledger querysets
+        of this library call before touching the total amount.
+        Annotations are applied in order, so later ones may refer to
+        earlier ones.
+        """
+        return {}
+
+    @classmethod
+    def has_computed_total_amount(cls) -> bool:
+        return bool(cls.get_total_amount_annotations())
+
+    @classmethod
+    def _reflect_ledger_metadata(cls) -> DoubleBookMetadata:
         """
         Find the split relation to use through reflection.
-        """ 
+        This is done once for all installed models when the app registry
+        is ready, see double_entry.registry.
+        """
         def get_fks_on_split(split_model):
             return [
                 f for f in split_model._meta.get_fields()
@@ -147,7 +191,8 @@ class DoubleBookInterface(models.Model):
             )
             return doublebook_fk_count == doublebook_fk_model_count == 2
 
-        if cls.split_manager_name is None:
+        override = inspect.getattr_static(cls, 'split_manager_name')
+        if isinstance(override, _SplitManagerName):
             candidates = [
                 f for f in cls._meta.get_fields() if is_candidate(f)
             ]
@@ -164,38 +209,47 @@ class DoubleBookInterface(models.Model):
                     )
                 )
             split_rel = candidates[0]
-            cls.split_manager_name = split_rel.name
         else:
-            split_rel = cls._meta.get_field(cls.split_manager_name)
+            split_rel = cls._meta.get_field(override)
 
-        cls._split_model = split_rel.related_model
-        cls._remote_target_field = split_rel.remote_field.name
-        
+        split_model = split_rel.related_model
         # the is_candidate condition guarantees that this works
-        split_fk_1, split_fk_2 = get_fks_on_split(cls._split_model)
+        split_fk_1, split_fk_2 = get_fks_on_split(split_model)
         if issubclass(cls, split_fk_1.related_model):
-            cls._other_half_model = split_fk_2.related_model
+            other_half_model = split_fk_2.related_model
         else:
-            cls._other_half_model = split_fk_1.related_model
+            other_half_model = split_fk_1.related_model
+        return DoubleBookMetadata(
+            split_model=split_model,
+            split_manager_name=split_rel.name,
+            remote_target_field=split_rel.remote_field.name,
+            other_half_model=other_half_model
+        )
+
+    @classmethod
+    def get_ledger_metadata(cls) -> DoubleBookMetadata:
+        metadata = get_metadata(cls)
+        if metadata is None:
+            # the registry isn't ready yet
+            metadata = cls._reflect_ledger_metadata()
+        return metadata
 
     @classmethod
     def get_split_model(cls) -> Tuple[Type['BaseTransactionSplit'], str]:
-        if cls._split_model is None:
-            cls._prepare_split_metadata()
-        return cls._split_model, cls._remote_target_field
+        metadata = cls.get_ledger_metadata()
+        return metadata.split_model, metadata.remote_target_field
 
     @classmethod
     def get_other_half_model(cls) -> Type['DoubleBookInterface']:
-        if cls._other_half_model is None:
-            cls._prepare_split_metadata()
-        return cls._other_half_model
+        return cls.get_ledger_metadata().other_half_model
+
+    @classmethod
+    def get_split_manager_name(cls) -> str:
+        return cls.get_ledger_metadata().split_manager_name
 
     @property
     def split_manager(self):
-        cls = self.__class__
-        if cls.split_manager_name is None:
-            cls._prepare_split_metadata()
-        return getattr(self, cls.split_manager_name)
+        return getattr(self, self.__class__.get_split_manager_name())
 
     @cached_property
     def matched_balance(self):
@@ -209,16 +263,7 @@ class DoubleBookInterface(models.Model):
             # same should apply.
             if self.pk is None:
                 return decimal_to_money(Decimal('0.00'))
-            logger.debug(
-                'PERFORMANCE WARNING: '
-                'falling back to database deluge '
-                'for matched_balance computation. '
-                'Please review queryset usage. '
-                'Object of type %(model)s with id %(pk)s', 
-                {'model': self.__class__, 'pk': self.pk}
-            )
-            import traceback
-            logger.debug(''.join(traceback.format_stack()))
+            report_fallback('matched_balance', self)
             splits = self.split_manager
             return decimal_to_money(
                 splits.aggregate(
@@ -235,16 +280,7 @@ class DoubleBookInterface(models.Model):
         except AttributeError:
             if not self.fully_matched:
                 return None
-            logger.debug(
-                'PERFORMANCE WARNING: '
-                'falling back to database deluge '
-                'for fully_matched_date computation. '
-                'Please review queryset usage. '
-                'Object of type %(model)s with id %(pk)s',
-                {'model': self.__class__, 'pk': self.pk}
-            )
-            import traceback
-            logger.debug(''.join(traceback.format_stack()))
+            report_fallback('fully_matched_date', self)
             other_half = self.get_other_half_model()
             split_model, other_half_fk = other_half.get_split_model()
             return self.split_manager.aggregate(
@@ -319,6 +355,105 @@ class DoubleBookModel(DoubleBookInterface):
     class Meta:
         abstract = True
 
+    @classmethod
+    def _reflect_balance_checkpoint_targets(cls):
+        targets = []
+        for party_model in apps.get_models():
+            if not issubclass(party_model, TransactionPartyMixin):
+                continue
+            checkpoint_model, checkpoint_fk = \
+                party_model.get_balance_checkpoint_model()
+            if checkpoint_model is None:
+                continue
+            if issubclass(cls, party_model.get_debt_model()):
+                entry_fk = party_model.get_debt_remote_fk()
+            elif issubclass(cls, party_model.get_payment_model()):
+                entry_fk = party_model.get_payment_remote_fk()
+            else:
+                continue
+            targets.append((
+                checkpoint_model, checkpoint_fk,
+                cls._meta.get_field(entry_fk).attname
+            ))
+        return tuple(targets)
+
+    @classmethod
+    def get_balance_checkpoint_targets(cls):
+        """
+        Find the checkpoint models of the transaction parties that this
+        model is a ledger entry of. Returns a tuple of (checkpoint model,
+        name of its party foreign key, attname of the party foreign key on
+        this model).
+        """
+        metadata = get_metadata(cls)
+        if metadata is None:
+            # the registry isn't ready yet
+            return cls._reflect_balance_checkpoint_targets()
+        return metadata.balance_checkpoint_targets
+
+    @classmethod
+    def invalidate_balance_checkpoints_for(cls, changes, using=None):
+        """
+        Delete the balance checkpoints made obsolete by changes to ledger
+        entries of this model, see BaseBalanceCheckpoint.
+        changes is an iterable of (entry, timestamp) pairs, where timestamp
+        is the earliest point in time affected by the change.
+        using is the database the entries were written to.
+        This is a no-op if the transaction parties of this model don't
+        have a checkpoint model.
+        """
+        targets = cls.get_balance_checkpoint_targets()
+        if not targets:
+            return
+        changes = list(changes)
+        for checkpoint_model, checkpoint_fk, attname in targets:
+            earliest = {}
+            for entry, timestamp in changes:
+                party_id = getattr(entry, attname)
+                if party_id is None or timestamp is None:
+                    continue
+                if party_id not in earliest or timestamp < earliest[party_id]:
+                    earliest[party_id] = timestamp
+            checkpoint_model.invalidate(earliest, checkpoint_fk, using=using)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'timestamp' in field_names:
+            instance._loaded_timestamp = instance.timestamp
+        return instance
+
+    def save(self, **kwargs):
+        changes = []
+        update_fields = kwargs.get('update_fields')
+        moved = update_fields is None or 'timestamp' in update_fields
+        if self.__class__.get_balance_checkpoint_targets():
+            changes.append((self, self.timestamp))
+            if moved and self.pk is not None and not self._state.adding:
+                # the entry may have been moved to a later point in time
+                try:
+                    old = self._loaded_timestamp
+                except AttributeError:
+                    old = self.__class__._base_manager\
+                        .db_manager(kwargs.get('using', self._state.db))\
+                        .filter(pk=self.pk)\
+                        .values_list('timestamp', flat=True).first()
+                changes.append((self, old))
+        super().save(**kwargs)
+        if moved:
+            self._loaded_timestamp = self.timestamp
+        self.__class__.invalidate_balance_checkpoints_for(
+            changes, using=self._state.db
+        )
+
+    def delete(self, **kwargs):
+        using = self._state.db
+        result = super().delete(**kwargs)
+        self.__class__.invalidate_balance_checkpoints_for(
+            [(self, self.timestamp)], using=using
+        )
+        return result
+
 class DuplicationProtectionMixin(DoubleBookInterface):
     """
     Specify fields to be used in the duplicate checker on bulk imports.
@@ -331,12 +466,13 @@ class DuplicationProtectionMixin(DoubleBookInterface):
     class Meta:
         abstract = True
 
-    @property
-    def dupcheck_signature(self):
-        cls = self.__class__
-        if cls.dupcheck_signature_fields is None:
-            return None
-
+    @classmethod
+    def get_dupcheck_signature_type(cls):
+        """
+        Return the namedtuple type used for duplication signatures on this
+        model, together with the (column) names of the extra signature
+        fields.
+        """
         if cls.__dupcheck_signature_nt is None:
             # translates foreign keys to the fieldname_id format,
             # which is better for comparisons
@@ -345,13 +481,21 @@ class DuplicationProtectionMixin(DoubleBookInterface):
                 for fname in cls.dupcheck_signature_fields
             )
             cls.__dupcheck_signature_nt = namedtuple(
-                self.__class__.__name__ + 'DuplicationSignature',
+                cls.__name__ + 'DuplicationSignature',
                 ['date', 'amount'] + sig_fields
             )
             cls.__dupcheck_sig_fields = sig_fields
+        return cls.__dupcheck_signature_nt, cls.__dupcheck_sig_fields
+
+    @property
+    def dupcheck_signature(self):
+        cls = self.__class__
+        if cls.dupcheck_signature_fields is None:
+            return None
 
+        sig_type, sig_fields = cls.get_dupcheck_signature_type()
         sig_kwargs = {
-            field: getattr(self, field) for field in cls.__dupcheck_sig_fields
+            field: getattr(self, field) for field in sig_fields
         }
         # Problem: the resolution of most banks' reporting is a day.
         # Hence, we cannot use an exact timestamp as a cutoff point between
@@ -366,7 +510,160 @@ class DuplicationProtectionMixin(DoubleBookInterface):
             date = self.timestamp.date()
         sig_kwargs['date'] = date
         sig_kwargs['amount'] = self.total_amount.amount
-        return cls.__dupcheck_signature_nt(**sig_kwargs)
+        return sig_type(**sig_kwargs)
+
+
+class DupcheckSignatureHashMixin(DuplicationProtectionMixin):
+    """
+    Store a hash of the duplication signature in an indexed column,
+    so that the duplicate checker can look up the signatures of an
+    incoming batch directly, instead of scanning a window of history.
+    The hash is computed on save() and on bulk_create() through a
+    DuplicationProtectedQuerySet.
+    Timestamps read back from the database have lost the offset they were
+    submitted with, so the hashed signature uses the date in UTC instead,
+    or in the server timezone if TRANSACTION_DUPCHECK_SERVER_TZ is set
+    (see dupcheck_hash_signature). If that setting changes, stored hashes
+    can be recomputed with refresh_dupcheck_sig_hashes() on the queryset.
+    """
+
+    dupcheck_sig_hash = models.CharField(
+        max_length=64,
+        editable=False,
+        db_index=True,
+        blank=True,
+    )
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def hash_dupcheck_signature(cls, signature):
+        """
+        Hash a signature as returned by dupcheck_hash_signature.
+        """
+        # normalise amounts, the database may return more decimal places
+        parts = [
+            signature.date.isoformat(),
+            str(signature.amount.normalize())
+        ]
+        parts.extend(str(value) for value in signature[2:])
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+    @property
+    def dupcheck_hash_signature(self):
+        """
+        The duplication signature of this entry, with the date computed in
+        a way that doesn't depend on the offset of the timestamp.
+        """
+        signature = self.dupcheck_signature
+        if not settings.USE_TZ or timezone.is_naive(self.timestamp):
+            return signature
+        if getattr(settings, 'TRANSACTION_DUPCHECK_SERVER_TZ', False):
+            date = timezone.localdate(self.timestamp)
+        else:
+            date = self.timestamp.astimezone(datetime.timezone.utc).date()
+        return signature._replace(date=date)
+
+    def refresh_dupcheck_sig_hash(self):
+        self.dupcheck_sig_hash = self.hash_dupcheck_signature(
+            self.dupcheck_hash_signature
+        )
+
+    def save(self, **kwargs):
+        self.refresh_dupcheck_sig_hash()
+        super().save(**kwargs)
+
+
+class PersistedBalanceMixin(DoubleBookInterface):
+    """
+    Opt-in denormalisation of the matched balance of a ledger entry.
+    The split write paths (split saves/deletes and bulk_create on split
+    querysets) and saves of the entry itself keep these columns up to
+    date, so that balance filters can be evaluated as plain (indexed)
+    column predicates.
+    Writes that bypass those paths (e.g. queryset updates on splits or
+    entries) can be repaired with the rebuild_ledger_balances management
+    command.
+    """
+
+    PERSISTED_BALANCE_FIELDS = ('matched_amount', 'is_fully_matched')
+
+    matched_amount = models.DecimalField(
+        verbose_name=_('matched amount'),
+        decimal_places=getattr(settings, 'CURRENCY_DECIMAL_PLACES', 4),
+        max_digits=getattr(settings, 'CURRENCY_MAX_DIGITS', 19),
+        default=Decimal('0.00'),
+        editable=False
+    )
+
+    is_fully_matched = models.BooleanField(
+        verbose_name=_('fully matched'),
+        default=False,
+        editable=False,
+        db_index=True
+    )
+
+    class Meta:
+        abstract = True
+
+    @cached_property
+    def matched_balance(self):
+        try:
+            return decimal_to_money(
+                getattr(self, DoubleBookQuerySet.MATCHED_BALANCE_FIELD)
+            )
+        except AttributeError:
+            return decimal_to_money(self.matched_amount)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_total_amount = instance._stored_total_amount()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        if fields is None or self.TOTAL_AMOUNT_FIELD_COLUMN in fields:
+            self._loaded_total_amount = self._stored_total_amount()
+
+    def _stored_total_amount(self):
+        # the total amount if it is a (loaded) column of this model,
+        # None if it is computed
+        try:
+            field = self._meta.get_field(self.TOTAL_AMOUNT_FIELD_COLUMN)
+        except FieldDoesNotExist:
+            return None
+        if field.attname in self.get_deferred_fields():
+            return None
+        return getattr(self, field.attname)
+
+    def save(self, **kwargs):
+        total = self._stored_total_amount()
+        adding = self._state.adding
+        if adding and total is not None:
+            # a new entry can't have any splits yet, use the same
+            # criterion as refresh_persisted_balances
+            self.matched_amount = Decimal('0.00')
+            self.is_fully_matched = getattr(total, 'amount', total) <= 0
+        super().save(**kwargs)
+        fields = PersistedBalanceMixin.PERSISTED_BALANCE_FIELDS
+        update_fields = kwargs.get('update_fields')
+        if total is not None:
+            unchanged = adding or (
+                update_fields is not None
+                and self.TOTAL_AMOUNT_FIELD_COLUMN not in update_fields
+            ) or getattr(self, '_loaded_total_amount', None) == total
+            self._loaded_total_amount = total
+            if unchanged:
+                return
+        elif update_fields is not None and set(update_fields) <= set(fields):
+            return
+        stale = self.__class__._default_manager.db_manager(self._state.db)\
+            .filter(pk=self.pk).refresh_persisted_balances()
+        if stale:
+            self.refresh_from_db(fields=fields)
+            self.__dict__.pop('matched_balance', None)
 
 
 class ConcreteAmountMixin(models.Model):
@@ -390,6 +687,165 @@ class ConcreteAmountMixin(models.Model):
             )
 
 
+class GroupedSumJoin:
+    """
+    LEFT OUTER JOIN of a derived table that sums a column over the rows of
+    a (possibly grouped) subquery per value of its key column, on
+    key = parent_column of the parent table. See JoinedSubquerySum.
+    This implements the alias_map interface documented on
+    django.db.models.sql.datastructures.Join.
+    """
+    template = (
+        '%(join_type)s (SELECT %(key)s, SUM(%(column)s) AS %(column)s '
+        'FROM (%(subquery)s) %(inner_alias)s GROUP BY %(key)s) %(alias)s '
+        'ON (%(parent_alias)s.%(parent_column)s = %(alias)s.%(key)s)'
+    )
+    filtered_relation = None
+
+    def __init__(self, query, column, key, parent_alias, parent_column,
+                 table_name='grouped_sum', table_alias=None,
+                 join_type=LOUTER, nullable=True):
+        self.query = query
+        self.column = column
+        self.key = key
+        self.parent_alias = parent_alias
+        self.parent_column = parent_column
+        # only used to generate the alias
+        self.table_name = table_name
+        self.table_alias = table_alias
+        self.join_type = join_type
+        self.nullable = nullable
+
+    def as_sql(self, compiler, connection):
+        qn = connection.ops.quote_name
+        subquery, params = self.query.get_compiler(
+            connection=connection
+        ).as_sql()
+        return self.template % {
+            'join_type': self.join_type,
+            'key': qn(self.key),
+            'column': qn(self.column),
+            'subquery': subquery,
+            'inner_alias': qn('subquery_sum'),
+            'alias': qn(self.table_alias),
+            'parent_alias': compiler.quote_name_unless_alias(
+                self.parent_alias
+            ),
+            'parent_column': qn(self.parent_column),
+        }, params
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(
+            self.query, self.column, self.key,
+            change_map.get(self.parent_alias, self.parent_alias),
+            self.parent_column, self.table_name,
+            change_map.get(self.table_alias, self.table_alias),
+            self.join_type, self.nullable
+        )
+
+    @property
+    def identity(self):
+        return (
+            self.__class__, self.query, self.column, self.key,
+            self.parent_alias, self.parent_column
+        )
+
+    def equals(self, other, with_filtered_relation=True):
+        return isinstance(other, GroupedSumJoin) \
+            and self.identity == other.identity
+
+    def __eq__(self, other):
+        return self.equals(other)
+
+    def __hash__(self):
+        return hash(self.identity)
+
+    def demote(self):
+        new = self.relabeled_clone({})
+        new.join_type = INNER
+        return new
+
+    def promote(self):
+        new = self.relabeled_clone({})
+        new.join_type = LOUTER
+        return new
+
+
+class JoinedColumn(Expression):
+    """
+    A column of a joined table that isn't backed by a model field,
+    see JoinedSubquerySum.
+    """
+
+    def __init__(self, alias, column, output_field=None):
+        self.alias = alias
+        self.column = column
+        super().__init__(output_field=output_field)
+
+    def as_sql(self, compiler, connection):
+        qn = connection.ops.quote_name
+        return '%s.%s' % (qn(self.alias), qn(self.column)), []
+
+    def relabeled_clone(self, change_map):
+        return self.__class__(
+            change_map.get(self.alias, self.alias), self.column,
+            self.output_field
+        )
+
+
+class JoinedSubquerySum(Expression):
+    """
+    Sum a column over the rows of a (possibly grouped) subquery per value
+    of its key column, and match the sums with the outer rows through
+    parent_column (the primary key by default).
+    Unlike SubquerySum, the subquery isn't correlated with the outer query:
+    it is evaluated once, as a derived table joined to the outer query.
+    Outer rows without a match are NULL, or dropped if nullable is False.
+    """
+
+    def __init__(self, queryset, column, key, parent_column=None,
+                 table_name='grouped_sum', nullable=True, output_field=None):
+        self.queryset = queryset
+        self.column = column
+        self.key = key
+        self.parent_column = parent_column
+        self.table_name = table_name
+        self.nullable = nullable
+        super().__init__(output_field=output_field)
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None,
+                           summarize=False, for_save=False):
+        if not allow_joins:
+            raise FieldError('Joined sums are not allowed in this query.')
+        parent_column = self.parent_column or query.model._meta.pk.column
+        alias = query.join(GroupedSumJoin(
+            self.queryset.query, self.column, self.key,
+            query.get_initial_alias(), parent_column, self.table_name,
+            nullable=self.nullable
+        ))
+        return JoinedColumn(alias, self.column, self._output_field_or_none)
+
+
+class SubquerySum(Subquery):
+    """
+    Sum a column over the rows of a (possibly grouped) subquery.
+    The ORM doesn't allow aggregates over aggregates, so this wraps the
+    subquery in a derived table.
+    """
+    template = '(SELECT SUM(%(column)s) FROM (%(subquery)s) %(alias)s)'
+
+    def __init__(self, queryset, column, output_field=None, **extra):
+        self.column = column
+        super().__init__(queryset, output_field=output_field, **extra)
+
+    def as_sql(self, compiler, connection, template=None, **extra_context):
+        qn = connection.ops.quote_name
+        return super().as_sql(
+            compiler, connection, template, column=qn(self.column),
+            alias=qn('subquery_sum'), **extra_context
+        )
+
+
 # Conventions: 
 #  matched balance: sum of all splits
 #  unmatched balance: whatever remains 
@@ -402,19 +858,56 @@ class DoubleBookQuerySet(models.QuerySet):
     UNMATCHED_BALANCE_FIELD = 'unmatched_balance_fromdb' 
     FULLY_MATCHED_FIELD = 'fully_matched_fromdb'
     FULLY_MATCHED_DATE_FIELD = 'fully_matched_date_fromdb'
+    CLAMPED_BALANCE_FIELD = 'clamped_balance_fromdb'
+
+    def with_total_amount(self):
+        """
+        Apply the total amount annotations registered on the model,
+        see DoubleBookInterface.get_total_amount_annotations.
+        """
+        annotations = self.model.get_total_amount_annotations()
+        if not annotations \
+                or self.model.TOTAL_AMOUNT_FIELD_COLUMN \
+                in self.query.annotations:
+            return self
+        return self.annotate(**annotations)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        # objs may be a generator
+        objs = list(objs)
+        result = super().bulk_create(objs, *args, **kwargs)
+        self.model.invalidate_balance_checkpoints_for(
+            ((obj, obj.timestamp) for obj in objs), using=self.db
+        )
+        return result
 
-    def _split_sum_subquery(self):
+    def on_replica(self):
+        """
+        Read from the configured replica database, see double_entry.routers.
+        """
+        alias = replica_alias_for_read()
+        return self if alias is None else self.using(alias)
+
+    def _split_sum_subquery(self, as_of=None):
         """
         Compute the sum over all transaction splits for each row
         via a subquery (no joins, so suitable for multiple qs annotations).
+        If as_of is given, only splits that were in effect at that point
+        in time are taken into account.
         The final output will be a DecimalField.
         """
         # The pattern used here is from
         # https://docs.djangoproject.com/en/2.1ref/models/expressions/
         split_model, join_on = self.model.get_split_model()
-        subq = split_model._default_manager.filter(**{
+        split_qs = split_model._default_manager.filter(**{
             join_on: OuterRef('pk')
-        }).order_by().values(join_on).annotate(
+        })
+        if as_of is not None:
+            split_qs = split_qs.with_effective_timestamp().filter(**{
+                TransactionSplitQuerySet.EFFECTIVE_TIMESTAMP_FIELD + '__lte':
+                    as_of
+            })
+        subq = split_qs.order_by().values(join_on).annotate(
             _split_total=Sum('amount')
         ).values('_split_total')
         return Coalesce(
@@ -423,16 +916,72 @@ class DoubleBookQuerySet(models.QuerySet):
             output_field=models.DecimalField()
         )
 
-    def with_remote_accounts(self):
+    def _clamped_balances(self, *fields):
+        """
+        Return the balance of every ledger entry in this queryset, together
+        with the given fields, as a values() queryset. The splits are summed
+        in one grouped join rather than a correlated subquery per entry, and
+        entries that are matched beyond their total amount count as zero.
+        """
+        total_amount_field_name = self.model.TOTAL_AMOUNT_FIELD_COLUMN
+        if issubclass(self.model, PersistedBalanceMixin):
+            matched = F('matched_amount')
+        else:
+            matched = Coalesce(
+                Sum(self.model.get_split_manager_name() + '__amount'),
+                Value(Decimal('0.00')),
+                output_field=models.DecimalField()
+            )
+        return self.with_total_amount().order_by().values(
+            'pk', *fields
+        ).annotate(**{
+            self.__class__.CLAMPED_BALANCE_FIELD: Greatest(
+                ExpressionWrapper(
+                    F(total_amount_field_name) - matched,
+                    output_field=models.DecimalField()
+                ),
+                # a plain integer, SQLite would compare a decimal
+                # parameter as text
+                Value(0),
+                output_field=models.DecimalField()
+            )
+        })
+
+    def with_remote_accounts(self, as_of=None):
+        """
+        Annotate the matched and unmatched balances of each ledger entry.
+        If as_of is given, the balances are computed as they stood at
+        that point in time. A split is considered to be in effect as soon
+        as both ledger entries it connects have been recorded.
+        """
         cls = self.__class__
         # TODO: figure out if this is even necessary
         if cls.FULLY_MATCHED_FIELD in self.query.annotations:
+            if as_of is not None:
+                # the existing annotations may have been computed as of
+                # another point in time (or not as of any point at all)
+                raise ValueError(
+                    'Remote account balances have already been annotated; '
+                    'as_of can only be passed on the first call.'
+                )
             return self
-        # joins don't work for multiple annotations, so 
-        # we have to use a subquery
         total_amount_field_name = self.model.TOTAL_AMOUNT_FIELD_COLUMN
+        qs = self.with_total_amount()
+        persisted = issubclass(self.model, PersistedBalanceMixin)
+        if persisted and as_of is None:
+            # no need to touch the split table at all
+            return qs.annotate(**{
+                cls.MATCHED_BALANCE_FIELD: F('matched_amount'),
+                cls.UNMATCHED_BALANCE_FIELD: ExpressionWrapper(
+                    F(total_amount_field_name) - F('matched_amount'),
+                    output_field=models.DecimalField()
+                ),
+                cls.FULLY_MATCHED_FIELD: F('is_fully_matched'),
+            })
+        # joins don't work for multiple annotations, so
+        # we have to use a subquery
         annotation_kwargs = {
-            cls.MATCHED_BALANCE_FIELD: self._split_sum_subquery(),
+            cls.MATCHED_BALANCE_FIELD: self._split_sum_subquery(as_of=as_of),
             cls.UNMATCHED_BALANCE_FIELD: ExpressionWrapper(
                 F(total_amount_field_name) - F(cls.MATCHED_BALANCE_FIELD),
                 output_field=models.DecimalField()
@@ -458,18 +1007,70 @@ class DoubleBookQuerySet(models.QuerySet):
                 output_field=models.BooleanField()
             ),
         }
-        return self.annotate(**annotation_kwargs)
+        return qs.annotate(**annotation_kwargs)
+
+    def _with_split_aggregates(self):
+        """
+        Compute the split sum and the timestamp of the latest counterpart
+        in one grouped join over the split table, rather than in two
+        correlated subqueries.
+        Since this groups by the ledger entry table, it shouldn't be combined
+        with other aggregates over multi-valued relations.
+        """
+        cls = self.__class__
+        other_half = self.model.get_other_half_model()
+        split_lookup = self.model.get_split_manager_name()
+        __, other_half_fk = other_half.get_split_model()
+        last_counterpart_date = Max(
+            '%s__%s__timestamp' % (split_lookup, other_half_fk)
+        )
+        persisted = issubclass(self.model, PersistedBalanceMixin)
+        if persisted or cls.FULLY_MATCHED_FIELD in self.query.annotations:
+            qs = self.with_remote_accounts()
+        else:
+            total_amount_field_name = self.model.TOTAL_AMOUNT_FIELD_COLUMN
+            qs = self.with_total_amount().annotate(**{
+                cls.MATCHED_BALANCE_FIELD: Coalesce(
+                    Sum(split_lookup + '__amount'),
+                    Value(Decimal('0.00')),
+                    output_field=models.DecimalField()
+                ),
+                cls.UNMATCHED_BALANCE_FIELD: ExpressionWrapper(
+                    F(total_amount_field_name) - F(cls.MATCHED_BALANCE_FIELD),
+                    output_field=models.DecimalField()
+                ),
+                # see with_remote_accounts
+                cls.FULLY_MATCHED_FIELD: Case(
+                    When(**{
+                        total_amount_field_name + '__lte':
+                            F(cls.MATCHED_BALANCE_FIELD),
+                        'then': Value(True)
+                    }),
+                    default=Value(False),
+                    output_field=models.BooleanField()
+                ),
+            })
+        return qs.annotate(**{
+            cls.FULLY_MATCHED_DATE_FIELD: Case(
+                When(**{
+                    cls.FULLY_MATCHED_FIELD: True,
+                    'then': last_counterpart_date,
+                }),
+                default=Value(None),
+                output_field=models.DateTimeField()
+            )
+        })
 
-    def with_fully_matched_date(self):
+    def with_fully_matched_date(self, single_pass=False):
         # Useful e.g. to compute the effective date of payment on a debt
-        # TODO: I assume the db is smart enough to do this more or less
-        #  in tandem with _split_sum_subquery, but is it really that simple?
-        #  Ideally, it would probably be best to do both in the same subquery
-        #  but Django doesn't seem to deal with multi-column subqueries that
-        #  well.
+        # The default strategy uses two correlated subqueries over the split
+        # table (one here, one in with_remote_accounts). Pass single_pass=True
+        # to compute both in one grouped join instead.
         cls = self.__class__
         if cls.FULLY_MATCHED_DATE_FIELD in self.query.annotations:
             return self
+        if single_pass:
+            return self._with_split_aggregates()
         qs = self.with_remote_accounts()
         other_half = self.model.get_other_half_model()
         split_model, join_on = self.model.get_split_model()
@@ -494,6 +1095,38 @@ class DoubleBookQuerySet(models.QuerySet):
             )
         })
 
+    def with_archived(self, *fields, **filters):
+        """
+        Return the given fields of the entries in this queryset, together
+        with those of the archived entries matching the given filters,
+        as a values() queryset. Intended for reporting only: annotations
+        and filters applied to this queryset beforehand do not apply to
+        the archived entries.
+        """
+        from double_entry.archive import get_archive_model
+        archive_model = get_archive_model(self.model)
+        if archive_model is None:
+            raise TypeError('This DoubleBookModel has no archive.')
+        archived = archive_model._default_manager.filter(**filters)
+        return self.filter(**filters).order_by().values(*fields).union(
+            archived.order_by().values(*fields), all=True
+        )
+
+    # rows per query in chunked_iterator
+    iteration_chunk_size = 2000
+
+    def chunked_iterator(self, chunk_size=None):
+        """
+        Iterate over the ledger entries in this queryset with their balances
+        annotated, fetching chunk_size rows at a time by primary key.
+        Unlike iterator(), this keeps prefetches, and memory use does not
+        grow with the size of the table.
+        """
+        return iterate_by_pk(
+            self.with_remote_accounts(),
+            chunk_size or self.iteration_chunk_size
+        )
+
     def unmatched(self):
         return self.with_remote_accounts().filter(**{
             self.__class__.FULLY_MATCHED_FIELD: False
@@ -504,17 +1137,134 @@ class DoubleBookQuerySet(models.QuerySet):
             self.__class__.FULLY_MATCHED_FIELD: True
         })
 
+    def refresh_persisted_balances(self, batch_size=500):
+        """
+        Recompute the persisted balance columns of all entries in this
+        queryset from the split table, and write back the ones that
+        are out of date. Returns the number of rows that were updated.
+        """
+        model = self.model
+        if not issubclass(model, PersistedBalanceMixin):
+            raise TypeError(
+                'Balances are not persisted on this DoubleBookModel.'
+            )
+        places = model._meta.get_field('matched_amount').decimal_places
+        quantum = Decimal(1).scaleb(-places)
+        rows = self.with_total_amount().order_by().annotate(
+            _split_total=self._split_sum_subquery()
+        ).values_list(
+            'pk', model.TOTAL_AMOUNT_FIELD_COLUMN, '_split_total',
+            'matched_amount', 'is_fully_matched'
+        )
+        stale = []
+        for pk, total, matched, old_matched, old_flag in rows.iterator():
+            matched = matched.quantize(quantum)
+            # same criterion as the FULLY_MATCHED_FIELD annotation
+            flag = total is not None and total <= matched
+            if matched != old_matched or flag != old_flag:
+                stale.append(
+                    model(pk=pk, matched_amount=matched, is_fully_matched=flag)
+                )
+        model._base_manager.using(self.db).bulk_update(
+            stale, ['matched_amount', 'is_fully_matched'],
+            batch_size=batch_size
+        )
+        return len(stale)
+
+
+class TruncDateIn(TruncDate):
+    """
+    TruncDate with an explicit time zone instead of the current one.
+    Pass tzname=None for naive datetimes.
+    """
+
+    def __init__(self, expression, tzname=None, **extra):
+        self.dupcheck_tzname = tzname
+        super().__init__(expression, **extra)
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = compiler.compile(self.lhs)
+        sql = connection.ops.datetime_cast_date_sql(lhs, self.dupcheck_tzname)
+        return sql, lhs_params
+
 
 class DuplicationProtectedQuerySet(DoubleBookQuerySet):
 
     model: Type[DuplicationProtectionMixin]
 
+    # number of hashes to look up per query
+    dupcheck_hash_chunk_size = 500
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if issubclass(self.model, DupcheckSignatureHashMixin):
+            objs = list(objs)
+            for obj in objs:
+                obj.refresh_dupcheck_sig_hash()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def dupcheck_buckets_for(self, signatures):
+        """
+        Count the ledger entries in this queryset matching the given
+        duplication signatures, using the stored signature hashes.
+        The signatures should come from dupcheck_hash_signature.
+        Only available on models with DupcheckSignatureHashMixin.
+        """
+        if not issubclass(self.model, DupcheckSignatureHashMixin):
+            raise TypeError(
+                'Signature hashes are not stored on this model.'
+            )
+        by_hash = {
+            self.model.hash_dupcheck_signature(sig): sig
+            for sig in signatures
+        }
+        hashes = list(by_hash.keys())
+        historical_buckets = defaultdict(int)
+        chunk_size = self.dupcheck_hash_chunk_size
+        for i in range(0, len(hashes), chunk_size):
+            rows = self.order_by().filter(
+                dupcheck_sig_hash__in=hashes[i:i + chunk_size]
+            ).values('dupcheck_sig_hash').annotate(
+                _dupcheck_count=Count('pk')
+            ).values_list('dupcheck_sig_hash', '_dupcheck_count')
+            for sig_hash, count in rows:
+                historical_buckets[by_hash[sig_hash]] += count
+        return historical_buckets
+
+    def refresh_dupcheck_sig_hashes(self, batch_size=500):
+        """
+        Recompute the stored signature hashes of all entries in this
+        queryset. Returns the number of rows that were updated.
+        """
+        if not issubclass(self.model, DupcheckSignatureHashMixin):
+            raise TypeError(
+                'Signature hashes are not stored on this model.'
+            )
+        stale = []
+        for entry in self.iterator():
+            old_hash = entry.dupcheck_sig_hash
+            entry.refresh_dupcheck_sig_hash()
+            if entry.dupcheck_sig_hash != old_hash:
+                stale.append(entry)
+        self.model._base_manager.using(self.db).bulk_update(
+            stale, ['dupcheck_sig_hash'], batch_size=batch_size
+        )
+        return len(stale)
+
     # Prepare buckets for duplication check
-    def dupcheck_buckets(self, timestamp_bounds=None):
+    def dupcheck_buckets(self, timestamp_bounds=None, in_database=None):
+        """
+        Count the ledger entries in this queryset by duplication signature.
+        By default, the counting is done with a GROUP BY in the database,
+        unless the model overrides dupcheck_signature, in which case the
+        signatures are computed in Python. Pass in_database to force either.
+        """
         if self.model.dupcheck_signature_fields is None:
             raise TypeError(  # pragma: no cover
                 'Duplicate checking is not supported on this model.'
             )
+        if in_database is None:
+            in_database = self.model.dupcheck_signature \
+                is DuplicationProtectionMixin.dupcheck_signature
         historical_buckets = defaultdict(int)
         if timestamp_bounds is not None:
             min_ts, max_ts = timestamp_bounds
@@ -522,17 +1272,54 @@ class DuplicationProtectedQuerySet(DoubleBookQuerySet):
         else:
             qs = self
 
-        for entry in qs:
-            historical_buckets[entry.dupcheck_signature] += 1
+        if not in_database:
+            for entry in qs:
+                historical_buckets[entry.dupcheck_signature] += 1
+            return historical_buckets
+
+        sig_type, sig_fields = self.model.get_dupcheck_signature_type()
+        # see DuplicationProtectionMixin.dupcheck_signature
+        if not settings.USE_TZ:
+            tzname = None
+        elif getattr(settings, 'TRANSACTION_DUPCHECK_SERVER_TZ', False):
+            tzname = timezone.get_current_timezone_name()
+        else:
+            # timestamps coming from the database are in UTC
+            tzname = 'UTC'
+        total_amount_field_name = self.model.TOTAL_AMOUNT_FIELD_COLUMN
+        rows = qs.with_total_amount().order_by().annotate(
+            _dupcheck_date=TruncDateIn('timestamp', tzname=tzname)
+        ).values(
+            '_dupcheck_date', total_amount_field_name, *sig_fields
+        ).annotate(_dupcheck_count=Count('pk'))
+        for row in rows:
+            sig = sig_type(
+                date=row['_dupcheck_date'],
+                amount=row[total_amount_field_name],
+                **{field: row[field] for field in sig_fields}
+            )
+            historical_buckets[sig] += row['_dupcheck_count']
+
+        return historical_buckets
+
+
+class DoubleBookManager(models.Manager):
+    """
+    Manager applying the total amount annotations registered on the model
+    to every queryset, see DoubleBookInterface.get_total_amount_annotations.
+    Use DoubleBookManager.from_queryset() for custom querysets.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().with_total_amount()
 
-        return historical_buckets 
 
 # mainly for semantic consistency and backwards compatibility
 class BaseDebtQuerySet(DoubleBookQuerySet):
     
-    def with_payments(self, include_timestamps=False):
+    def with_payments(self, include_timestamps=False, single_pass=False):
         if include_timestamps:
-            return self.with_fully_matched_date()
+            return self.with_fully_matched_date(single_pass=single_pass)
         else:
             return self.with_remote_accounts()
 
@@ -577,7 +1364,7 @@ class BaseDebtRecord(DoubleBookModel):
         blank=True
     )
 
-    objects = BaseDebtQuerySet.as_manager()
+    objects = DoubleBookManager.from_queryset(BaseDebtQuerySet)()
 
     class Meta:
         abstract = True
@@ -613,7 +1400,7 @@ class BaseDebtRecord(DoubleBookModel):
 
 class BasePaymentRecord(DoubleBookModel):
 
-    objects = BasePaymentQuerySet.as_manager()
+    objects = DoubleBookManager.from_queryset(BasePaymentQuerySet)()
 
     class Meta:
         abstract = True
@@ -643,28 +1430,210 @@ class BasePaymentRecord(DoubleBookModel):
         return self.fully_matched
     
 
-# TODO: can we auto-enforce unique_together?
-class BaseTransactionSplit(models.Model):
+class TransactionSplitQuerySet(models.QuerySet):
+    EFFECTIVE_TIMESTAMP_FIELD = 'effective_timestamp_fromdb'
 
-    amount = MoneyField(
-        verbose_name=_('amount'),
+    def with_effective_timestamp(self):
+        """
+        Annotate the point in time at which a split came into effect,
+        i.e. the timestamp of the most recent of its two ledger entries.
+        """
+        fk_1, fk_2 = self.model.get_double_book_models().keys()
+        return self.annotate(**{
+            self.__class__.EFFECTIVE_TIMESTAMP_FIELD: Greatest(
+                fk_1 + '__timestamp', fk_2 + '__timestamp'
+            )
+        })
+
+    def bulk_create(self, objs, *args, **kwargs):
+        # objs may be a generator
+        objs = list(objs)
+        result = super().bulk_create(objs, *args, **kwargs)
+        self.model.refresh_persisted_balances_for(objs, using=self.db)
+        self.model.invalidate_balance_checkpoints_for(objs, using=self.db)
+        return result
+
+
+# TODO: can we auto-enforce unique_together?
+class BaseTransactionSplit(models.Model):
+
+    amount = MoneyField(
+        verbose_name=_('amount'),
         decimal_places=getattr(settings, 'CURRENCY_DECIMAL_PLACES', 4),
         max_digits=getattr(settings, 'CURRENCY_MAX_DIGITS', 19),
         validators=[nonzero_money_validator]
     )
-    
+
+    objects = TransactionSplitQuerySet.as_manager()
+
+    # see DoubleBookInterface.archive_model
+    archive_model = None
+
     class Meta:
         abstract = True
 
     @classmethod
-    def get_double_book_models(cls):
-        res = {
-            f.name: f.related_model for f in cls._meta.get_fields()
-            if isinstance(f, models.ForeignKey) 
+    def _reflect_ledger_metadata(cls) -> SplitMetadata:
+        res = tuple(
+            (f.name, f.related_model) for f in cls._meta.get_fields()
+            if isinstance(f, models.ForeignKey)
             and issubclass(f.related_model, DoubleBookModel)
+        )
+        if len(res) != 2:
+            raise TypeError(
+                'A split model needs exactly two DoubleBookModel '
+                'foreign keys.'
+            )
+        return SplitMetadata(double_book_models=res)
+
+    @classmethod
+    def get_ledger_metadata(cls) -> SplitMetadata:
+        metadata = get_metadata(cls)
+        if metadata is None:
+            # the registry isn't ready yet
+            metadata = cls._reflect_ledger_metadata()
+        return metadata
+
+    @classmethod
+    def get_double_book_models(cls):
+        return dict(cls.get_ledger_metadata().double_book_models)
+
+    @classmethod
+    def refresh_persisted_balances_for(cls, splits, chunk_size=500,
+                                       using=None):
+        """
+        Bring the persisted balances of all ledger entries touched by the
+        given splits up to date, in the database the splits were written
+        to (using). This is a no-op if neither half of the ledger persists
+        its balances.
+        """
+        for fname, model in cls.get_double_book_models().items():
+            if not issubclass(model, PersistedBalanceMixin):
+                continue
+            attname = cls._meta.get_field(fname).attname
+            pks = list(set(
+                getattr(split, attname) for split in splits
+            ) - {None})
+            # stay under SQLite's parameter limit
+            for ix in range(0, len(pks), chunk_size):
+                model._default_manager.db_manager(using).filter(
+                    pk__in=pks[ix:ix + chunk_size]
+                ).refresh_persisted_balances()
+
+    @classmethod
+    def invalidate_balance_checkpoints_for(cls, splits, chunk_size=500,
+                                           using=None):
+        """
+        Delete the balance checkpoints made obsolete by the given (new or
+        deleted) splits, i.e. the ones of the parties on both sides that
+        were taken after the splits came into effect.
+        using is the database the splits were written to.
+        See TransactionSplitQuerySet.with_effective_timestamp.
+        """
+        halves = [
+            (cls._meta.get_field(fname), model)
+            for fname, model in cls.get_double_book_models().items()
+        ]
+        if not any(
+            model.get_balance_checkpoint_targets() for __, model in halves
+        ):
+            return
+        splits = list(splits)
+        entries = []
+        for field, model in halves:
+            party_fields = [
+                model._meta.get_field(attname).name
+                for __, __, attname in model.get_balance_checkpoint_targets()
+            ]
+            pks = list(set(
+                getattr(split, field.attname) for split in splits
+            ) - {None})
+            by_pk = {}
+            for ix in range(0, len(pks), chunk_size):
+                by_pk.update(
+                    (entry.pk, entry)
+                    for entry in model._base_manager.db_manager(using).filter(
+                        pk__in=pks[ix:ix + chunk_size]
+                    ).only('timestamp', *party_fields)
+                )
+            entries.append(by_pk)
+
+        changes = [[] for __ in halves]
+        for split in splits:
+            split_entries = [
+                by_pk.get(getattr(split, field.attname))
+                for (field, __), by_pk in zip(halves, entries)
+            ]
+            if None in split_entries:
+                # deleted along with one of its ledger entries
+                continue
+            effective = max(entry.timestamp for entry in split_entries)
+            for entry, half_changes in zip(split_entries, changes):
+                half_changes.append((entry, effective))
+        for (__, model), half_changes in zip(halves, changes):
+            model.invalidate_balance_checkpoints_for(half_changes, using=using)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_ledger_entries()
+        if 'amount' in field_names:
+            instance._loaded_amount = instance.amount
+        return instance
+
+    def _ledger_attnames(self):
+        return [
+            self._meta.get_field(fname).attname
+            for fname in self.__class__.get_double_book_models()
+        ]
+
+    def _remember_ledger_entries(self):
+        # the ledger entries this split was last loaded with or saved to
+        self._loaded_ledger_entries = {
+            attname: self.__dict__[attname]
+            for attname in self._ledger_attnames()
+            if attname in self.__dict__
         }
-        assert len(res) == 2
-        return res
+
+    def _affected_splits(self):
+        """
+        Return this split, together with a copy pointing to the ledger
+        entries it was previously attached to if any of its foreign keys
+        were changed since it was loaded.
+        """
+        loaded = getattr(self, '_loaded_ledger_entries', {})
+        current = {
+            attname: getattr(self, attname)
+            for attname in self._ledger_attnames()
+        }
+        previous = dict(current, **loaded)
+        if previous == current:
+            return [self]
+        return [self, self.__class__(**previous)]
+
+    def save(self, **kwargs):
+        adding = self._state.adding
+        super().save(**kwargs)
+        splits = self._affected_splits()
+        # the balances only change if the amount or the ledger entries of
+        # the split did
+        changed = adding or len(splits) > 1 \
+            or getattr(self, '_loaded_amount', None) != self.amount
+        if changed:
+            using = self._state.db
+            cls = self.__class__
+            cls.refresh_persisted_balances_for(splits, using=using)
+            cls.invalidate_balance_checkpoints_for(splits, using=using)
+        self._remember_ledger_entries()
+        self._loaded_amount = self.amount
+
+    def delete(self, **kwargs):
+        using = self._state.db
+        splits = self._affected_splits()
+        result = super().delete(**kwargs)
+        self.__class__.refresh_persisted_balances_for(splits, using=using)
+        self.__class__.invalidate_balance_checkpoints_for(splits, using=using)
+        return result
 
     def clean(self):
         if self.amount.amount < 0:
@@ -678,6 +1647,8 @@ class BaseTransactionSplit(models.Model):
 class BaseDebtPaymentSplit(BaseTransactionSplit):
     strictly_enforce_timestamps = False
 
+    # names of the foreign keys to the payment and debt models,
+    # found through reflection if not set
     _pmt_column_name = None
     _debt_column_name = None
 
@@ -685,34 +1656,39 @@ class BaseDebtPaymentSplit(BaseTransactionSplit):
         abstract = True
 
     @classmethod
-    def get_payment_column(cls):
-        if cls._pmt_column_name is None:
+    def _reflect_ledger_metadata(cls) -> SplitMetadata:
+        metadata = super()._reflect_ledger_metadata()
+
+        def find_column(base_class, kind):
             res = [
                 f.name for f in cls._meta.get_fields()
-                if isinstance(f, models.ForeignKey) 
-                and issubclass(f.related_model, BasePaymentRecord)
+                if isinstance(f, models.ForeignKey)
+                and issubclass(f.related_model, base_class)
             ]
             if len(res) == 0:
-                raise TypeError('No payment column present.')
+                raise TypeError('No %s column present.' % kind)
             elif len(res) == 2:
-                raise TypeError('Multiple payment columns present.')
-            cls._pmt_column_name = res[0]
-        return cls._pmt_column_name
+                raise TypeError('Multiple %s columns present.' % kind)
+            return res[0]
+
+        return dataclasses.replace(
+            metadata,
+            payment_column=(
+                cls._pmt_column_name
+                or find_column(BasePaymentRecord, 'payment')
+            ),
+            debt_column=(
+                cls._debt_column_name or find_column(BaseDebtRecord, 'debt')
+            )
+        )
+
+    @classmethod
+    def get_payment_column(cls):
+        return cls.get_ledger_metadata().payment_column
 
     @classmethod
     def get_debt_column(cls):
-        if cls._debt_column_name is None:
-            res = [
-                f.name for f in cls._meta.get_fields()
-                if isinstance(f, models.ForeignKey) 
-                and issubclass(f.related_model, BaseDebtRecord)
-            ]
-            if len(res) == 0:
-                raise TypeError('No debt column present.')
-            elif len(res) == 2:
-                raise TypeError('Multiple debt columns present.')
-            cls._debt_column_name = res[0]
-        return cls._debt_column_name
+        return cls.get_ledger_metadata().debt_column
     
     def clean(self):
         super().clean()
@@ -748,8 +1724,35 @@ def parse_transaction_no(ogm, prefix_digit: Optional[int]=None, match=None):
 class TransactionPartyQuerySet(models.QuerySet):
     model: 'TransactionPartyMixin'
     DEBT_BALANCE_FIELD = 'debt_balance_fromdb'
+    DEBT_PAID_FIELD = 'debt_paid_fromdb'
+    PAYMENT_TOTAL_FIELD = 'payment_total_fromdb'
+    CREDIT_BALANCE_FIELD = 'credit_balance_fromdb'
+    CHECKPOINT_TIMESTAMP_FIELD = 'checkpoint_timestamp_fromdb'
+
+    # use the grouped strategy in with_debt_balances by default
+    grouped_debt_balances = False
+
+    def on_replica(self):
+        """
+        Read from the configured replica database, see double_entry.routers.
+        """
+        alias = replica_alias_for_read()
+        return self if alias is None else self.using(alias)
+
+    def _stored_payment_tracking_no(self, ogm):
+        # normalise the OGM to the format of the stored column
+        prefix, _ = parse_ogm(ogm)
+        if prefix // 10**9 != self.model.payment_tracking_prefix:
+            raise ValueError
+        return ogm_from_prefix(prefix, formatted=False)
 
     def by_payment_tracking_no(self, ogm):
+        if issubclass(self.model, PersistedPaymentTrackingNoMixin):
+            try:
+                raw = self._stored_payment_tracking_no(ogm)
+            except ValueError:
+                raise self.model.DoesNotExist()
+            return self.get(stored_payment_tracking_no=raw)
         try:
             prefix_digit, pk = parse_transaction_no(
                 ogm, prefix_digit=self.model.payment_tracking_prefix
@@ -760,6 +1763,17 @@ class TransactionPartyQuerySet(models.QuerySet):
 
     @validated_bulk_query(lambda x: x.payment_tracking_no)
     def by_payment_tracking_nos(self, ogms):
+        if issubclass(self.model, PersistedPaymentTrackingNoMixin):
+            raws = set()
+            for ogm in ogms:
+                try:
+                    raws.add(self._stored_payment_tracking_no(ogm))
+                except ValueError:
+                    continue
+            if not raws:
+                return self.none()
+            return self.filter(stored_payment_tracking_no__in=raws)
+
         def compute_pks():
             for ogm in ogms:
                 try:
@@ -774,6 +1788,32 @@ class TransactionPartyQuerySet(models.QuerySet):
             return self.none()
         return self.filter(pk__in=pks)
 
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if issubclass(self.model, PersistedPaymentTrackingNoMixin):
+            # only possible if the backend returns primary keys
+            for obj in objs:
+                if obj.pk is not None:
+                    obj.assign_payment_tracking_no()
+        return objs
+
+    def fill_payment_tracking_nos(self):
+        """
+        Assign stored payment tracking numbers to all parties in this
+        queryset that do not have one yet.
+        Returns the number of parties that were updated.
+        """
+        if not issubclass(self.model, PersistedPaymentTrackingNoMixin):
+            raise TypeError(
+                'Payment tracking numbers are not stored on this model.'
+            )
+        count = 0
+        qs = self.filter(stored_payment_tracking_no__isnull=True)
+        for party in qs.iterator():
+            party.assign_payment_tracking_no()
+            count += 1
+        return count
+
     def with_debt_annotations(self):
         # annotate debts relation
         # this does NOT compute the debt balance/member annotation
@@ -796,12 +1836,27 @@ class TransactionPartyQuerySet(models.QuerySet):
     def with_debts_and_payments(self):
         return self.with_debt_annotations().with_payment_annotations()
 
-    def with_debt_balances(self):
+    def with_debt_balances(self, grouped=None):
+        """
+        Annotate the outstanding debt balance of each party.
+        With grouped=True (or grouped_debt_balances set on the queryset
+        class), the balances of all debts are computed in one grouped join
+        over the split table and summed per party in a derived table, which
+        is joined to the parties once, instead of computing the balance of
+        every debt in a correlated subquery per party. A debt that is
+        matched beyond its total amount counts as zero, so it doesn't
+        cancel out the balances of the other debts.
+        """
         # TODO: figure out if this is even necessary
         cls = self.__class__
         if cls.DEBT_BALANCE_FIELD in self.query.annotations:
             return self
 
+        if grouped is None:
+            grouped = cls.grouped_debt_balances
+        if grouped:
+            return self._with_grouped_debt_balances()
+
         # prefetch_related doesn't work and leads to
         # confusing but nonetheless absolutely hilarious bugs.
         # prefetching debts as InternalDebtItem.objects.with_payments(),
@@ -834,20 +1889,347 @@ class TransactionPartyQuerySet(models.QuerySet):
         })
         # R'amen
 
+    # number of party ids per query in balances_for
+    balances_chunk_size = 500
+
+    # rows per query in chunked_iterator
+    iteration_chunk_size = 2000
+
+    def chunked_iterator(self, chunk_size=None):
+        """
+        Iterate over the parties in this queryset, fetching chunk_size rows
+        at a time by primary key. Unlike iterator(), this keeps the
+        prefetches of e.g. with_debts_and_payments(), which are run per
+        chunk. If the debts are not prefetched, the debt balances are
+        annotated instead, so debt_balance never hits the database.
+        """
+        qs = self
+        prefetched = {
+            getattr(lookup, 'prefetch_to', lookup)
+            for lookup in self._prefetch_related_lookups
+        }
+        if self.model.get_debts_manager_name() not in prefetched:
+            qs = qs.with_debt_balances()
+        return iterate_by_pk(qs, chunk_size or self.iteration_chunk_size)
+
+    def balances_for(self, ids, kind='debt'):
+        """
+        Compute the outstanding debt balance (kind='debt') or the remaining
+        credit (kind='credit') of the parties with the given primary keys,
+        without instantiating any models.
+        Returns a dict mapping every requested id (as a primary key value)
+        to a Decimal.
+        Every chunk of ids costs one query, which sums the splits of each
+        ledger entry in a grouped join, sums the balances per party in a
+        derived table and joins that to the parties.
+        Like with_debt_balances, ledger entries that are matched beyond
+        their total amount count as zero.
+        """
+        model = self.model
+        if kind == 'debt':
+            entry_model = model.get_debt_model()
+            tp_remote_fk = model.get_debt_remote_fk()
+        elif kind == 'credit':
+            entry_model = model.get_payment_model()
+            tp_remote_fk = model.get_payment_remote_fk()
+        else:
+            raise ValueError('kind must be one of \'debt\' or \'credit\'')
+
+        remote_fk = entry_model._meta.get_field(tp_remote_fk)
+        pk_field = model._meta.pk
+        ids = [pk_field.to_python(pk) for pk in ids]
+        balances = {pk: Decimal('0.00') for pk in ids}
+        balance_field = DoubleBookQuerySet.CLAMPED_BALANCE_FIELD
+        parties = model._base_manager.using(self.db)
+        chunk_size = self.balances_chunk_size
+        for i in range(0, len(ids), chunk_size):
+            entry_balances = entry_model._default_manager.filter(**{
+                tp_remote_fk + '__in': ids[i:i + chunk_size]
+            })._clamped_balances(tp_remote_fk)
+            # parties without ledger entries in the chunk are dropped
+            # by the join
+            balances.update(parties.order_by().annotate(**{
+                balance_field: JoinedSubquerySum(
+                    entry_balances, balance_field, remote_fk.column,
+                    remote_fk.target_field.column, nullable=False,
+                    output_field=models.DecimalField()
+                )
+            }).values_list('pk', balance_field))
+        return {
+            pk: decimal_to_money(balance).amount
+            for pk, balance in balances.items()
+        }
+
+    def with_balance_components_as_of(self, as_of):
+        """
+        Annotate the debt total, the matched debt amount, the payment total
+        and the matched payment amount of each party, as they stood at
+        as_of. Like in with_debt_balances, every ledger entry counts as
+        matched for at most its total amount.
+        These are computed from the most recent balance checkpoint before
+        as_of (if the party model has a checkpoint model), plus the ledger
+        entries and splits that came into effect after it.
+        The annotations are named after the fields of BaseBalanceCheckpoint.
+        """
+        model = self.model
+        debt_model = model.get_debt_model()
+        payment_model = model.get_payment_model()
+        for entry_model in (debt_model, payment_model):
+            try:
+                entry_model._meta.get_field(
+                    entry_model.TOTAL_AMOUNT_FIELD_COLUMN
+                )
+            except FieldDoesNotExist:
+                raise TypeError(
+                    'As-of balances require the total amount of %s '
+                    'to be stored in a column.' % entry_model.__name__
+                )
+
+        def decimal_subquery(subq):
+            return Coalesce(
+                Subquery(subq),
+                Value(Decimal('0.00')),
+                output_field=models.DecimalField()
+            )
+
+        cls = self.__class__
+        annotations = {}
+        checkpoint_model, checkpoint_fk = model.get_balance_checkpoint_model()
+        if checkpoint_model is not None:
+            checkpoints = checkpoint_model._default_manager.filter(**{
+                checkpoint_fk: OuterRef('pk'),
+                'timestamp__lte': as_of
+            }).order_by('-timestamp')
+            annotations[cls.CHECKPOINT_TIMESTAMP_FIELD] = Subquery(
+                checkpoints.values('timestamp')[:1]
+            )
+            for field in BaseBalanceCheckpoint.BALANCE_FIELDS:
+                annotations['_checkpoint_' + field] = decimal_subquery(
+                    checkpoints.values(field)[:1]
+                )
+
+        def since(outer_ref):
+            # parties without a checkpoint have to take everything into
+            # account
+            return Coalesce(
+                outer_ref, Value(BaseBalanceCheckpoint.beginning_of_time()),
+                output_field=models.DateTimeField()
+            )
+
+        def total_delta_subquery(entry_model, party_fk):
+            total_amount_field_name = entry_model.TOTAL_AMOUNT_FIELD_COLUMN
+            qs = entry_model._default_manager.filter(**{
+                party_fk: OuterRef('pk'), 'timestamp__lte': as_of
+            })
+            if checkpoint_model is not None:
+                qs = qs.filter(timestamp__gt=since(
+                    OuterRef(cls.CHECKPOINT_TIMESTAMP_FIELD)
+                ))
+            return decimal_subquery(
+                qs.order_by().values(party_fk).annotate(
+                    _delta=Sum(total_amount_field_name)
+                ).values('_delta')
+            )
+
+        def matched_delta_subquery(entry_model, party_fk):
+            # Every entry counts as matched for at most its total amount,
+            # so the delta is computed per entry, for the entries with
+            # splits that came into effect since the checkpoint.
+            # A split is in effect once both of its entries are recorded.
+            total_amount_field_name = entry_model.TOTAL_AMOUNT_FIELD_COLUMN
+            split_model, join_on = entry_model.get_split_model()
+            __, other_half_fk = \
+                entry_model.get_other_half_model().get_split_model()
+            split_lookup = entry_model.get_split_manager_name()
+            other_half_ts = '%s__%s__timestamp' % (split_lookup, other_half_fk)
+            effective_ts = TransactionSplitQuerySet.EFFECTIVE_TIMESTAMP_FIELD
+            entries = entry_model._default_manager.filter(**{
+                party_fk: OuterRef('pk'), 'timestamp__lte': as_of
+            })
+            if checkpoint_model is not None:
+                # Look up the checkpoint through the party of the entry
+                # itself, so that no outer reference needs to be resolved
+                # two levels up, or in a When clause (which the supported
+                # Django versions don't all handle).
+                checkpoint_ts = checkpoint_model._default_manager.filter(**{
+                    checkpoint_fk: OuterRef(party_fk),
+                    'timestamp__lte': as_of
+                }).order_by('-timestamp').values('timestamp')[:1]
+                changed = split_model._default_manager\
+                    .with_effective_timestamp().filter(**{
+                        join_on: OuterRef('pk'),
+                        effective_ts + '__gt': OuterRef('_since'),
+                        effective_ts + '__lte': as_of
+                    })
+                entries = entries.annotate(
+                    _since=since(Subquery(checkpoint_ts))
+                ).annotate(_changed=Exists(changed)).filter(_changed=True)
+                checkpoint_ts = F('_since')
+
+            def matched_until(condition):
+                return Least(
+                    Sum(
+                        Case(
+                            When(condition, then=F(split_lookup + '__amount')),
+                            default=Value(Decimal('0.00')),
+                            output_field=models.DecimalField()
+                        ),
+                        output_field=models.DecimalField()
+                    ),
+                    F(total_amount_field_name),
+                    output_field=models.DecimalField()
+                )
+
+            delta = matched_until(Q(**{other_half_ts + '__lte': as_of}))
+            if checkpoint_model is not None:
+                delta = ExpressionWrapper(
+                    delta - matched_until(
+                        Q(timestamp__lte=checkpoint_ts)
+                        & Q(**{other_half_ts + '__lte': checkpoint_ts})
+                    ),
+                    output_field=models.DecimalField()
+                )
+            entry_deltas = entries.order_by().values('pk')\
+                .annotate(_delta=delta).values('_delta')
+            return Coalesce(
+                SubquerySum(
+                    entry_deltas, '_delta', output_field=models.DecimalField()
+                ),
+                Value(Decimal('0.00')),
+                output_field=models.DecimalField()
+            )
+
+        debt_fk = model.get_debt_remote_fk()
+        payment_fk = model.get_payment_remote_fk()
+        deltas = {
+            'debt_total': total_delta_subquery(debt_model, debt_fk),
+            'debt_matched': matched_delta_subquery(debt_model, debt_fk),
+            'credit_total': total_delta_subquery(payment_model, payment_fk),
+            'credit_matched': matched_delta_subquery(
+                payment_model, payment_fk
+            ),
+        }
+        for field, delta in deltas.items():
+            if checkpoint_model is not None:
+                delta = ExpressionWrapper(
+                    F('_checkpoint_' + field) + delta,
+                    output_field=models.DecimalField()
+                )
+            annotations[field + '_fromdb'] = delta
+        return self.annotate(**annotations)
+
+    def with_balances_as_of(self, as_of):
+        """
+        Annotate the outstanding debt balance and the remaining credit of
+        each party as they stood at as_of.
+        See with_balance_components_as_of.
+        """
+        cls = self.__class__
+        return self.with_balance_components_as_of(as_of).annotate(**{
+            cls.DEBT_BALANCE_FIELD: ExpressionWrapper(
+                F('debt_total_fromdb') - F('debt_matched_fromdb'),
+                output_field=models.DecimalField()
+            ),
+            cls.CREDIT_BALANCE_FIELD: ExpressionWrapper(
+                F('credit_total_fromdb') - F('credit_matched_fromdb'),
+                output_field=models.DecimalField()
+            ),
+        })
+
+    def _with_grouped_debt_balances(self):
+        cls = self.__class__
+        debt_model = self.model.get_debt_model()
+        remote_fk = debt_model._meta.get_field(
+            self.model.get_debt_remote_fk()
+        )
+        debt_balances = debt_model._default_manager.filter(**{
+            remote_fk.name + '__isnull': False
+        })._clamped_balances(remote_fk.name)
+
+        return self.annotate(**{
+            cls.DEBT_BALANCE_FIELD: Coalesce(
+                JoinedSubquerySum(
+                    debt_balances, DoubleBookQuerySet.CLAMPED_BALANCE_FIELD,
+                    remote_fk.column, remote_fk.target_field.column,
+                    table_name='debt_balances',
+                    output_field=models.DecimalField()
+                ),
+                Value(Decimal('0.00')),
+                output_field=models.DecimalField()
+            )
+        })
+
+    def with_debt_paid(self):
+        cls = self.__class__
+        if cls.DEBT_PAID_FIELD in self.query.annotations:
+            return self
+
+        # sum the splits directly, the debts themselves are irrelevant
+        split_model, debt_fk = self.model.get_debt_model().get_split_model()
+        tp_path = '%s__%s' % (debt_fk, self.model.get_debt_remote_fk())
+        debt_paid_subq = split_model._default_manager.filter(**{
+            tp_path: OuterRef('pk'),
+        }).order_by().values(tp_path).annotate(
+            total_paid=Sum('amount')
+        ).values('total_paid')
+
+        return self.annotate(**{
+            cls.DEBT_PAID_FIELD: Coalesce(
+                Subquery(debt_paid_subq),
+                Value(Decimal('0.00')),
+                output_field=models.DecimalField()
+            )
+        })
+
+    def with_payment_totals(self):
+        cls = self.__class__
+        if cls.PAYMENT_TOTAL_FIELD in self.query.annotations:
+            return self
+
+        payment_model = self.model.get_payment_model()
+        tp_remote_fk = self.model.get_payment_remote_fk()
+        payment_total_subq = payment_model.objects.filter(**{
+            tp_remote_fk: OuterRef('pk'),
+        }).with_total_amount().order_by().values(tp_remote_fk).annotate(
+            total_paid=Sum(payment_model.TOTAL_AMOUNT_FIELD_COLUMN)
+        ).values('total_paid')
+
+        return self.annotate(**{
+            cls.PAYMENT_TOTAL_FIELD: Coalesce(
+                Subquery(payment_total_subq),
+                Value(Decimal('0.00')),
+                output_field=models.DecimalField()
+            )
+        })
+
+StatementLine = namedtuple(
+    'StatementLine', ['timestamp', 'entry', 'entry_id', 'amount', 'balance']
+)
+StatementLine.__doc__ = """
+One line of a transaction party statement. entry is either 'debt' or
+'payment', and balance is the running balance after the line, i.e. the
+amount owed by the party (negative if the party has credit).
+"""
+
+STATEMENT_DEBT = 'debt'
+STATEMENT_PAYMENT = 'payment'
+
+# (model, database alias) -> (sql, params without the trailing pk param,
+# selected expression); nothing in here is bound to a connection, so the
+# entries can be shared between threads
+_balance_query_cache = {}
+
+
 # TODO: auto-enforce equality of transaction parties accross debt/payment splits
 #  through reflection
 class TransactionPartyMixin(models.Model):
 
     payment_tracking_prefix: int = None
-    _debt_model: Type[BaseDebtRecord] = None
-    _payment_model: Type[BasePaymentRecord] = None
-    _split_model: Type[BaseDebtPaymentSplit] = None
+    # the ledger relations are found through reflection if not set
     _debts_manager_name: str = None
     _payments_manager_name: str = None
-    _debt_remote_fk: str = None
-    _payment_remote_fk: str = None
-    _debt_remote_fk_column: str = None
-    _payment_remote_fk_column: str = None
+    _checkpoint_model: Type['BaseBalanceCheckpoint'] = None
+    _checkpoint_remote_fk: str = None
 
     hidden_token = models.BinaryField(
         max_length=8,
@@ -867,10 +2249,12 @@ class TransactionPartyMixin(models.Model):
         abstract = True
 
     @classmethod
-    def _annotate_model_metadata(cls):
-        if cls._debt_model is not None:
-            return
-
+    def _reflect_ledger_metadata(cls) -> TransactionPartyMetadata:
+        """
+        Find the debt and payment relations through reflection.
+        This is done once for all installed models when the app registry
+        is ready, see double_entry.registry.
+        """
         fields = cls._meta.get_fields()
         m2one_fields = [f for f in fields if isinstance(f, ManyToOneRel)]
         m2one_models = set(f.remote_field.model for f in m2one_fields)
@@ -894,7 +2278,6 @@ class TransactionPartyMixin(models.Model):
                     'Please set debts_manager_name'
                 )
             debts_f = debt_fields[0]
-            cls._debts_manager_name = debts_f.name
         else:
             debts_f = cls._meta.get_field(cls._debts_manager_name)
         if cls._payments_manager_name is None:
@@ -909,75 +2292,171 @@ class TransactionPartyMixin(models.Model):
                     'Please set payments_manager_name'
                 )
             payments_f = payment_fields[0]
-            cls._payments_manager_name = payments_f.name
         else:
             payments_f = cls._meta.get_field(cls._payments_manager_name)
-        cls._debt_model = debts_f.related_model
-        cls._payment_model = payments_f.related_model
-        if not issubclass(cls._debt_model, BaseDebtRecord):
+        debt_model = debts_f.related_model
+        payment_model = payments_f.related_model
+        if not issubclass(debt_model, BaseDebtRecord):
             raise TypeError('Debts relation does not point to a debt model')
-        if not issubclass(cls._payment_model, BasePaymentRecord):
+        if not issubclass(payment_model, BasePaymentRecord):
             raise TypeError(
                 'Payments relation does not point to a payment model'
             )
-        cls._debt_remote_fk = debts_f.remote_field.name
-        cls._payment_remote_fk = payments_f.remote_field.name
-        cls._debt_remote_fk_column = debts_f.remote_field.column
-        cls._payment_remote_fk_column = payments_f.remote_field.column
         models_consistent = (
-            cls._debt_model.get_other_half_model() == cls._payment_model
-            and cls._payment_model.get_other_half_model() == cls._debt_model
+            debt_model.get_other_half_model() == payment_model
+            and payment_model.get_other_half_model() == debt_model
         )
         if not models_consistent:
             raise TypeError(
                 'Payment and debt ledger classes are inconsistent.'
             )
-        cls._split_model = cls._debt_model.get_split_model()[0]
+
+        if cls._checkpoint_model is None:
+            candidates = [
+                f for f in fields
+                if isinstance(f, ManyToOneRel)
+                and issubclass(f.related_model, BaseBalanceCheckpoint)
+            ]
+            if len(candidates) > 1:
+                raise TypeError(
+                    'Too many candidates for balance checkpoints. '
+                    'Please set _checkpoint_model and _checkpoint_remote_fk'
+                )
+            elif candidates:
+                checkpoint_model = candidates[0].related_model
+                checkpoint_remote_fk = candidates[0].remote_field.name
+            else:
+                checkpoint_model = checkpoint_remote_fk = None
+        else:
+            checkpoint_model = cls._checkpoint_model
+            checkpoint_remote_fk = cls._checkpoint_remote_fk
+
+        return TransactionPartyMetadata(
+            debts_manager_name=debts_f.name,
+            payments_manager_name=payments_f.name,
+            debt_model=debt_model,
+            payment_model=payment_model,
+            split_model=debt_model.get_split_model()[0],
+            debt_remote_fk=debts_f.remote_field.name,
+            payment_remote_fk=payments_f.remote_field.name,
+            debt_remote_fk_column=debts_f.remote_field.column,
+            payment_remote_fk_column=payments_f.remote_field.column,
+            checkpoint_model=checkpoint_model,
+            checkpoint_remote_fk=checkpoint_remote_fk
+        )
+
+    @classmethod
+    def get_ledger_metadata(cls) -> TransactionPartyMetadata:
+        metadata = get_metadata(cls)
+        if metadata is None:
+            # the registry isn't ready yet
+            metadata = cls._reflect_ledger_metadata()
+        return metadata
 
     @classmethod
     def get_debts_manager_name(cls):
-        cls._annotate_model_metadata()
-        return cls._debts_manager_name
+        return cls.get_ledger_metadata().debts_manager_name
 
     @classmethod
     def get_payments_manager_name(cls):
-        cls._annotate_model_metadata()
-        return cls._payments_manager_name
+        return cls.get_ledger_metadata().payments_manager_name
 
     @classmethod
     def get_debt_model(cls):
-        cls._annotate_model_metadata()
-        return cls._debt_model
+        return cls.get_ledger_metadata().debt_model
 
     @classmethod
     def get_payment_model(cls):
-        cls._annotate_model_metadata()
-        return cls._payment_model
+        return cls.get_ledger_metadata().payment_model
 
     @classmethod
     def get_split_model(cls):
-        cls._annotate_model_metadata()
-        return cls._split_model
+        return cls.get_ledger_metadata().split_model
 
     @classmethod
     def get_debt_remote_fk(cls):
-        cls._annotate_model_metadata()
-        return cls._debt_remote_fk
+        return cls.get_ledger_metadata().debt_remote_fk
 
     @classmethod
     def get_payment_remote_fk(cls):
-        cls._annotate_model_metadata()
-        return cls._payment_remote_fk
+        return cls.get_ledger_metadata().payment_remote_fk
 
     @classmethod
     def get_debt_remote_fk_column(cls):
-        cls._annotate_model_metadata()
-        return cls._debt_remote_fk_column
+        return cls.get_ledger_metadata().debt_remote_fk_column
 
     @classmethod
     def get_payment_remote_fk_column(cls):
-        cls._annotate_model_metadata()
-        return cls._payment_remote_fk_column
+        return cls.get_ledger_metadata().payment_remote_fk_column
+
+    @classmethod
+    def get_balance_checkpoint_model(cls) \
+            -> Tuple[Optional[Type['BaseBalanceCheckpoint']], Optional[str]]:
+        """
+        Return the balance checkpoint model pointing to this model, and the
+        name of its foreign key, or (None, None) if there is none.
+        """
+        metadata = cls.get_ledger_metadata()
+        return metadata.checkpoint_model, metadata.checkpoint_remote_fk
+
+    @classmethod
+    def _compile_balance_query(cls, using, pk):
+        qs = cls._default_manager.db_manager(using).with_debt_balances()\
+            .order_by().filter(pk=pk).values_list(
+                TransactionPartyQuerySet.DEBT_BALANCE_FIELD
+            )
+        compiler = qs.query.get_compiler(using=using)
+        sql, params = compiler.as_sql()
+        # the pk condition was added last, so its parameter is the last one
+        # of the WHERE clause, which should be the last one of the query
+        __, where_params = compiler.compile(compiler.where)
+        if not where_params \
+                or list(params[-len(where_params):]) != list(where_params):
+            return None
+        (expression, __, __), = compiler.select
+        return sql, tuple(params[:-1]), expression
+
+    @classmethod
+    def fetch_balance(cls, pk) -> Decimal:
+        """
+        Fetch the outstanding debt balance of a single party, as annotated
+        by with_debt_balances(). The SQL is compiled once per model and
+        database, and reused with the primary key as a bound parameter,
+        which saves building and compiling the queryset on every call.
+        Raises DoesNotExist if there is no party with the given pk.
+        """
+        using = router.db_for_read(cls)
+        try:
+            compiled = _balance_query_cache[(cls, using)]
+        except KeyError:
+            compiled = _balance_query_cache[(cls, using)] = \
+                cls._compile_balance_query(using, pk)
+        if compiled is None:
+            return cls._default_manager.using(using).with_debt_balances()\
+                .values_list(
+                    TransactionPartyQuerySet.DEBT_BALANCE_FIELD, flat=True
+                ).get(pk=pk)
+
+        sql, params, expression = compiled
+        connection = connections[using]
+        pk_field = cls._meta.pk
+        params = list(params) + [
+            pk_field.get_db_prep_value(pk_field.to_python(pk), connection)
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        if not rows:
+            raise cls.DoesNotExist(
+                '%s matching query does not exist.' % cls._meta.object_name
+            )
+        (balance,), = rows
+        # apply the backend's converters, as the ORM would
+        converters = connection.ops.get_db_converters(expression) \
+            + expression.get_db_converters(connection)
+        for converter in converters:
+            balance = converter(balance, expression, connection)
+        return balance
 
     @classmethod
     def parse_transaction_no(cls, ogm):
@@ -1004,6 +2483,11 @@ class TransactionPartyMixin(models.Model):
     def raw_payment_tracking_no(self):
         return self._payment_tracking_no(False)
 
+    def _report_unprefetched(self, what, relation):
+        # summing over a prefetched relation doesn't hit the database
+        if relation not in getattr(self, '_prefetched_objects_cache', {}):
+            report_fallback(what, self)
+
     @cached_property
     def debt_balance(self):
         try:
@@ -1013,8 +2497,10 @@ class TransactionPartyMixin(models.Model):
         except AttributeError:
             # let's hope that you called this method with
             # with_debt_annotations, otherwise RIP DB
-            # TODO: can we detect prefetched relations easily?
             cls = self.__class__
+            self._report_unprefetched(
+                'debt_balance', cls.get_debts_manager_name()
+            )
             # TODO: can we do better than falling back on settings.DEFAULT_CURRENCY?
             return sum(
                 (d.balance for d in getattr(self, cls.get_debts_manager_name()).all()),
@@ -1023,22 +2509,362 @@ class TransactionPartyMixin(models.Model):
 
     @cached_property
     def debt_paid(self):
-        # see above
-        cls = self.__class__
-        return sum(
-            (d.amount_paid for d in getattr(self, cls.get_debts_manager_name()).all()),
-            Money(0, settings.DEFAULT_CURRENCY)
-        )
+        try:
+            return decimal_to_money(
+                getattr(self, TransactionPartyQuerySet.DEBT_PAID_FIELD)
+            )
+        except AttributeError:
+            # see above, use with_debt_paid or with_debt_annotations
+            cls = self.__class__
+            self._report_unprefetched(
+                'debt_paid', cls.get_debts_manager_name()
+            )
+            return sum(
+                (d.amount_paid for d in getattr(self, cls.get_debts_manager_name()).all()),
+                Money(0, settings.DEFAULT_CURRENCY)
+            )
 
     @cached_property
     def payment_total(self):
-        # this one needs with_payment_annotations to be efficient
-        cls = self.__class__
-        return sum(
-            (d.total_amount for d in getattr(self, cls.get_payments_manager_name()).all()),
-            Money(0, settings.DEFAULT_CURRENCY)
-        )
+        try:
+            return decimal_to_money(
+                getattr(self, TransactionPartyQuerySet.PAYMENT_TOTAL_FIELD)
+            )
+        except AttributeError:
+            # this one needs with_payment_totals or with_payment_annotations
+            # to be efficient
+            cls = self.__class__
+            self._report_unprefetched(
+                'payment_total', cls.get_payments_manager_name()
+            )
+            return sum(
+                (d.total_amount for d in getattr(self, cls.get_payments_manager_name()).all()),
+                Money(0, settings.DEFAULT_CURRENCY)
+            )
 
     @cached_property
     def to_refund(self):
         return self.payment_total - self.debt_paid
+
+    def statement(self, in_database=None, chunk_size=2000):
+        """
+        Generate the debts and payments of this party in chronological
+        order as StatementLine tuples, with a running balance.
+        Debts come before payments with the same timestamp.
+        By default, the running balance is computed with a window function
+        if the database supports it (and the total amounts of the ledger
+        entries are stored in columns). Otherwise, both relations are
+        streamed from the database and merged in Python.
+        The ledger entries are read from the database this party was
+        loaded from.
+        """
+        cls = self.__class__
+        using = self._state.db or router.db_for_read(cls.get_debt_model())
+        if in_database is None:
+            in_database = supports_window_functions(connections[using])
+            for entry_model in (cls.get_debt_model(), cls.get_payment_model()):
+                try:
+                    entry_model._meta.get_field(
+                        entry_model.TOTAL_AMOUNT_FIELD_COLUMN
+                    )
+                except FieldDoesNotExist:
+                    in_database = False
+        if in_database:
+            return self._statement_in_database(chunk_size, using)
+        else:
+            return self._statement_merged(chunk_size, using)
+
+    def _statement_merged(self, chunk_size, using):
+        cls = self.__class__
+
+        def entries(kind, model, remote_fk, sign):
+            qs = model._default_manager.db_manager(using).filter(**{
+                remote_fk: self.pk
+            })
+            for entry in qs.order_by('timestamp', 'pk').iterator(chunk_size):
+                yield (
+                    entry.timestamp, kind == STATEMENT_PAYMENT, entry.pk,
+                    kind, entry.total_amount, sign
+                )
+
+        merged = heapq.merge(
+            entries(
+                STATEMENT_DEBT, cls.get_debt_model(),
+                cls.get_debt_remote_fk(), 1
+            ),
+            entries(
+                STATEMENT_PAYMENT, cls.get_payment_model(),
+                cls.get_payment_remote_fk(), -1
+            ),
+        )
+        balance = Money(0, settings.DEFAULT_CURRENCY)
+        for timestamp, __, entry_id, kind, amount, sign in merged:
+            balance += amount * sign
+            yield StatementLine(
+                timestamp=timestamp, entry=kind, entry_id=entry_id,
+                amount=amount, balance=balance
+            )
+
+    def _statement_in_database(self, chunk_size, using):
+        cls = self.__class__
+        connection = connections[using]
+        qn = connection.ops.quote_name
+
+        def select(model, remote_fk, kind_ix, sign):
+            amount_col = qn(model._meta.get_field(
+                model.TOTAL_AMOUNT_FIELD_COLUMN
+            ).column)
+            return (
+                'SELECT {ts} AS ts, {kind_ix} AS kind, {pk} AS entry_id, '
+                '{amount} AS amount, {sign}{amount} AS signed_amount '
+                'FROM {table} WHERE {fk} = %s'
+            ).format(
+                ts=qn(model._meta.get_field('timestamp').column),
+                kind_ix=kind_ix, pk=qn(model._meta.pk.column),
+                amount=amount_col, sign=sign, table=qn(model._meta.db_table),
+                fk=qn(model._meta.get_field(remote_fk).column)
+            )
+
+        debt_model = cls.get_debt_model()
+        payment_model = cls.get_payment_model()
+        sql = (
+            'SELECT s.ts, s.kind, s.entry_id, s.amount, '
+            'SUM(s.signed_amount) OVER ('
+            'ORDER BY s.ts, s.kind, s.entry_id '
+            'ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW'
+            ') FROM (%s UNION ALL %s) s '
+            'ORDER BY s.ts, s.kind, s.entry_id'
+        ) % (
+            select(debt_model, cls.get_debt_remote_fk(), 0, ''),
+            select(payment_model, cls.get_payment_remote_fk(), 1, '-'),
+        )
+
+        # apply the backend's converters, as the ORM would
+        ts_col = debt_model._meta.get_field('timestamp').get_col('s')
+        amount_col = debt_model._meta.get_field(
+            debt_model.TOTAL_AMOUNT_FIELD_COLUMN
+        ).get_col('s')
+
+        def convert(value, col):
+            for converter in connection.ops.get_db_converters(col):
+                value = converter(value, col, connection)
+            return value
+
+        kinds = (STATEMENT_DEBT, STATEMENT_PAYMENT)
+        # a server-side cursor where the backend supports it, so the rows
+        # are actually fetched chunk_size at a time
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(sql, [self.pk, self.pk])
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for timestamp, kind_ix, entry_id, amount, balance in rows:
+                    yield StatementLine(
+                        timestamp=convert(timestamp, ts_col),
+                        entry=kinds[kind_ix], entry_id=entry_id,
+                        amount=decimal_to_money(convert(amount, amount_col)),
+                        balance=decimal_to_money(convert(balance, amount_col))
+                    )
+
+
+class PersistedPaymentTrackingNoMixin(TransactionPartyMixin):
+    """
+    Store the (unformatted) payment tracking number of a transaction party
+    in a unique column, so that OGMs can be resolved with a plain
+    (indexed) lookup.
+    For primary keys below 10^7, the stored number coincides with the
+    computed one. Beyond that, the computed number would wrap around,
+    so a random unused number is assigned instead.
+    Parties created through bulk_create on backends that do not return
+    primary keys (or created before the column was added) can be
+    backfilled with the backfill_payment_tracking_nos management command.
+    """
+
+    # number of attempts to find an unused random tracking number
+    payment_tracking_no_attempts = 20
+
+    stored_payment_tracking_no = models.CharField(
+        max_length=12,
+        verbose_name=_('payment tracking number'),
+        unique=True,
+        null=True,
+        editable=False,
+    )
+
+    class Meta:
+        abstract = True
+
+    def _random_payment_tracking_no(self):
+        type_prefix = self.__class__.payment_tracking_prefix
+        prefix_str = '%s%09d' % (type_prefix, secrets.randbelow(10**9))
+        return ogm_from_prefix(prefix_str, formatted=False)
+
+    def assign_payment_tracking_no(self):
+        cls = self.__class__
+        manager = cls._base_manager
+        if self.pk < 10**7:
+            candidates = [super()._payment_tracking_no(False)]
+        else:
+            candidates = []
+        candidates.extend(
+            self._random_payment_tracking_no()
+            for _ in range(cls.payment_tracking_no_attempts)
+        )
+        for candidate in candidates:
+            try:
+                with transaction.atomic(using=manager.db):
+                    manager.filter(pk=self.pk).update(
+                        stored_payment_tracking_no=candidate
+                    )
+            except IntegrityError:
+                continue
+            self.stored_payment_tracking_no = candidate
+            self.__dict__.pop('payment_tracking_no', None)
+            self.__dict__.pop('raw_payment_tracking_no', None)
+            return candidate
+        raise ValueError(  # pragma: no cover
+            'Could not find an unused payment tracking number for %s.' % self
+        )
+
+    def save(self, **kwargs):
+        super().save(**kwargs)
+        if self.stored_payment_tracking_no is None:
+            self.assign_payment_tracking_no()
+
+    def _payment_tracking_no(self, formatted):
+        raw = self.stored_payment_tracking_no
+        if raw is None:
+            return super()._payment_tracking_no(formatted)
+        return ogm_from_prefix(raw[:10], formatted)
+
+
+class BaseBalanceCheckpoint(models.Model):
+    """
+    Snapshot of the debt and payment totals of a transaction party at a
+    period boundary, to speed up as-of balance queries.
+    Concrete subclasses should declare a foreign key to the transaction
+    party model (ideally unique together with the timestamp).
+    Ledger entries and splits that are recorded (or deleted) after a
+    checkpoint was taken, but take effect before it, delete the checkpoint
+    when they are written through save(), delete() or bulk_create().
+    Other writes, e.g. queryset updates and deletes, bypass this;
+    delete and recreate the checkpoints of the parties involved then.
+    """
+    BALANCE_FIELDS = (
+        'debt_total', 'debt_matched', 'credit_total', 'credit_matched'
+    )
+
+    timestamp = models.DateTimeField(
+        verbose_name=_('timestamp'),
+        db_index=True,
+    )
+
+    debt_total = models.DecimalField(
+        verbose_name=_('debt total'),
+        decimal_places=getattr(settings, 'CURRENCY_DECIMAL_PLACES', 4),
+        max_digits=getattr(settings, 'CURRENCY_MAX_DIGITS', 19),
+    )
+
+    debt_matched = models.DecimalField(
+        verbose_name=_('matched debt amount'),
+        decimal_places=getattr(settings, 'CURRENCY_DECIMAL_PLACES', 4),
+        max_digits=getattr(settings, 'CURRENCY_MAX_DIGITS', 19),
+    )
+
+    credit_total = models.DecimalField(
+        verbose_name=_('credit total'),
+        decimal_places=getattr(settings, 'CURRENCY_DECIMAL_PLACES', 4),
+        max_digits=getattr(settings, 'CURRENCY_MAX_DIGITS', 19),
+    )
+
+    credit_matched = models.DecimalField(
+        verbose_name=_('matched credit amount'),
+        decimal_places=getattr(settings, 'CURRENCY_DECIMAL_PLACES', 4),
+        max_digits=getattr(settings, 'CURRENCY_MAX_DIGITS', 19),
+    )
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def beginning_of_time():
+        # lower bound for timestamps of parties without checkpoints
+        dt = datetime.datetime(1900, 1, 1)
+        if settings.USE_TZ:
+            return timezone.make_aware(dt, timezone=timezone.utc)
+        return dt
+
+    @classmethod
+    def get_party_fk(cls) -> str:
+        try:
+            party_fk, = (
+                f for f in cls._meta.get_fields()
+                if isinstance(f, models.ForeignKey)
+                and issubclass(f.related_model, TransactionPartyMixin)
+            )
+        except ValueError:
+            raise TypeError(
+                'A balance checkpoint model needs exactly one foreign key '
+                'to a transaction party model.'
+            )
+        return party_fk.name
+
+    @classmethod
+    def invalidate(cls, earliest, party_fk=None, chunk_size=200, using=None):
+        """
+        Delete the checkpoints taken at or after the given point in time,
+        for every party. earliest maps party primary keys to timestamps.
+        Returns the number of checkpoints deleted.
+        """
+        party_fk = party_fk or cls.get_party_fk()
+        items = list(earliest.items())
+        deleted = 0
+        for ix in range(0, len(items), chunk_size):
+            condition = Q()
+            for party_id, timestamp in items[ix:ix + chunk_size]:
+                condition |= Q(**{
+                    party_fk: party_id, 'timestamp__gte': timestamp
+                })
+            count, __ = cls._default_manager.db_manager(using)\
+                .filter(condition).delete()
+            deleted += count
+        if deleted:
+            logger.info(
+                'Deleted %d obsolete balance checkpoint(s) of %s.',
+                deleted, cls._meta.label
+            )
+        return deleted
+
+    @classmethod
+    def create_checkpoints(cls, as_of, parties=None, batch_size=500):
+        """
+        Record checkpoints at as_of for the given parties (a queryset),
+        or for all parties. Existing checkpoints at the same timestamp
+        are replaced. Returns the number of checkpoints created.
+        """
+        party_fk = cls.get_party_fk()
+        party_fk_attname = cls._meta.get_field(party_fk).attname
+        if parties is None:
+            party_model = cls._meta.get_field(party_fk).related_model
+            parties = party_model._default_manager.all()
+        with transaction.atomic(using=cls._default_manager.db):
+            cls._default_manager.filter(**{
+                'timestamp': as_of,
+                party_fk + '__in': parties.order_by().values('pk')
+            }).delete()
+            rows = parties.order_by().with_balance_components_as_of(
+                as_of
+            ).values_list(
+                'pk', *(field + '_fromdb' for field in cls.BALANCE_FIELDS)
+            )
+            checkpoints = [
+                cls(**{
+                    party_fk_attname: row[0], 'timestamp': as_of,
+                    **dict(zip(cls.BALANCE_FIELDS, row[1:]))
+                }) for row in rows.iterator()
+            ]
+            cls._default_manager.bulk_create(
+                checkpoints, batch_size=batch_size
+            )
+        return len(checkpoints)
@@ -0,0 +1,281 @@
+"""
+Set-based FIFO apportionment, computed entirely in the database.
+
+To re-apportion a whole ledger (e.g. after a data migration or a bulk
+correction), reconcile_in_database() computes the running sums of the
+open debt balances and of the remaining payment credit of every
+transaction party with window functions. Each split is the overlap of
+a debt range and a payment range of the same party, and all of them are
+written to the split table with a single INSERT ... SELECT, so no ledger
+entries are loaded into Python.
+
+Payments are never applied to debts dated after them: like
+make_payment_splits, a payment only covers the debts up to its own
+timestamp, and whatever credit it has left when it reaches a more recent
+debt stays open. The payment ranges are shifted by the running total of
+the credit left open this way, which is the running maximum of the
+payment total minus the total of the debts dated up to each payment.
+
+This is simpler than make_payment_splits otherwise: there is no exact
+amount matching, and refunds are left alone.
+"""
+import logging
+from typing import Type
+
+from django.conf import settings
+from django.db import connections, router, transaction, NotSupportedError
+from django.db.models import F, Min
+
+from double_entry.models import (
+    TransactionPartyMixin, DoubleBookQuerySet, PersistedBalanceMixin,
+    BaseDebtRecord,
+)
+from double_entry.utils import supports_window_functions
+
+__all__ = ['reconcile_in_database']
+
+logger = logging.getLogger(__name__)
+
+_ENTRY_ID = 'reconcile_entry_id'
+_PARTY_ID = 'reconcile_party_id'
+_TIMESTAMP = 'reconcile_timestamp'
+
+
+def _open_entries(model, party_fk, parties, using):
+    qs = model._default_manager.db_manager(using).unmatched()
+    if parties is not None:
+        qs = qs.filter(**{party_fk + '__in': parties})
+    if issubclass(model, BaseDebtRecord):
+        qs = qs.filter(is_refund=False)
+    return qs
+
+
+def _earliest_open_entries(model, party_fk, parties, using):
+    return dict(
+        _open_entries(model, party_fk, parties, using).order_by()
+        .values(party_fk).annotate(_earliest=Min('timestamp'))
+        .values_list(party_fk, '_earliest')
+    )
+
+
+def _open_entries_sql(model, party_fk, parties, using):
+    qs = _open_entries(model, party_fk, parties, using)
+    qs = qs.order_by().annotate(**{
+        _ENTRY_ID: F('pk'),
+        _PARTY_ID: F(party_fk),
+        _TIMESTAMP: F('timestamp'),
+    }).values_list(
+        _ENTRY_ID, _PARTY_ID, _TIMESTAMP,
+        DoubleBookQuerySet.UNMATCHED_BALANCE_FIELD
+    )
+    return qs.query.get_compiler(using=using).as_sql()
+
+
+def _units_sql(entries_sql, qn, scale, kind=0):
+    """
+    Wrap the query for the open entries, and compute their balances as
+    integers, in units of 1/scale (the smallest amount a split can
+    record). kind is added as a constant column.
+    """
+    # the rounding only absorbs the representation error on backends that
+    # store decimals as floating point numbers, like SQLite
+    return (
+        'SELECT e.{entry_id} AS entry_id, e.{party_id} AS party_id, '
+        'e.{ts} AS ts, {kind} AS kind, '
+        'CAST(ROUND(e.{balance} * {scale}) AS BIGINT) AS units '
+        'FROM ({entries}) e'
+    ).format(
+        entry_id=qn(_ENTRY_ID), party_id=qn(_PARTY_ID), ts=qn(_TIMESTAMP),
+        balance=qn(DoubleBookQuerySet.UNMATCHED_BALANCE_FIELD),
+        kind=kind, scale=scale, entries=entries_sql
+    )
+
+
+def _running_sums_sql(entries_sql, qn, scale):
+    """
+    Compute the balances of the open entries in integer units, together
+    with the running total per party.
+    """
+    return (
+        'SELECT r.entry_id, r.party_id, r.ts, r.units, SUM(r.units) OVER ('
+        'PARTITION BY r.party_id ORDER BY r.ts, r.entry_id '
+        'ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW'
+        ') AS running_total FROM ({units}) r WHERE r.units > 0'
+    ).format(units=_units_sql(entries_sql, qn, scale))
+
+
+def _payment_ranges_sql(debts_sql, payments_sql, qn, scale):
+    """
+    Compute the range of the debt running totals covered by every open
+    payment, as running_total - units up to running_total, skipping the
+    credit that can't be used because the debts are more recent.
+    """
+    window = (
+        'PARTITION BY {t}.party_id ORDER BY {t}.ts, {t}.kind, {t}.entry_id '
+        'ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW'
+    )
+    # the debt total includes the debts dated at the same time as the
+    # payment, since those are ordered first
+    totals = (
+        'SELECT v.entry_id, v.party_id, v.ts, v.kind, '
+        'SUM(CASE WHEN v.kind = 0 THEN v.units ELSE 0 END) OVER ({w}) '
+        'AS debt_total, '
+        'SUM(CASE WHEN v.kind = 1 THEN v.units ELSE 0 END) OVER ({w}) '
+        'AS credit_total '
+        'FROM ({debts} UNION ALL {payments}) v WHERE v.units > 0'
+    ).format(
+        w=window.format(t='v'), debts=_units_sql(debts_sql, qn, scale),
+        payments=_units_sql(payments_sql, qn, scale, kind=1)
+    )
+    # the credit left open so far by payments that ran into more recent
+    # debts
+    unused = (
+        'SELECT t.entry_id, t.party_id, t.ts, t.credit_total, '
+        'MAX(t.credit_total - t.debt_total) OVER ({w}) AS unused '
+        'FROM ({totals}) t WHERE t.kind = 1'
+    ).format(w=window.format(t='t'), totals=totals)
+    used = (
+        'SELECT u.entry_id, u.party_id, u.ts, u.credit_total - '
+        'CASE WHEN u.unused > 0 THEN u.unused ELSE 0 END AS running_total '
+        'FROM ({unused}) u'
+    ).format(unused=unused)
+    return (
+        'SELECT r.entry_id, r.party_id, r.ts, r.running_total, '
+        'r.running_total - LAG(r.running_total, 1, 0) OVER ('
+        'PARTITION BY r.party_id ORDER BY r.ts, r.entry_id'
+        ') AS units FROM ({used}) r'
+    ).format(used=used)
+
+
+def _extra_split_columns(split_model, skip, connection):
+    # other columns on the split table get their default value
+    for field in split_model._meta.concrete_fields:
+        if field.primary_key or field.name in skip:
+            continue
+        value = field.get_default()
+        if value is None and not field.null:
+            raise TypeError(
+                'Field %s of %s has no default value.' % (
+                    field.name, split_model._meta.label
+                )
+            )
+        yield field.column, field.get_db_prep_save(value, connection)
+
+
+def reconcile_in_database(
+        transaction_party_model: Type[TransactionPartyMixin],
+        parties=None) -> int:
+    """
+    Apportion the remaining credit of every transaction party to their
+    open debts in FIFO order, in the database. Pass a list of primary keys
+    as parties to restrict the run to those parties.
+    Persisted balances are refreshed afterwards, and balance checkpoints
+    that the new splits make obsolete are deleted.
+    Returns the number of splits that were created.
+    """
+    debt_model = transaction_party_model.get_debt_model()
+    payment_model = transaction_party_model.get_payment_model()
+    split_model = transaction_party_model.get_split_model()
+    using = router.db_for_write(split_model)
+    connection = connections[using]
+    if not supports_window_functions(connection):
+        raise NotSupportedError(
+            'Reconciliation in the database requires window functions.'
+        )
+    qn = connection.ops.quote_name
+    # the splits are recorded in the default currency, at the precision
+    # of their amount column
+    scale = 10 ** split_model._meta.get_field('amount').decimal_places
+
+    debt_fk = transaction_party_model.get_debt_remote_fk()
+    payment_fk = transaction_party_model.get_payment_remote_fk()
+    debt_sql, debt_params = _open_entries_sql(
+        debt_model, debt_fk, parties, using
+    )
+    payment_sql, payment_params = _open_entries_sql(
+        payment_model, payment_fk, parties, using
+    )
+
+    debt_column = split_model.get_debt_column()
+    payment_column = split_model.get_payment_column()
+    amount_field = split_model._meta.get_field('amount')
+    currency_field = split_model._meta.get_field('amount_currency')
+    extra_columns = list(_extra_split_columns(
+        split_model, {
+            debt_column, payment_column, amount_field.name,
+            currency_field.name
+        }, connection
+    ))
+    columns = [
+        split_model._meta.get_field(debt_column).column,
+        split_model._meta.get_field(payment_column).column,
+        amount_field.column, currency_field.column,
+    ] + [column for column, __ in extra_columns]
+    select_params = [settings.DEFAULT_CURRENCY] + [
+        value for __, value in extra_columns
+    ]
+
+    # the overlap of [d.running_total - d.units, d.running_total)
+    # and [p.running_total - p.units, p.running_total), divided in the
+    # backend's decimal type so the amounts are exact (SQLite doesn't have
+    # one, but stores decimals as floating point numbers anyway)
+    overlap = (
+        'CAST(CASE WHEN d.running_total < p.running_total '
+        'THEN d.running_total ELSE p.running_total END - '
+        'CASE WHEN d.running_total - d.units > p.running_total - p.units '
+        'THEN d.running_total - d.units ELSE p.running_total - p.units END '
+        'AS DECIMAL({digits}, 0))'
+    ).format(digits=amount_field.max_digits)
+    sql = (
+        'INSERT INTO {table} ({columns}) '
+        'SELECT d.entry_id, p.entry_id, {overlap} / {scale}, {params} '
+        'FROM ({debts}) d INNER JOIN ({payments}) p '
+        'ON p.party_id = d.party_id AND p.units > 0 '
+        'AND p.running_total - p.units < d.running_total '
+        'AND d.running_total - d.units < p.running_total'
+    ).format(
+        table=qn(split_model._meta.db_table),
+        columns=', '.join(qn(column) for column in columns),
+        overlap=overlap, scale='%d.0' % scale,
+        params=', '.join(['%s'] * len(select_params)),
+        debts=_running_sums_sql(debt_sql, qn, scale),
+        payments=_payment_ranges_sql(debt_sql, payment_sql, qn, scale),
+    )
+    params = select_params + list(debt_params) + list(debt_params) \
+        + list(payment_params)
+
+    checkpoint_model, checkpoint_fk = \
+        transaction_party_model.get_balance_checkpoint_model()
+    with transaction.atomic(using=using):
+        if checkpoint_model is not None:
+            # no split can come into effect before both the oldest open
+            # debt and the oldest open payment of its party
+            earliest_debts = _earliest_open_entries(
+                debt_model, debt_fk, parties, using
+            )
+            earliest_payments = _earliest_open_entries(
+                payment_model, payment_fk, parties, using
+            )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            created = cursor.rowcount
+        for model, party_fk in ((debt_model, debt_fk),
+                                (payment_model, payment_fk)):
+            if not created or not issubclass(model, PersistedBalanceMixin):
+                continue
+            # only the entries that were open can have new splits, and
+            # their persisted flags haven't been updated yet
+            _open_entries(
+                model, party_fk, parties, using
+            ).refresh_persisted_balances()
+        if checkpoint_model is not None and created:
+            checkpoint_model.invalidate({
+                party_id: max(timestamp, earliest_payments[party_id])
+                for party_id, timestamp in earliest_debts.items()
+                if party_id in earliest_payments
+            }, checkpoint_fk, using=using)
+    logger.info(
+        'Created %d split(s) for %s in the database.',
+        created, transaction_party_model._meta.label
+    )
+    return created
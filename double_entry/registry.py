@@ -0,0 +1,148 @@
+"""
+Registry of the relationships between ledger models.
+
+The split models, the two halves of each ledger, the relations to the
+transaction parties and their balance checkpoints are found through
+reflection once, when the app registry is ready (see
+DoubleEntryAppConfig.ready), and stored in immutable metadata objects.
+Misconfigured ledger models are reported at startup. The accessors on
+the models (get_split_model, get_debt_model, ...) simply look up the
+metadata here, and only fall back to reflection for models that are
+used before the registry is built.
+"""
+from collections import defaultdict
+from dataclasses import dataclass, replace
+from types import MappingProxyType
+from typing import Mapping, Optional, Tuple, Type
+
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured, FieldDoesNotExist
+from django.db import models
+
+__all__ = [
+    'DoubleBookMetadata', 'SplitMetadata', 'TransactionPartyMetadata',
+    'get_metadata', 'get_account_field', 'build_registry',
+]
+
+
+@dataclass(frozen=True)
+class DoubleBookMetadata:
+    split_model: Type[models.Model]
+    split_manager_name: str
+    remote_target_field: str
+    other_half_model: Type[models.Model]
+    # (checkpoint model, name of its party fk, attname of the party fk on
+    # the ledger entry model), see BaseBalanceCheckpoint
+    balance_checkpoint_targets: Tuple[
+        Tuple[Type[models.Model], str, str], ...
+    ] = ()
+
+
+@dataclass(frozen=True)
+class SplitMetadata:
+    double_book_models: Tuple[Tuple[str, Type[models.Model]], ...]
+    debt_column: Optional[str] = None
+    payment_column: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class TransactionPartyMetadata:
+    debts_manager_name: str
+    payments_manager_name: str
+    debt_model: Type[models.Model]
+    payment_model: Type[models.Model]
+    split_model: Type[models.Model]
+    debt_remote_fk: str
+    payment_remote_fk: str
+    debt_remote_fk_column: str
+    payment_remote_fk_column: str
+    checkpoint_model: Optional[Type[models.Model]] = None
+    checkpoint_remote_fk: Optional[str] = None
+
+
+_metadata: Mapping[Type[models.Model], object] = MappingProxyType({})
+# (ledger entry model, transaction party model) -> name of the fk
+_account_fields: Mapping[tuple, str] = MappingProxyType({})
+
+
+def get_metadata(model):
+    """
+    Return the metadata of the given model, or None if the registry
+    hasn't been built yet.
+    """
+    return _metadata.get(model)
+
+
+def get_account_field(entry_model, transaction_party_model):
+    return _account_fields.get((entry_model, transaction_party_model))
+
+
+def _reflect_account_fields(entry_model, party_models):
+    for party_model in party_models:
+        fks = [
+            f.name for f in entry_model._meta.get_fields()
+            if isinstance(f, models.ForeignKey)
+            and f.related_model == party_model
+        ]
+        # ambiguous links have to be configured on the preparator
+        if len(fks) == 1:
+            yield (entry_model, party_model), fks[0]
+
+
+def build_registry():
+    """
+    Reflect on all installed ledger models, and replace the registry.
+    Raises ImproperlyConfigured if any of them is inconsistent.
+    """
+    global _metadata, _account_fields
+    from double_entry.models import (
+        DoubleBookModel, BaseTransactionSplit, TransactionPartyMixin,
+    )
+
+    ledger_classes = (
+        DoubleBookModel, BaseTransactionSplit, TransactionPartyMixin
+    )
+    metadata = {}
+    errors = []
+    for model in apps.get_models():
+        if not issubclass(model, ledger_classes):
+            continue
+        try:
+            metadata[model] = model._reflect_ledger_metadata()
+        except (TypeError, FieldDoesNotExist) as e:
+            errors.append('%s: %s' % (model._meta.label, e))
+    if errors:
+        raise ImproperlyConfigured(
+            'Invalid ledger models:\n' + '\n'.join(errors)
+        )
+
+    party_models = [
+        model for model in metadata
+        if issubclass(model, TransactionPartyMixin)
+    ]
+    account_fields = {}
+    checkpoint_targets = defaultdict(list)
+    for model in list(metadata):
+        if not issubclass(model, DoubleBookModel):
+            continue
+        account_fields.update(_reflect_account_fields(model, party_models))
+        for party_model in party_models:
+            party = metadata[party_model]
+            if party.checkpoint_model is None:
+                continue
+            if issubclass(model, party.debt_model):
+                entry_fk = party.debt_remote_fk
+            elif issubclass(model, party.payment_model):
+                entry_fk = party.payment_remote_fk
+            else:
+                continue
+            checkpoint_targets[model].append((
+                party.checkpoint_model, party.checkpoint_remote_fk,
+                model._meta.get_field(entry_fk).attname
+            ))
+    for model, targets in checkpoint_targets.items():
+        metadata[model] = replace(
+            metadata[model], balance_checkpoint_targets=tuple(targets)
+        )
+    _metadata = MappingProxyType(metadata)
+    _account_fields = MappingProxyType(account_fields)
@@ -0,0 +1,232 @@
+"""
+Read-replica routing for ledger reads.
+
+Add double_entry.routers.LedgerReplicaRouter to DATABASE_ROUTERS and set
+DOUBLE_ENTRY_REPLICA_DATABASE to the alias of a replica of the primary
+database. Reads are only sent to the replica inside a read_from_replica()
+block, which the review paths of the submission pipelines open
+automatically. Commits open a pin_to_primary() block, so that everything
+they read (duplicate checks included) comes from the primary, even when
+called from within a replica block.
+Listings and exports can opt in explicitly by calling on_replica() on a
+ledger or transaction party queryset.
+
+TenantLedgerRouter shards the ledger tables (transaction parties, debts,
+payments, splits and balance checkpoints) per tenant, together with the
+tables of the same apps they refer to through foreign keys (e.g. GnuCash
+categories). Models of other apps, like users, stay shared. Other models
+follow the ledger rows they are accessed through, and relations across
+databases are refused. Map tenants to
+database aliases in DOUBLE_ENTRY_TENANT_DATABASES, and run ledger code
+inside a tenant_context() block. The submission pipelines remember the
+tenant that was active when they were created (or the one passed in
+explicitly), so they can also be handed to worker threads. List the
+tenant router before the replica router, so that tenant reads never end
+up on the shared replica.
+"""
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+__all__ = [
+    'LedgerReplicaRouter', 'get_primary_database', 'get_replica_database',
+    'read_from_replica', 'pin_to_primary', 'replica_alias_for_read',
+    'TenantLedgerRouter', 'tenant_context', 'get_current_tenant',
+    'get_tenant_database', 'get_current_tenant_database',
+]
+
+_PRIMARY = object()
+
+_read_alias = ContextVar('double_entry_read_alias', default=None)
+
+_current_tenant = ContextVar('double_entry_tenant', default=None)
+
+
+def get_primary_database():
+    return getattr(
+        settings, 'DOUBLE_ENTRY_PRIMARY_DATABASE', DEFAULT_DB_ALIAS
+    )
+
+
+def get_replica_database():
+    return getattr(settings, 'DOUBLE_ENTRY_REPLICA_DATABASE', None)
+
+
+def replica_alias_for_read():
+    """
+    Return the replica alias if reads may go to the replica in the
+    current context, and None otherwise.
+    """
+    if _read_alias.get() is _PRIMARY:
+        return None
+    return get_replica_database()
+
+
+@contextmanager
+def read_from_replica():
+    """
+    Route all reads in this block to the replica, unless an enclosing
+    block pinned them to the primary.
+    """
+    current = _read_alias.get()
+    replica = get_replica_database()
+    if current is _PRIMARY or replica is None:
+        yield
+        return
+    token = _read_alias.set(replica)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+@contextmanager
+def pin_to_primary():
+    """
+    Route all reads in this block to the primary.
+    """
+    token = _read_alias.set(_PRIMARY)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class LedgerReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is _PRIMARY:
+            return get_primary_database()
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as the primary
+        replica = get_replica_database()
+        if replica is None:
+            return None
+        aliases = {get_primary_database(), replica}
+        if {obj1._state.db, obj2._state.db} <= aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+def get_tenant_database(tenant):
+    databases = getattr(settings, 'DOUBLE_ENTRY_TENANT_DATABASES', {})
+    try:
+        return databases[tenant]
+    except KeyError:
+        raise ValueError('No database configured for tenant %r.' % tenant)
+
+
+def get_current_tenant():
+    return _current_tenant.get()
+
+
+def get_current_tenant_database():
+    tenant = _current_tenant.get()
+    return None if tenant is None else get_tenant_database(tenant)
+
+
+@contextmanager
+def tenant_context(tenant):
+    """
+    Route all ledger queries in this block to the database of the given
+    tenant. Passing None clears the active tenant.
+    """
+    if tenant is not None:
+        # fail early on unknown tenants
+        get_tenant_database(tenant)
+    token = _current_tenant.set(tenant)
+    try:
+        yield
+    finally:
+        _current_tenant.reset(token)
+
+
+def is_ledger_model(model):
+    from double_entry.models import (
+        DoubleBookModel, BaseTransactionSplit, TransactionPartyMixin,
+        BaseBalanceCheckpoint,
+    )
+    return issubclass(model, (
+        DoubleBookModel, BaseTransactionSplit, TransactionPartyMixin,
+        BaseBalanceCheckpoint
+    ))
+
+
+@functools.lru_cache(maxsize=None)
+def _tenant_models():
+    to_visit = [model for model in apps.get_models() if is_ledger_model(model)]
+    app_labels = {model._meta.app_label for model in to_visit}
+    app_labels.add(apps.get_containing_app_config(__name__).label)
+    models = set()
+    while to_visit:
+        model = to_visit.pop()
+        if model in models:
+            continue
+        models.add(model)
+        to_visit.extend(
+            field.related_model for field in model._meta.concrete_fields
+            if field.is_relation
+            and field.related_model._meta.app_label in app_labels
+        )
+    return frozenset(models)
+
+
+def is_tenant_model(model):
+    """
+    Ledger models and the models of the ledger apps (and double_entry)
+    they (indirectly) refer to through foreign keys are stored in the
+    tenant databases.
+    """
+    return model in _tenant_models()
+
+
+class TenantLedgerRouter:
+
+    def _db_for(self, model, hints):
+        tenant_db = get_current_tenant_database()
+        if tenant_db is None:
+            return None
+        if is_tenant_model(model):
+            return tenant_db
+        # e.g. the reverse side of a foreign key to a ledger model
+        instance = hints.get('instance')
+        if instance is not None and is_tenant_model(type(instance)):
+            return tenant_db
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not (is_tenant_model(type(obj1)) or is_tenant_model(type(obj2))):
+            return None
+        if obj1._state.db == obj2._state.db:
+            return True
+        # tenant databases don't hold the rows of other databases,
+        # primary-replica relations are up to the replica router
+        tenant_dbs = set(
+            getattr(settings, 'DOUBLE_ENTRY_TENANT_DATABASES', {}).values()
+        ) - {get_primary_database()}
+        if {obj1._state.db, obj2._state.db} & tenant_dbs:
+            return False
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # every database holds the full schema
+        return None
@@ -85,6 +85,33 @@ def validated_bulk_query(get_search_param, ignorecase=False):
     return dec
 
 
+def iterate_by_pk(qs, chunk_size=2000):
+    """
+    Iterate over a queryset in chunks of chunk_size rows, paging by primary
+    key (keyset pagination) rather than with OFFSET.
+    Unlike QuerySet.iterator(), this keeps the annotations and prefetches
+    of the queryset, since every chunk is evaluated as a regular queryset.
+    The ordering of the queryset is ignored.
+    """
+    qs = qs.order_by('pk')
+    last_pk = None
+    while True:
+        chunk_qs = qs if last_pk is None else qs.filter(pk__gt=last_pk)
+        chunk = list(chunk_qs[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk
+
+
+def supports_window_functions(connection) -> bool:
+    if connection.features.supports_over_clause:
+        return True
+    # older Django versions don't detect this on SQLite
+    return connection.vendor == 'sqlite' \
+        and connection.Database.sqlite_version_info >= (3, 25, 0)
+
+
 def csv_response(rows, headers, download_name):
     buf = io.StringIO()
     # don't use dictwriter, since we want to be able to translate the headers
@@ -150,6 +177,33 @@ def decimal_to_money(d, currency=None):
     )
 
 
+def amount_decimal_places() -> int:
+    """
+    Number of decimal places of the amounts stored in the MoneyFields of
+    this app, see CURRENCY_DECIMAL_PLACES.
+    """
+    return getattr(settings, 'CURRENCY_DECIMAL_PLACES', 4)
+
+
+def money_to_units(m: Money):
+    """
+    Convert a Money object to a number of units of the smallest amount
+    that the MoneyFields of this app can store (see
+    amount_decimal_places). The currency is dropped.
+    This is an int for any amount that fits in such a field. Amounts with
+    more decimal places are returned as a scaled Decimal instead, so
+    arithmetic on the result stays exact either way.
+    """
+    units = m.amount.scaleb(amount_decimal_places())
+    if units == units.to_integral_value():
+        return int(units)
+    return units
+
+
+def units_to_decimal(units) -> Decimal:
+    return Decimal(units).scaleb(-amount_decimal_places())
+
+
 def parse_ogm(ogm_str, match=None, validate=True):
     m = match or SEARCH_PATTERN.match(ogm_str.strip())
 
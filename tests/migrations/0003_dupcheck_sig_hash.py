@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-16 20:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tests', '0002_persisted_balances'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='persistedcustomerpayment',
+            name='dupcheck_sig_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+    ]
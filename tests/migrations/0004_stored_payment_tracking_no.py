@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-16 20:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tests', '0003_dupcheck_sig_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='persistedcustomer',
+            name='stored_payment_tracking_no',
+            field=models.CharField(editable=False, max_length=12, null=True, unique=True, verbose_name='payment tracking number'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-16 20:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tests', '0004_stored_payment_tracking_no'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimpleCustomerBalanceCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(db_index=True, verbose_name='timestamp')),
+                ('debt_total', models.DecimalField(decimal_places=4, max_digits=19, verbose_name='debt total')),
+                ('debt_matched', models.DecimalField(decimal_places=4, max_digits=19, verbose_name='matched debt amount')),
+                ('credit_total', models.DecimalField(decimal_places=4, max_digits=19, verbose_name='credit total')),
+                ('credit_matched', models.DecimalField(decimal_places=4, max_digits=19, verbose_name='matched credit amount')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_checkpoints', to='tests.SimpleCustomer')),
+            ],
+            options={
+                'unique_together': {('customer', 'timestamp')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-16 21:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tests', '0006_ledger_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimpleCustomerDebtNote',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField()),
+                ('debt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notes', to='tests.SimpleCustomerDebt')),
+            ],
+        ),
+    ]
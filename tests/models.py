@@ -14,6 +14,7 @@ from djmoney.models.fields import MoneyField
 from djmoney.money import Money
 
 from double_entry import models as base
+from double_entry.fallbacks import report_fallback
 from double_entry.forms.bulk_utils import (
     ResolvedTransaction,
     TransactionPartyIndexBuilder,
@@ -47,6 +48,7 @@ class SimpleCustomer(base.TransactionPartyMixin):
         return '%s (id %d)' % (self.name, self.pk)
 
 class SimpleCustomerDebt(base.BaseDebtRecord, base.ConcreteAmountMixin):
+    archive_model = 'tests.ArchivedSimpleCustomerDebt'
     # give different names for more meaningful testing
     debtor = models.ForeignKey(
         SimpleCustomer, on_delete=models.CASCADE,
@@ -63,6 +65,7 @@ class PaymentQuerySet(base.DuplicationProtectedQuerySet, base.BasePaymentQuerySe
 
 class SimpleCustomerPayment(base.BasePaymentRecord, base.ConcreteAmountMixin, base.DuplicationProtectionMixin):
     dupcheck_signature_fields = ('creditor',)
+    archive_model = 'tests.ArchivedSimpleCustomerPayment'
     creditor = models.ForeignKey(
         SimpleCustomer, on_delete=models.CASCADE,
         related_name='payments'
@@ -72,6 +75,8 @@ class SimpleCustomerPayment(base.BasePaymentRecord, base.ConcreteAmountMixin, ba
 
 
 class SimpleCustomerPaymentSplit(base.BaseDebtPaymentSplit):
+    archive_model = 'tests.ArchivedSimpleCustomerPaymentSplit'
+
     payment = models.ForeignKey(
         SimpleCustomerPayment, on_delete=models.CASCADE,
         related_name='payment_splits'
@@ -220,9 +225,29 @@ class ReservationDebtQuerySet(base.BaseDebtQuerySet):
     TOTAL_PRICE_FIELD = 'total_price_fromdb'
     FACE_VALUE_FIELD = 'face_value_fromdb'
 
-    # noinspection DuplicatedCode
     def with_total_price(self):
-        cls = self.__class__
+        return self.with_total_amount()
+
+ReservationDebtManager = base.DoubleBookManager.from_queryset(
+    ReservationDebtQuerySet
+)
+
+class ReservationDebt(base.BaseDebtRecord):
+    TOTAL_AMOUNT_FIELD_COLUMN = ReservationDebtQuerySet.TOTAL_PRICE_FIELD
+
+    owner = models.ForeignKey(
+        TicketCustomer, on_delete=models.CASCADE, related_name='reservations'
+    )
+
+    static_price = models.DecimalField(
+        decimal_places=4, max_digits=19, null=True, blank=True
+    )
+
+    objects = ReservationDebtManager()
+
+    # noinspection DuplicatedCode
+    @classmethod
+    def get_total_amount_annotations(cls):
         actual_reservation_query = Ticket.objects.filter(
             reservation__debt_id=OuterRef('pk')
         ).order_by().values('reservation_id').annotate(
@@ -234,37 +259,18 @@ class ReservationDebtQuerySet(base.BaseDebtQuerySet):
             )
         ).values('_total_ticket_price')
 
-        return self.annotate(**{
-            cls.FACE_VALUE_FIELD: ExpressionWrapper(
+        face_value_field = ReservationDebtQuerySet.FACE_VALUE_FIELD
+        return {
+            face_value_field: ExpressionWrapper(
                 Subquery(actual_reservation_query),
                 output_field=models.DecimalField()
             ),
             # static price takes precedence
-            cls.TOTAL_PRICE_FIELD: ExpressionWrapper(
-                Coalesce(F('static_price'), F(cls.FACE_VALUE_FIELD), 0),
+            ReservationDebtQuerySet.TOTAL_PRICE_FIELD: ExpressionWrapper(
+                Coalesce(F('static_price'), F(face_value_field), 0),
                 output_field=models.DecimalField()
             )
-        })
-
-BaseDebtReservationManager = models.Manager.from_queryset(
-    ReservationDebtQuerySet
-)
-class ReservationDebtManager(BaseDebtReservationManager):
-    def get_queryset(self):
-        return super().get_queryset().with_total_price()
-
-class ReservationDebt(base.BaseDebtRecord):
-    TOTAL_AMOUNT_FIELD_COLUMN = ReservationDebtQuerySet.TOTAL_PRICE_FIELD
-
-    owner = models.ForeignKey(
-        TicketCustomer, on_delete=models.CASCADE, related_name='reservations'
-    )
-
-    static_price = models.DecimalField(
-        decimal_places=4, max_digits=19, null=True, blank=True
-    )
-
-    objects = ReservationDebtManager()
+        }
 
     # noinspection DuplicatedCode
     @property
@@ -277,10 +283,14 @@ class ReservationDebt(base.BaseDebtRecord):
             )
         except AttributeError:
             # no prefetch or annotation => database deluge :(
-            # TODO: detect prefetch and warn if not present
+            reservation = self.reservation
+            tickets = reservation.tickets.all()
+            prefetched = getattr(reservation, '_prefetched_objects_cache', {})
+            if 'tickets' not in prefetched or not all(
+                    Ticket.category.is_cached(ticket) for ticket in tickets):
+                report_fallback('total_amount', self)
             return sum(
-                (ticket.count * ticket.category.price
-                 for ticket in self.reservation.tickets.all()),
+                (ticket.count * ticket.category.price for ticket in tickets),
                 Money(Decimal('0.00'), settings.DEFAULT_CURRENCY)
             )
 
@@ -361,3 +371,103 @@ class ReservationPreparator(DuplicationProtectedPreparator, StandardCreditApport
         if self.no_refunds:
             return None
         return GnuCashCategory.get_category('refund')
+
+
+class PersistedCustomer(base.PersistedPaymentTrackingNoMixin):
+    payment_tracking_prefix = 3
+    name = models.CharField(max_length=100)
+
+    def __str__(self):
+        return '%s (id %d)' % (self.name, self.pk)
+
+
+class PersistedCustomerDebt(base.BaseDebtRecord, base.ConcreteAmountMixin,
+                            base.PersistedBalanceMixin):
+    debtor = models.ForeignKey(
+        PersistedCustomer, on_delete=models.CASCADE,
+        related_name='debts'
+    )
+
+
+class PersistedCustomerPaymentQuerySet(base.BasePaymentQuerySet,
+                                       base.DuplicationProtectedQuerySet):
+    pass
+
+
+class PersistedCustomerPayment(base.BasePaymentRecord, base.ConcreteAmountMixin,
+                               base.PersistedBalanceMixin,
+                               base.DupcheckSignatureHashMixin):
+    dupcheck_signature_fields = ('creditor',)
+    creditor = models.ForeignKey(
+        PersistedCustomer, on_delete=models.CASCADE,
+        related_name='payments'
+    )
+
+    objects = PersistedCustomerPaymentQuerySet.as_manager()
+
+
+class PersistedCustomerPaymentSplit(base.BaseDebtPaymentSplit):
+    payment = models.ForeignKey(
+        PersistedCustomerPayment, on_delete=models.CASCADE,
+        related_name='payment_splits'
+    )
+    debt = models.ForeignKey(
+        PersistedCustomerDebt, on_delete=models.CASCADE,
+        related_name='debt_splits'
+    )
+
+
+class PersistedPreparator(DuplicationProtectedPreparator,
+                          StandardCreditApportionmentMixin):
+    transaction_party_model = PersistedCustomer
+
+    def get_refund_credit_gnucash_account(self, debt_key):
+        return GnuCashCategory.get_category('refund')
+
+
+class SimpleCustomerBalanceCheckpoint(base.BaseBalanceCheckpoint):
+    customer = models.ForeignKey(
+        SimpleCustomer, on_delete=models.CASCADE,
+        related_name='balance_checkpoints'
+    )
+
+    class Meta:
+        unique_together = ('customer', 'timestamp')
+
+
+class ArchivedSimpleCustomerDebt(models.Model):
+    id = models.IntegerField(primary_key=True)
+    timestamp = models.DateTimeField()
+    total_amount = MoneyField(decimal_places=4, max_digits=19)
+    debtor = models.ForeignKey(
+        SimpleCustomer, on_delete=models.CASCADE, related_name='+'
+    )
+
+
+class ArchivedSimpleCustomerPayment(models.Model):
+    id = models.IntegerField(primary_key=True)
+    timestamp = models.DateTimeField()
+    total_amount = MoneyField(decimal_places=4, max_digits=19)
+    creditor = models.ForeignKey(
+        SimpleCustomer, on_delete=models.CASCADE, related_name='+'
+    )
+
+
+class ArchivedSimpleCustomerPaymentSplit(models.Model):
+    id = models.IntegerField(primary_key=True)
+    amount = MoneyField(decimal_places=4, max_digits=19)
+    payment = models.ForeignKey(
+        ArchivedSimpleCustomerPayment, on_delete=models.CASCADE,
+        related_name='+'
+    )
+    debt = models.ForeignKey(
+        ArchivedSimpleCustomerDebt, on_delete=models.CASCADE,
+        related_name='+'
+    )
+
+
+class SimpleCustomerDebtNote(models.Model):
+    debt = models.ForeignKey(
+        SimpleCustomerDebt, on_delete=models.CASCADE, related_name='notes'
+    )
+    text = models.TextField()
@@ -0,0 +1,444 @@
+import datetime
+from decimal import Decimal
+import itertools
+import random
+from unittest import mock, skipUnless
+
+from django.db.models import signals
+from django.test import TestCase
+from djmoney.money import Money
+from hypothesis import given, settings, strategies as st
+from hypothesis.extra import django as hypothesis_django
+
+from double_entry import apportionment
+from double_entry.apportionment import (
+    ENGINE_PYTHON, ENGINE_NUMPY, numpy_available,
+)
+from double_entry.forms.bulk_utils import (
+    make_payment_splits, bounded_subset_sum,
+)
+from double_entry.utils import money_to_units, units_to_decimal
+from . import models
+
+BASE_DATE = datetime.datetime(2019, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def debt(pk, amount, day, is_refund=False):
+    d = models.SimpleCustomerDebt(
+        pk=pk, debtor_id=1, total_amount=Money(amount, 'EUR'),
+        timestamp=BASE_DATE + datetime.timedelta(days=day),
+        is_refund=is_refund
+    )
+    d.spoof_matched_balance(0)
+    return d
+
+
+def payment(pk, amount, day):
+    p = models.SimpleCustomerPayment(
+        pk=pk, creditor_id=1, total_amount=Money(amount, 'EUR'),
+        timestamp=BASE_DATE + datetime.timedelta(days=day)
+    )
+    p.spoof_matched_balance(0)
+    return p
+
+
+def apportion(payments, debts, **kwargs):
+    gen = make_payment_splits(
+        payments, debts, models.SimpleCustomerPaymentSplit, **kwargs
+    )
+    splits = []
+    while True:
+        try:
+            splits.append(next(gen))
+        except StopIteration as e:
+            return splits, e.value
+
+
+def scan_exact_matches(payments, debts):
+    """
+    Reference implementation of the exact amount matching phase:
+    a linear scan over the remaining debts for every payment.
+    """
+    debt_list = list(debts)
+    matches = []
+    for p in payments:
+        match = next(
+            (d for d in debt_list
+             if d.balance == p.credit_remaining
+             and d.timestamp <= p.timestamp and not d.is_refund), None
+        )
+        if match is not None:
+            debt_list.remove(match)
+            matches.append((p.pk, match.pk))
+    return matches, [d.pk for d in debt_list]
+
+
+class TestExactAmountMatching(TestCase):
+
+    def test_oldest_eligible_debt(self):
+        debts = [
+            debt(1, 10, 0), debt(2, 10, 1), debt(3, 20, 2), debt(4, 10, 5)
+        ]
+        payments = [payment(1, 10, 3), payment(2, 10, 3), payment(3, 10, 4)]
+        splits, result = apportion(
+            payments, debts, exact_amount_match_only=True
+        )
+        self.assertEqual(
+            [(s.payment.pk, s.debt.pk) for s in splits], [(1, 1), (2, 2)]
+        )
+        # debt 4 is more recent than payment 3
+        self.assertEqual([p.pk for p in result.remaining_payments], [3])
+        self.assertEqual([d.pk for d in result.remaining_debts], [3, 4])
+        self.assertEqual([d.pk for d in result.fully_paid_debts], [1, 2])
+
+    def test_refunds_excluded(self):
+        debts = [debt(1, 10, 0, is_refund=True), debt(2, 10, 1)]
+        splits, result = apportion(
+            [payment(1, 10, 2)], debts, exact_amount_match_only=True
+        )
+        self.assertEqual([(s.payment.pk, s.debt.pk) for s in splits], [(1, 2)])
+        self.assertEqual([d.pk for d in result.remaining_debts], [1])
+
+    def test_remaining_debts_keep_order(self):
+        debts = [debt(1, 5, 0), debt(2, 10, 1), debt(3, 7, 2)]
+        payments = [payment(1, 10, 3), payment(2, 12, 3)]
+        splits, result = apportion(payments, debts)
+        self.assertEqual(
+            [(s.payment.pk, s.debt.pk, s.amount) for s in splits], [
+                (1, 2, Money(10, 'EUR')), (2, 1, Money(5, 'EUR')),
+                (2, 3, Money(7, 'EUR')),
+            ]
+        )
+        self.assertEqual(result.remaining_debts, [])
+        self.assertEqual(result.remaining_payments, [])
+
+    def test_matches_linear_scan(self):
+        rng = random.Random(1729)
+        amounts = [5, 10, 15, 20]
+        for _ in range(20):
+            debts = [
+                debt(i, rng.choice(amounts), rng.randrange(30),
+                     is_refund=rng.random() < 0.1)
+                for i in range(1, 40)
+            ]
+            debts.sort(key=lambda d: d.timestamp)
+            payments = [
+                payment(i, rng.choice(amounts), rng.randrange(30))
+                for i in range(1, 30)
+            ]
+            payments.sort(key=lambda p: p.timestamp)
+            expected_matches, expected_remaining = scan_exact_matches(
+                payments, debts
+            )
+            splits, result = apportion(
+                payments, debts, exact_amount_match_only=True
+            )
+            self.assertEqual(
+                [(s.payment.pk, s.debt.pk) for s in splits], expected_matches
+            )
+            self.assertEqual(
+                [d.pk for d in result.remaining_debts], expected_remaining
+            )
+
+
+class TestDebtSubsetMatching(TestCase):
+
+    def test_bounded_subset_sum(self):
+        self.assertEqual(bounded_subset_sum([5, 3, 7, 2], 10, 3), (1, 2))
+        self.assertEqual(bounded_subset_sum([5, 3, 2, 7], 10, 2), (1, 3))
+        self.assertEqual(bounded_subset_sum([5, 3, 2, 9], 10, 3), (0, 1, 2))
+        self.assertIsNone(bounded_subset_sum([4, 4, 4], 10, 3))
+        self.assertIsNone(bounded_subset_sum([5, 5], 0, 3))
+        self.assertIsNone(bounded_subset_sum([1, 2, 3, 4], 10, 3))
+
+    def test_matches_brute_force(self):
+        rng = random.Random(1729)
+        for _ in range(200):
+            values = [rng.randrange(-2, 15) for _ in range(8)]
+            target = rng.randrange(1, 30)
+            expected = next((
+                subset for size in range(1, 4)
+                for subset in itertools.combinations(range(8), size)
+                if sum(values[ix] for ix in subset) == target
+                and all(values[ix] > 0 for ix in subset)
+            ), None)
+            self.assertEqual(
+                bounded_subset_sum(values, target, 3), expected
+            )
+
+    def test_smallest_oldest_subset(self):
+        debts = [
+            debt(1, 4, 0), debt(2, 6, 1), debt(3, 3, 1),
+            debt(4, 7, 2), debt(5, 12, 3),
+        ]
+        splits, result = apportion(
+            [payment(1, 10, 4)], debts, exact_amount_match_only=True,
+            match_debt_subsets=True
+        )
+        self.assertEqual(
+            [(s.payment.pk, s.debt.pk, s.amount) for s in splits],
+            [(1, 1, Money(4, 'EUR')), (1, 2, Money(6, 'EUR'))]
+        )
+        self.assertEqual([d.pk for d in result.fully_paid_debts], [1, 2])
+        self.assertEqual([d.pk for d in result.remaining_debts], [3, 4, 5])
+        self.assertEqual([p.pk for p in result.fully_used_payments], [1])
+        self.assertEqual(
+            [d.balance for d in debts[:2]], [Money(0, 'EUR')] * 2
+        )
+
+    def test_single_debt_first(self):
+        debts = [debt(1, 4, 0), debt(2, 6, 1), debt(3, 10, 2)]
+        splits, __ = apportion(
+            [payment(1, 10, 4)], debts, exact_amount_match_only=True,
+            match_debt_subsets=True
+        )
+        self.assertEqual([s.debt.pk for s in splits], [3])
+
+    def test_disabled_by_default(self):
+        debts = [debt(1, 4, 0), debt(2, 6, 1)]
+        splits, result = apportion(
+            [payment(1, 10, 4)], debts, exact_amount_match_only=True
+        )
+        self.assertEqual(splits, [])
+        self.assertEqual([p.pk for p in result.remaining_payments], [1])
+
+    def test_debts_after_payment(self):
+        debts = [debt(1, 4, 0), debt(2, 6, 5)]
+        splits, result = apportion(
+            [payment(1, 10, 4)], debts, exact_amount_match_only=True,
+            match_debt_subsets=True
+        )
+        self.assertEqual(splits, [])
+        self.assertEqual([p.pk for p in result.remaining_payments], [1])
+
+    def test_refunds_excluded(self):
+        debts = [debt(1, 4, 0, is_refund=True), debt(2, 6, 1)]
+        splits, __ = apportion(
+            [payment(1, 10, 4)], debts, exact_amount_match_only=True,
+            match_debt_subsets=True
+        )
+        self.assertEqual(splits, [])
+
+    def test_caps(self):
+        debts = [debt(1, 2, 0), debt(2, 3, 0), debt(3, 5, 0)]
+        splits, __ = apportion(
+            [payment(1, 10, 1)], debts, exact_amount_match_only=True,
+            match_debt_subsets=True, subset_max_size=2
+        )
+        self.assertEqual(splits, [])
+        debts = [debt(1, 1, 0), debt(2, 1, 0), debt(3, 9, 0)]
+        splits, __ = apportion(
+            [payment(1, 10, 1)], debts, exact_amount_match_only=True,
+            match_debt_subsets=True, subset_max_debts=2
+        )
+        self.assertEqual(splits, [])
+
+    def test_matched_debts_not_reused(self):
+        debts = [debt(1, 4, 0), debt(2, 6, 1), debt(3, 4, 2), debt(4, 6, 2)]
+        payments = [payment(1, 10, 3), payment(2, 4, 3), payment(3, 10, 3)]
+        splits, result = apportion(
+            payments, debts, exact_amount_match_only=True,
+            match_debt_subsets=True
+        )
+        self.assertEqual(
+            [(s.payment.pk, s.debt.pk) for s in splits],
+            [(1, 1), (1, 2), (2, 3)]
+        )
+        self.assertEqual([p.pk for p in result.remaining_payments], [3])
+        self.assertEqual([d.pk for d in result.remaining_debts], [4])
+
+    def test_fifo_afterwards(self):
+        debts = [debt(1, 4, 0), debt(2, 6, 1), debt(3, 8, 2)]
+        payments = [payment(1, 10, 3), payment(2, 5, 3)]
+        splits, result = apportion(
+            payments, debts, match_debt_subsets=True
+        )
+        self.assertEqual(
+            [(s.payment.pk, s.debt.pk, s.amount) for s in splits], [
+                (1, 1, Money(4, 'EUR')), (1, 2, Money(6, 'EUR')),
+                (2, 3, Money(5, 'EUR')),
+            ]
+        )
+        self.assertEqual(debts[2].balance, Money(3, 'EUR'))
+        self.assertEqual(result.remaining_debts, [debts[2]])
+
+
+class TestAmountUnits(TestCase):
+
+    def test_conversion(self):
+        self.assertEqual(money_to_units(Money('12.34', 'EUR')), 123400)
+        self.assertEqual(money_to_units(Money('-0.5', 'EUR')), -5000)
+        self.assertEqual(money_to_units(Money('1234', 'JPY')), 12340000)
+        self.assertEqual(units_to_decimal(123400), Decimal('12.34'))
+
+    def test_sub_cent(self):
+        # anything a MoneyField can store converts exactly
+        self.assertEqual(money_to_units(Money('10.005', 'EUR')), 100050)
+        self.assertEqual(money_to_units(Money('1.234', 'BHD')), 12340)
+        # more precise amounts are kept as a Decimal
+        units = money_to_units(Money('0.00005', 'EUR'))
+        self.assertEqual(units, Decimal('0.5'))
+        self.assertEqual(units_to_decimal(units), Decimal('0.00005'))
+
+    def test_sub_cent_amounts(self):
+        # stored amounts can have more decimal places than the currency;
+        # the balances are rounded to cents, as before
+        for engine in (ENGINE_PYTHON, ENGINE_NUMPY):
+            debts = [debt(1, '10.005', 0), debt(2, '0.0001', 1)]
+            payments = [payment(1, '10.0149', 2)]
+            splits, result = apportion(
+                payments, debts, prioritise_exact_amount_match=False,
+                engine=engine
+            )
+            self.assertEqual(
+                [s.amount for s in splits], [Money('10.00', 'EUR')]
+            )
+            self.assertEqual(result.fully_paid_debts, debts)
+            self.assertEqual(result.remaining_payments, payments)
+            self.assertEqual(payments[0].credit_remaining, Money('0.01', 'EUR'))
+
+    def test_cent_amounts(self):
+        debts = [
+            debt(1, Decimal('0.10'), 0), debt(2, Decimal('0.20'), 1),
+            debt(3, Decimal('10.05'), 1),
+        ]
+        payments = [payment(1, Decimal('0.30'), 2), payment(2, '5.01', 2)]
+        splits, result = apportion(
+            payments, debts, prioritise_exact_amount_match=False
+        )
+        self.assertEqual(
+            [s.amount for s in splits], [
+                Money('0.10', 'EUR'), Money('0.20', 'EUR'),
+                Money('5.01', 'EUR'),
+            ]
+        )
+        d1, d2, d3 = debts
+        self.assertEqual(result.fully_paid_debts, [d1, d2])
+        self.assertEqual(result.remaining_debts, [d3])
+        self.assertEqual(d3.balance, Money('5.04', 'EUR'))
+        self.assertEqual(result.fully_used_payments, payments)
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            apportion([], [], engine='fortran')
+
+
+def build_entries(debt_specs, payment_specs):
+    debts = [
+        debt(pk, Decimal(cents).scaleb(-2), day, is_refund=is_refund)
+        for pk, (cents, day, is_refund) in enumerate(debt_specs, start=1)
+    ]
+    payments = [
+        payment(pk, Decimal(cents).scaleb(-2), day)
+        for pk, (cents, day) in enumerate(payment_specs, start=1)
+    ]
+    debts.sort(key=lambda d: d.timestamp)
+    payments.sort(key=lambda p: p.timestamp)
+    return payments, debts
+
+
+def apportionment_outcome(debt_specs, payment_specs, **kwargs):
+    payments, debts = build_entries(debt_specs, payment_specs)
+    splits, result = apportion(payments, debts, **kwargs)
+    return (
+        [
+            (s.payment.pk, s.debt.pk, s.payment_id, s.debt_id, s.amount,
+             s._state.db, s._state.adding)
+            for s in splits
+        ],
+        [[e.pk for e in entries] for entries in (
+            result.fully_used_payments, result.remaining_payments,
+            result.fully_paid_debts, result.remaining_debts
+        )],
+        [(p.pk, p.matched_balance) for p in payments],
+        [(d.pk, d.matched_balance) for d in debts],
+    )
+
+
+amounts = st.integers(min_value=-500, max_value=5000) | st.sampled_from(
+    [0, 500, 1000]
+)
+days = st.integers(min_value=0, max_value=10)
+
+
+@skipUnless(numpy_available(), 'NumPy is not installed')
+class TestNumpyEngine(hypothesis_django.TestCase):
+
+    def assertSameOutcome(self, debt_specs, payment_specs, **kwargs):
+        self.assertEqual(
+            apportionment_outcome(
+                debt_specs, payment_specs, engine=ENGINE_PYTHON, **kwargs
+            ),
+            apportionment_outcome(
+                debt_specs, payment_specs, engine=ENGINE_NUMPY, **kwargs
+            ),
+        )
+
+    def test_payment_too_old(self):
+        # the first payment has to be given up on halfway through
+        self.assertSameOutcome(
+            [(1000, 0, False), (1000, 5, False), (500, 6, False)],
+            [(1500, 1), (2000, 5)],
+            prioritise_exact_amount_match=False
+        )
+
+    def test_save_splits(self):
+        models.SimpleCustomer.objects.create(pk=1, name='Alice')
+        payments, debts = build_entries(
+            [(1000, 0, False), (1000, 5, False), (500, 6, False)],
+            [(1500, 1), (2000, 5)],
+        )
+        for entry in payments + debts:
+            entry.save()
+        splits, __ = apportion(
+            payments, debts, engine=ENGINE_NUMPY,
+            prioritise_exact_amount_match=False
+        )
+        models.SimpleCustomerPaymentSplit.objects.bulk_create(splits)
+        self.assertEqual(
+            sorted(models.SimpleCustomerPaymentSplit.objects.values_list(
+                'payment_id', 'debt_id', 'amount'
+            )), sorted(
+                (s.payment_id, s.debt_id, s.amount.amount) for s in splits
+            )
+        )
+
+    def test_init_signals(self):
+        inits = []
+
+        def receiver(instance, **kwargs):
+            inits.append(instance)
+
+        signals.post_init.connect(
+            receiver, sender=models.SimpleCustomerPaymentSplit
+        )
+        self.addCleanup(
+            signals.post_init.disconnect, receiver,
+            sender=models.SimpleCustomerPaymentSplit
+        )
+        payments, debts = build_entries(
+            [(1000, 0, False), (1000, 1, False)], [(3000, 2)]
+        )
+        splits, __ = apportion(
+            payments, debts, engine=ENGINE_NUMPY,
+            prioritise_exact_amount_match=False
+        )
+        self.assertEqual(len(splits), 2)
+        self.assertEqual(inits, splits)
+
+    @settings(max_examples=300, deadline=None)
+    @given(
+        debt_specs=st.lists(st.tuples(amounts, days, st.booleans())),
+        payment_specs=st.lists(st.tuples(amounts, days)),
+        prioritise_exact_amount_match=st.booleans(),
+        window=st.sampled_from([(1, 1), (1, 4), (64, 1 << 16)]),
+    )
+    def test_same_outcome(self, debt_specs, payment_specs,
+                          prioritise_exact_amount_match, window):
+        min_window, max_window = window
+        with mock.patch.object(apportionment, 'MIN_WINDOW', min_window), \
+                mock.patch.object(apportionment, 'MAX_WINDOW', max_window):
+            self.assertSameOutcome(
+                debt_specs, payment_specs,
+                prioritise_exact_amount_match=prioritise_exact_amount_match
+            )
@@ -0,0 +1,113 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+import pytz
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+from djmoney.money import Money
+
+from double_entry.archive import archive_fully_matched
+from tests import models
+
+CUTOFF = datetime.datetime(2020, 1, 1, tzinfo=pytz.utc)
+
+
+class TestArchive(TestCase):
+    fixtures = ['simple.json']
+
+    def setUp(self):
+        # a fully paid debt, paid with a payment that still has credit left
+        ts = datetime.datetime(2019, 9, 1, tzinfo=pytz.utc)
+        self.linked_debt = models.SimpleCustomerDebt.objects.create(
+            debtor_id=3, total_amount=Money(10, 'EUR'), timestamp=ts
+        )
+        payment = models.SimpleCustomerPayment.objects.create(
+            creditor_id=3, total_amount=Money(30, 'EUR'), timestamp=ts
+        )
+        models.SimpleCustomerPaymentSplit.objects.create(
+            debt=self.linked_debt, payment=payment, amount=Money(10, 'EUR')
+        )
+
+    def test_archive(self):
+        unpaid_before = set(
+            models.SimpleCustomerDebt.objects.unpaid().values_list(
+                'pk', flat=True
+            )
+        )
+        self.assertEqual(
+            archive_fully_matched(models.SimpleCustomerDebt, CUTOFF),
+            (1, 1, 1)
+        )
+        self.assertFalse(
+            models.SimpleCustomerDebt.objects.filter(pk=2).exists()
+        )
+        # connected to a payment with credit remaining
+        self.assertTrue(
+            models.SimpleCustomerDebt.objects.filter(
+                pk=self.linked_debt.pk
+            ).exists()
+        )
+        archived = models.ArchivedSimpleCustomerDebt.objects.get(pk=2)
+        self.assertEqual(archived.total_amount, Money(24, 'EUR'))
+        self.assertEqual(
+            models.ArchivedSimpleCustomerPaymentSplit.objects.get().debt_id, 2
+        )
+        self.assertEqual(
+            set(models.SimpleCustomerDebt.objects.unpaid().values_list(
+                'pk', flat=True
+            )), unpaid_before
+        )
+        customer = models.SimpleCustomer.objects.with_debt_balances().get(
+            pk=2
+        )
+        self.assertFalse(customer.debt_balance)
+
+        debts = models.SimpleCustomerDebt.objects.with_archived(
+            'pk', 'debtor_id', debtor_id=2
+        )
+        self.assertEqual(list(debts), [{'pk': 2, 'debtor_id': 2}])
+
+    def test_checkpoint_at_cutoff(self):
+        as_of = CUTOFF + datetime.timedelta(days=1)
+        balances = models.SimpleCustomer.objects.with_balances_as_of(
+            as_of
+        ).values_list('pk', 'debt_balance_fromdb', 'credit_balance_fromdb')
+        before = set(balances)
+        checkpoints = models.SimpleCustomerBalanceCheckpoint
+        with mock.patch.object(
+                checkpoints, 'create_checkpoints',
+                wraps=checkpoints.create_checkpoints) as create:
+            archive_fully_matched(models.SimpleCustomerDebt, CUTOFF)
+        # the party has archived debts and payments, but is only
+        # checkpointed once
+        create.assert_called_once()
+        checkpoint = models.SimpleCustomerBalanceCheckpoint.objects.get()
+        self.assertEqual(checkpoint.customer_id, 2)
+        self.assertEqual(checkpoint.timestamp, CUTOFF)
+        self.assertEqual(set(balances.all()), before)
+
+    def test_refuse_dependents(self):
+        models.SimpleCustomerDebtNote.objects.create(debt_id=2, text='note')
+        with self.assertRaises(ValueError):
+            archive_fully_matched(models.SimpleCustomerDebt, CUTOFF)
+        self.assertTrue(
+            models.SimpleCustomerDebt.objects.filter(pk=2).exists()
+        )
+        self.assertTrue(models.SimpleCustomerDebtNote.objects.exists())
+        self.assertFalse(models.ArchivedSimpleCustomerDebt.objects.exists())
+        with self.assertRaises(CommandError):
+            call_command(
+                'archive_ledger_entries', '--before', '2020-01-01',
+                stdout=StringIO()
+            )
+
+    def test_command(self):
+        out = StringIO()
+        call_command(
+            'archive_ledger_entries', '--before', '2020-01-01', stdout=out
+        )
+        self.assertIn(
+            'tests.SimpleCustomerDebt: archived 1 debt(s), 1 payment(s) '
+            'and 1 split(s).', out.getvalue()
+        )
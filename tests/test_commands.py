@@ -0,0 +1,40 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.test import TestCase
+
+
+class TestIndexAdvisor(TestCase):
+
+    def test_report(self):
+        out = StringIO()
+        call_command('suggest_ledger_indexes', stdout=out)
+        report = out.getvalue()
+        self.assertIn(
+            'MISSING: tests.SimpleCustomerPayment (creditor_id, timestamp)',
+            report
+        )
+        self.assertIn(
+            'MISSING: tests.SimpleCustomerPaymentSplit (payment_id, debt_id)',
+            report
+        )
+        # covered by unique_together
+        self.assertIn(
+            'OK: tests.SimpleCustomerBalanceCheckpoint (customer_id, timestamp)',
+            report
+        )
+
+    def test_emit_migration(self):
+        out = StringIO()
+        call_command(
+            'suggest_ledger_indexes', emit_migration=True, dry_run=True,
+            stdout=out
+        )
+        migration = out.getvalue()
+        self.assertIn('migrations.SeparateDatabaseAndState(', migration)
+        self.assertIn("fields=['creditor', 'timestamp']", migration)
+        # depends on the latest migration of the app
+        leaf, = MigrationLoader(connection).graph.leaf_nodes('tests')
+        self.assertIn(repr(leaf), migration)
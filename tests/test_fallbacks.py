@@ -0,0 +1,85 @@
+from unittest import mock
+
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+
+from double_entry import fallbacks
+from double_entry.fallbacks import (
+    collect_fallbacks, LedgerFallbackError, FallbackStatsMiddleware,
+)
+from tests import models
+
+
+class TestFallbacks(TestCase):
+    fixtures = ['simple.json', 'reservations.json']
+
+    def test_count(self):
+        with collect_fallbacks() as stats:
+            for debt in models.SimpleCustomerDebt.objects.all():
+                debt.balance
+            for debt in models.SimpleCustomerDebt.objects.with_payments():
+                debt.balance
+            customers = models.SimpleCustomer.objects.with_debts_and_payments()
+            for customer in customers:
+                customer.debt_balance
+                customer.to_refund
+        debt_count = models.SimpleCustomerDebt.objects.count()
+        self.assertEqual(stats.total, debt_count)
+        self.assertEqual(
+            stats.counts[('matched_balance', 'tests.SimpleCustomerDebt')],
+            debt_count
+        )
+        self.assertFalse(stats.call_sites)
+
+        with collect_fallbacks() as stats:
+            models.SimpleCustomer.objects.get(pk=1).debt_balance
+        self.assertEqual(
+            stats.counts[('debt_balance', 'tests.SimpleCustomer')], 1
+        )
+
+    def test_prefetched_tickets(self):
+        debts = models.ReservationDebt._base_manager.filter(
+            static_price__isnull=True
+        )
+        with collect_fallbacks() as stats:
+            for debt in debts.prefetch_related('reservation__tickets__category'):
+                debt.total_amount
+        self.assertEqual(stats.total, 0)
+        with collect_fallbacks() as stats:
+            for debt in debts.prefetch_related('reservation__tickets'):
+                debt.total_amount
+        self.assertEqual(
+            stats.counts[('total_amount', 'tests.ReservationDebt')],
+            debts.count()
+        )
+
+    def test_stacks(self):
+        with mock.patch.object(fallbacks.traceback, 'format_stack') as fs:
+            models.SimpleCustomerDebt.objects.get(pk=1).balance
+        fs.assert_not_called()
+        with override_settings(DOUBLE_ENTRY_FALLBACK_STACKS=True):
+            with collect_fallbacks() as stats:
+                models.SimpleCustomerDebt.objects.get(pk=1).balance
+        call_site, = stats.call_sites
+        self.assertIn('test_stacks', call_site)
+
+    @override_settings(DOUBLE_ENTRY_FALLBACKS='raise')
+    def test_raise(self):
+        debt = models.SimpleCustomerDebt.objects.get(pk=1)
+        with self.assertRaises(LedgerFallbackError):
+            debt.balance
+        debt = models.SimpleCustomerDebt.objects.with_payments().get(pk=1)
+        debt.balance
+
+    def test_middleware(self):
+        def view(request):
+            models.SimpleCustomerDebt.objects.get(pk=1).balance
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        with self.assertLogs('double_entry.fallbacks', 'INFO') as logs:
+            FallbackStatsMiddleware(view)(request)
+        self.assertEqual(request.ledger_fallbacks.total, 1)
+        self.assertIn(
+            'matched_balance on tests.SimpleCustomerDebt: 1', logs.output[0]
+        )
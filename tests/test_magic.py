@@ -1,5 +1,11 @@
+import dataclasses
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
 
+from double_entry import registry
+
 from tests import models
 
 class TestSimpleMagic(TestCase):
@@ -136,3 +142,75 @@ class TestComplexMagic(TestCase):
         self.assertEqual(
             models.TicketCustomer.get_payment_remote_fk_column(), 'customer_id'
         )
+
+
+class TestRegistry(TestCase):
+
+    def test_lookups(self):
+        metadata = registry.get_metadata(models.SimpleCustomer)
+        self.assertEqual(metadata.debt_model, models.SimpleCustomerDebt)
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            metadata.debt_model = models.ReservationDebt
+        self.assertEqual(
+            registry.get_account_field(
+                models.SimpleCustomerPayment, models.SimpleCustomer
+            ), 'creditor'
+        )
+        # no reflection after startup
+        reflect = mock.Mock(side_effect=AssertionError)
+        with mock.patch.object(
+                models.SimpleCustomer, '_reflect_ledger_metadata', reflect), \
+                mock.patch.object(
+                    models.SimpleCustomerDebt, '_reflect_ledger_metadata',
+                    reflect
+                ):
+            self.assertEqual(
+                models.SimpleCustomer.get_debt_remote_fk(), 'debtor'
+            )
+            self.assertEqual(
+                models.SimpleCustomerDebt.get_split_manager_name(),
+                'debt_splits'
+            )
+
+    def test_balance_checkpoint_targets(self):
+        expected = (
+            (models.SimpleCustomerBalanceCheckpoint, 'customer', 'debtor_id'),
+        )
+        debts = models.SimpleCustomerDebt
+        reflect = mock.Mock(side_effect=AssertionError)
+        with mock.patch.object(
+                debts, '_reflect_balance_checkpoint_targets', reflect):
+            self.assertEqual(debts.get_balance_checkpoint_targets(), expected)
+        self.assertEqual(
+            debts._reflect_balance_checkpoint_targets(), expected
+        )
+        self.assertEqual(
+            models.ReservationDebt.get_balance_checkpoint_targets(), ()
+        )
+
+    def test_validation(self):
+        with mock.patch.object(
+                models.SimpleCustomer, '_debts_manager_name', 'debts_'):
+            with self.assertRaisesRegex(
+                    ImproperlyConfigured, 'tests.SimpleCustomer:'):
+                registry.build_registry()
+        # the old registry is left alone
+        self.assertEqual(
+            models.SimpleCustomer.get_debts_manager_name(), 'debts'
+        )
+
+    def test_split_manager_override(self):
+        with mock.patch.object(
+                models.SimpleCustomerDebt, 'split_manager_name',
+                'debt_splits', create=True):
+            self.assertEqual(
+                models.SimpleCustomerDebt.split_manager_name, 'debt_splits'
+            )
+            metadata = models.SimpleCustomerDebt._reflect_ledger_metadata()
+        self.assertEqual(metadata.split_manager_name, 'debt_splits')
+        self.assertEqual(
+            metadata.split_model, models.SimpleCustomerPaymentSplit
+        )
+        self.assertEqual(
+            models.SimpleCustomerDebt.split_manager_name, 'debt_splits'
+        )
@@ -1,6 +1,9 @@
+import datetime
 import json
 from copy import deepcopy
 
+import pytz
+
 from django.test import TestCase
 from djmoney.money import Money
 
@@ -350,6 +353,27 @@ class TestSimplePreparator(TestCase):
             {ResolvedTransactionVerdict.SUGGEST_DISCARD, ResolvedTransactionVerdict.COMMIT}
         )
 
+    def test_duplicate_review_scoped_to_batch_accounts(self):
+        for creditor_id in (1, 2):
+            models.SimpleCustomerPayment(
+                creditor_id=creditor_id, total_amount=Money(32, 'EUR'),
+                timestamp=PARSE_TEST_DATETIME
+            ).save()
+        error_context = ResolvedTransactionMessageContext()
+        resolved_transaction = ResolvedTransaction(
+            **SIMPLE_LOOKUP_TEST_RESULT_DATA,
+            message_context=error_context, do_not_skip=False
+        )
+        cust = models.SimpleCustomer.objects.get(pk=1)
+        prep = models.SimpleGenericPreparator(
+            resolved_transactions=[(cust, resolved_transaction)]
+        )
+        prep.dupcheck_account_chunk_size = 1
+        prep.review()
+        self.assertEqual(
+            error_context.verdict, ResolvedTransactionVerdict.SUGGEST_DISCARD
+        )
+
     def test_duplicate_commit_with_prehist(self):
         pmt = models.SimpleCustomerPayment(
             creditor_id=1, total_amount=Money(32, 'EUR'),
@@ -407,6 +431,51 @@ class TestSimplePreparator(TestCase):
         )
 
 
+class TestPersistedPreparator(TestCase):
+
+    def setUp(self):
+        self.customer = models.PersistedCustomer.objects.create(name='Hash')
+        # shortly after midnight local time, still the previous day in UTC
+        self.timestamp = pytz.FixedOffset(120).localize(
+            datetime.datetime(2020, 3, 2, 1, 0)
+        )
+        models.PersistedCustomerPayment.objects.create(
+            creditor=self.customer, total_amount=Money(32, 'EUR'),
+            timestamp=self.timestamp
+        )
+
+    def review(self, amount):
+        error_context = ResolvedTransactionMessageContext()
+        resolved_transaction = ResolvedTransaction(
+            transaction_party_id=self.customer.pk, amount=amount,
+            timestamp=self.timestamp, message_context=error_context,
+            do_not_skip=False
+        )
+        prep = models.PersistedPreparator(
+            resolved_transactions=[(self.customer, resolved_transaction)]
+        )
+        prep.review()
+        return error_context.verdict
+
+    def test_duplicate_review_with_hashes(self):
+        self.assertEqual(
+            self.review(Money(32, 'EUR')),
+            ResolvedTransactionVerdict.SUGGEST_DISCARD
+        )
+        self.assertEqual(
+            self.review(Money('32.01', 'EUR')),
+            ResolvedTransactionVerdict.COMMIT
+        )
+
+    def test_duplicate_review_after_refresh(self):
+        payments = models.PersistedCustomerPayment.objects
+        self.assertEqual(payments.refresh_dupcheck_sig_hashes(), 0)
+        self.assertEqual(
+            self.review(Money(32, 'EUR')),
+            ResolvedTransactionVerdict.SUGGEST_DISCARD
+        )
+
+
 # noinspection DuplicatedCode
 class TestReservationPreparator(TestCase):
 
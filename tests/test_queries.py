@@ -1,10 +1,21 @@
 import datetime
+import re
 from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
 import pytz
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from djmoney.money import Money
 
+from double_entry.models import (
+    TransactionPartyQuerySet, _balance_query_cache,
+)
+from double_entry.utils import supports_window_functions
 from tests import models
 
 FIXTURE_EVENT_PK = 1
@@ -104,6 +115,170 @@ class TestSimplePaymentQueries(TestCase):
         self.assertEqual(fully_paid_prepped.matched_balance, Money(11, 'EUR'))
         self.assertEqual(fully_paid_prepped.unmatched_balance, Money(13, 'EUR'))
 
+    def test_single_pass(self):
+        for model in (models.SimpleCustomerDebt, models.SimpleCustomerPayment):
+            split_table = model.get_split_model()[0]._meta.db_table
+            qs = model.objects.with_fully_matched_date(single_pass=True)
+            self.assertEqual(
+                len(re.findall('(FROM|JOIN) "%s"' % split_table, str(qs.query))),
+                1
+            )
+            expected = {
+                r.pk: (r.matched_balance, r.fully_matched, r.fully_matched_date)
+                for r in model.objects.with_fully_matched_date()
+            }
+            actual = {
+                r.pk: (r.matched_balance, r.fully_matched, r.fully_matched_date)
+                for r in qs
+            }
+            self.assertEqual(expected, actual)
+        unpaid = models.SimpleCustomerDebt.objects.with_payments(
+            include_timestamps=True, single_pass=True
+        ).unpaid()
+        self.assertEqual(
+            set(unpaid.values_list('pk', flat=True)),
+            set(models.SimpleCustomerDebt.objects.unpaid().values_list(
+                'pk', flat=True
+            ))
+        )
+
+    def test_dupcheck_buckets(self):
+        # a payment close to midnight, to make the time zone matter
+        models.SimpleCustomerPayment.objects.create(
+            creditor_id=1, total_amount=Money(24, 'EUR'),
+            timestamp=datetime.datetime(
+                2019, 8, 7, 23, 30, 0, tzinfo=pytz.utc
+            )
+        )
+        qs = models.SimpleCustomerPayment.objects.all()
+        for server_tz in (False, True):
+            with self.settings(TRANSACTION_DUPCHECK_SERVER_TZ=server_tz):
+                with timezone.override('Europe/Brussels'):
+                    expected = qs.dupcheck_buckets(in_database=False)
+                    actual = qs.dupcheck_buckets()
+                self.assertEqual(dict(expected), dict(actual))
+                bounds = (
+                    datetime.datetime(2019, 8, 1, tzinfo=pytz.utc),
+                    datetime.datetime(2019, 8, 8, tzinfo=pytz.utc),
+                )
+                self.assertEqual(
+                    dict(qs.dupcheck_buckets(bounds, in_database=False)),
+                    dict(qs.dupcheck_buckets(bounds))
+                )
+
+    def test_dupcheck_buckets_override(self):
+        qs = models.SimpleCustomerPayment.objects.all()
+        signature = mock.PropertyMock(return_value='sig')
+        with mock.patch.object(
+                models.SimpleCustomerPayment, 'dupcheck_signature',
+                signature):
+            buckets = qs.dupcheck_buckets()
+        self.assertEqual(dict(buckets), {'sig': qs.count()})
+
+    def test_party_totals(self):
+        qs = models.SimpleCustomer.objects.with_debt_paid().with_payment_totals()
+        expected = {
+            c.pk: (c.debt_paid, c.payment_total, c.to_refund)
+            for c in models.SimpleCustomer.objects.with_debts_and_payments()
+        }
+        with self.assertNumQueries(1):
+            actual = {
+                c.pk: (c.debt_paid, c.payment_total, c.to_refund) for c in qs
+            }
+        self.assertEqual(expected, actual)
+
+    def test_grouped_debt_balances(self):
+        field = TransactionPartyQuerySet.DEBT_BALANCE_FIELD
+        expected = list(
+            models.SimpleCustomer.objects.with_debt_balances()
+            .order_by(field, 'pk').values_list('pk', field)
+        )
+        qs = models.SimpleCustomer.objects.with_debt_balances(grouped=True)
+        self.assertNotIn(
+            models.SimpleCustomerDebt._meta.db_table + '" U0 INNER JOIN',
+            str(qs.query)
+        )
+        self.assertEqual(
+            expected, list(qs.order_by(field, 'pk').values_list('pk', field))
+        )
+
+    def test_balances_for(self):
+        customers = models.SimpleCustomer.objects
+        pks = list(customers.values_list('pk', flat=True)) + [9999]
+        qs = customers.all()
+        qs.balances_chunk_size = 2
+        # one query per chunk
+        with self.assertNumQueries((len(pks) + 1) // 2):
+            debt = qs.balances_for(pks)
+        credit = qs.balances_for(pks, kind='credit')
+        self.assertEqual(debt[9999], Decimal('0.00'))
+        # keyed by primary key values
+        self.assertEqual(qs.balances_for(str(pk) for pk in pks), debt)
+        for c in customers.with_debts_and_payments():
+            self.assertEqual(debt[c.pk], c.debt_balance.amount)
+            self.assertEqual(
+                credit[c.pk], sum(
+                    (p.credit_remaining.amount for p in c.payments.all()),
+                    Decimal('0.00')
+                )
+            )
+
+    def test_fetch_balance(self):
+        field = TransactionPartyQuerySet.DEBT_BALANCE_FIELD
+        expected = dict(
+            models.SimpleCustomer.objects.with_debt_balances()
+            .values_list('pk', field)
+        )
+        for pk, balance in expected.items():
+            with self.assertNumQueries(1):
+                self.assertEqual(
+                    models.SimpleCustomer.fetch_balance(pk), balance
+                )
+        # the compiled query is used, not the queryset fallback
+        self.assertIsNotNone(
+            _balance_query_cache[(models.SimpleCustomer, 'default')]
+        )
+        with self.assertRaises(models.SimpleCustomer.DoesNotExist):
+            models.SimpleCustomer.fetch_balance(9999)
+
+    def test_chunked_iterator(self):
+        customers = models.SimpleCustomer.objects
+        expected = {
+            c.pk: (c.debt_balance, c.to_refund)
+            for c in customers.with_debts_and_payments()
+        }
+        qs = customers.with_debts_and_payments()
+        with CaptureQueriesContext(connection) as plain:
+            pks = [c.pk for c in qs.chunked_iterator(chunk_size=2)]
+        self.assertEqual(pks, sorted(expected))
+        # three queries per chunk: the parties, their debts and payments
+        self.assertEqual(len(plain), 3 * (len(expected) // 2 + 1))
+        with CaptureQueriesContext(connection) as touched:
+            actual = {
+                c.pk: (c.debt_balance, c.to_refund)
+                for c in qs.chunked_iterator(chunk_size=2)
+            }
+        self.assertEqual(expected, actual)
+        self.assertEqual(len(plain), len(touched))
+
+        # no prefetches: debt balances are annotated instead
+        with self.assertNumQueries(len(expected) // 2 + 1):
+            actual = {
+                c.pk: c.debt_balance
+                for c in customers.all().chunked_iterator(chunk_size=2)
+            }
+        self.assertEqual(
+            actual, {pk: balance for pk, (balance, _) in expected.items()}
+        )
+
+        debts = models.SimpleCustomerDebt.objects.all()
+        expected = {d.pk: d.balance for d in debts.with_payments()}
+        with self.assertNumQueries(len(expected) // 2 + 1):
+            actual = {
+                d.pk: d.balance for d in debts.chunked_iterator(chunk_size=2)
+            }
+        self.assertEqual(expected, actual)
+
 
 class TestReservationPaymentQueries(TestCase):
     fixtures = ['reservations.json']
@@ -160,3 +335,573 @@ class TestReservationPaymentQueries(TestCase):
         self.assertEquals(r.total_amount.amount, Decimal('7.00'))
         self.assertFalse(r.balance)
         self.assertEquals(r.ticket_face_value.amount, Decimal('32.00'))
+
+    def test_single_pass(self):
+        qs = models.ReservationDebt.objects.with_fully_matched_date(
+            single_pass=True
+        )
+        expected = {
+            r.pk: (r.balance, r.fully_matched_date)
+            for r in models.ReservationDebt.objects.with_fully_matched_date()
+        }
+        self.assertEqual(
+            {r.pk: (r.balance, r.fully_matched_date) for r in qs}, expected
+        )
+        r = qs.get(pk=FIXTURE_PERFECT_PK)
+        self.assertEquals(
+            r.fully_matched_date, datetime.datetime(
+                2019, 8, 8, 0, 15, 0, tzinfo=pytz.utc
+            )
+        )
+
+    def test_total_amount_annotations(self):
+        # a bare queryset, i.e. without the manager applying the annotations
+        qs = models.ReservationDebtQuerySet(models.ReservationDebt)
+        expected = {
+            r.pk: (r.total_amount, r.balance)
+            for r in models.ReservationDebt.objects.with_payments()
+        }
+        with self.assertNumQueries(1):
+            actual = {
+                r.pk: (r.total_amount, r.balance)
+                for r in qs.with_payments()
+            }
+        self.assertEqual(expected, actual)
+
+    def test_grouped_debt_balances(self):
+        field = TransactionPartyQuerySet.DEBT_BALANCE_FIELD
+        # TicketCustomerQuerySet also counts the tickets of reservations
+        # with a static price, so compare with the per-debt strategy
+        qs = TransactionPartyQuerySet(models.TicketCustomer).all()
+        expected = list(
+            qs.with_debt_balances(grouped=False).order_by('pk')
+            .values_list('pk', field)
+        )
+        qs = qs.with_debt_balances(grouped=True)
+        # the splits are joined once, not summed in a subquery per debt,
+        # and the debt balances are joined to the parties once
+        split_table = models.ReservationPaymentSplit._meta.db_table
+        sql = str(qs.query)
+        self.assertEqual(sql.count('JOIN "%s"' % split_table), 1)
+        self.assertIn('LEFT OUTER JOIN "%s"' % split_table, sql)
+        self.assertIn('LEFT OUTER JOIN (SELECT', sql)
+        with self.assertNumQueries(1):
+            actual = list(qs.order_by('pk').values_list('pk', field))
+        self.assertEqual(expected, actual)
+
+        unpaid = [pk for pk, balance in expected if balance > 0]
+        self.assertTrue(unpaid)
+        self.assertEqual(qs.filter(**{field + '__gt': 0}).count(), len(unpaid))
+        # relabeled in a subquery
+        self.assertEqual(
+            sorted(models.TicketCustomer.objects.filter(
+                pk__in=qs.filter(**{field + '__gt': 0}).values('pk')
+            ).values_list('pk', flat=True)), unpaid
+        )
+
+    def overmatch_static_price_reservation(self):
+        customer = models.TicketCustomer.objects.get(
+            pk=FIXTURE_PAID_TOO_MUCH_AND_TOO_LITTLE
+        )
+        # match the (static price) reservation of this customer for 5 more
+        # than its total, and add a reservation that isn't paid at all
+        payment = models.ReservationPayment.objects.create(
+            customer=customer, total_amount=Money(5, 'EUR'),
+            timestamp=datetime.datetime(2019, 8, 9, tzinfo=pytz.utc)
+        )
+        models.ReservationPaymentSplit.objects.create(
+            payment=payment, reservation_id=FIXTURE_STATIC_PRICE_PK,
+            amount=Money(5, 'EUR')
+        )
+        models.ReservationDebt.objects.create(
+            owner=customer, static_price=Decimal(3),
+            timestamp=datetime.datetime(2019, 8, 9, tzinfo=pytz.utc)
+        )
+        return customer
+
+    def test_grouped_debt_balances_overpaid(self):
+        field = TransactionPartyQuerySet.DEBT_BALANCE_FIELD
+        customer = self.overmatch_static_price_reservation()
+        qs = TransactionPartyQuerySet(models.TicketCustomer).all()
+        for grouped in (False, True):
+            balances = dict(
+                qs.with_debt_balances(grouped=grouped).values_list('pk', field)
+            )
+            self.assertEqual(balances[customer.pk], Decimal(3))
+            self.assertEqual(balances[FIXTURE_COMPLEX_PARTIALLY_PAID_PK], 6)
+
+    def test_fetch_balance(self):
+        field = TransactionPartyQuerySet.DEBT_BALANCE_FIELD
+        expected = models.TicketCustomer.objects.with_debt_balances()\
+            .values_list('pk', field)
+        for pk, balance in expected:
+            self.assertEqual(models.TicketCustomer.fetch_balance(pk), balance)
+
+    def test_party_totals(self):
+        qs = models.TicketCustomer.objects.with_debt_paid().with_payment_totals()
+        expected = {
+            c.pk: (c.debt_paid, c.payment_total, c.to_refund)
+            for c in models.TicketCustomer.objects.with_debts_and_payments()
+        }
+        with self.assertNumQueries(1):
+            actual = {
+                c.pk: (c.debt_paid, c.payment_total, c.to_refund) for c in qs
+            }
+        self.assertEqual(expected, actual)
+
+    def test_balances_for(self):
+        customers = models.TicketCustomer.objects
+        pks = list(customers.values_list('pk', flat=True)) + [9999]
+        qs = customers.all()
+        qs.balances_chunk_size = 2
+        # one query per chunk
+        with self.assertNumQueries((len(pks) + 1) // 2):
+            debt = qs.balances_for(pks)
+        credit = qs.balances_for(pks, kind='credit')
+        self.assertEqual(debt[9999], Decimal('0.00'))
+        for c in customers.with_debts_and_payments():
+            self.assertEqual(debt[c.pk], c.debt_balance.amount)
+            self.assertEqual(
+                credit[c.pk], sum(
+                    (p.credit_remaining.amount for p in c.payments.all()),
+                    Decimal('0.00')
+                )
+            )
+
+    def test_balances_for_overpaid(self):
+        customer = self.overmatch_static_price_reservation()
+        debt = models.TicketCustomer.objects.balances_for([customer.pk])
+        self.assertEqual(debt, {customer.pk: Decimal('3.00')})
+
+
+class TestPersistedBalanceQueries(TestCase):
+    databases = {'default', 'tenant'}
+
+    def setUp(self):
+        self.customer = models.PersistedCustomer.objects.create(name='Jane')
+        self.debt = models.PersistedCustomerDebt.objects.create(
+            debtor=self.customer, total_amount=Money(30, 'EUR'),
+            timestamp=datetime.datetime(2019, 8, 8, 0, 0, tzinfo=pytz.utc)
+        )
+        self.payment = models.PersistedCustomerPayment.objects.create(
+            creditor=self.customer, total_amount=Money(20, 'EUR'),
+            timestamp=datetime.datetime(2019, 8, 9, 0, 0, tzinfo=pytz.utc)
+        )
+
+    def test_split_save(self):
+        split = models.PersistedCustomerPaymentSplit(
+            debt=self.debt, payment=self.payment, amount=Money(20, 'EUR')
+        )
+        split.save()
+        debt = models.PersistedCustomerDebt.objects.get(pk=self.debt.pk)
+        self.assertEqual(debt.matched_amount, Decimal('20.00'))
+        self.assertFalse(debt.is_fully_matched)
+        self.assertEqual(debt.balance, Money(10, 'EUR'))
+        payment = models.PersistedCustomerPayment.objects.get(
+            pk=self.payment.pk
+        )
+        self.assertTrue(payment.is_fully_matched)
+        self.assertFalse(payment.credit_remaining)
+
+        split.delete()
+        debt = models.PersistedCustomerDebt.objects.get(pk=self.debt.pk)
+        self.assertEqual(debt.matched_amount, Decimal('0.00'))
+        self.assertEqual(debt.balance, Money(30, 'EUR'))
+
+    def test_entry_save(self):
+        models.PersistedCustomerPaymentSplit.objects.create(
+            debt=self.debt, payment=self.payment, amount=Money(20, 'EUR')
+        )
+        self.debt.refresh_from_db()
+        self.debt.total_amount = Money(20, 'EUR')
+        self.debt.save()
+        self.assertTrue(self.debt.is_fully_matched)
+        debts = models.PersistedCustomerDebt.objects
+        self.assertTrue(debts.get(pk=self.debt.pk).is_fully_matched)
+
+        self.debt.total_amount = Money(25, 'EUR')
+        self.debt.save()
+        self.assertEqual(debts.unpaid().get().balance, Money(5, 'EUR'))
+
+    def test_split_move(self):
+        other = models.PersistedCustomerDebt.objects.create(
+            debtor=self.customer, total_amount=Money(20, 'EUR'),
+            timestamp=datetime.datetime(2019, 8, 8, 0, 0, tzinfo=pytz.utc)
+        )
+        models.PersistedCustomerPaymentSplit.objects.create(
+            debt=self.debt, payment=self.payment, amount=Money(20, 'EUR')
+        )
+        split = models.PersistedCustomerPaymentSplit.objects.get()
+        split.debt = other
+        split.save()
+        debts = models.PersistedCustomerDebt.objects
+        self.assertEqual(
+            debts.get(pk=self.debt.pk).matched_amount, Decimal('0.00')
+        )
+        self.assertTrue(debts.get(pk=other.pk).is_fully_matched)
+
+        # moving it back once more, then deleting
+        split.debt = self.debt
+        split.delete()
+        self.assertEqual(debts.filter(matched_amount=0).count(), 2)
+
+    def test_unchanged_save(self):
+        split = models.PersistedCustomerPaymentSplit.objects.create(
+            debt=self.debt, payment=self.payment, amount=Money(20, 'EUR')
+        )
+        debt = models.PersistedCustomerDebt.objects.get(pk=self.debt.pk)
+        split = models.PersistedCustomerPaymentSplit.objects.get(pk=split.pk)
+        # plain UPDATEs, no balance refresh
+        with self.assertNumQueries(1):
+            debt.save()
+        with self.assertNumQueries(1):
+            split.save()
+        debt.total_amount = Money(20, 'EUR')
+        debt.save()
+        self.assertTrue(debt.is_fully_matched)
+
+    def test_other_database(self):
+        customer = models.PersistedCustomer.objects.using('tenant').create(
+            name='John'
+        )
+        debt = models.PersistedCustomerDebt(
+            debtor=customer, total_amount=Money(30, 'EUR'),
+            timestamp=datetime.datetime(2019, 8, 8, 0, 0, tzinfo=pytz.utc)
+        )
+        debt.save(using='tenant')
+        payment = models.PersistedCustomerPayment.objects.using(
+            'tenant'
+        ).create(
+            creditor=customer, total_amount=Money(30, 'EUR'),
+            timestamp=datetime.datetime(2019, 8, 9, 0, 0, tzinfo=pytz.utc)
+        )
+        split = models.PersistedCustomerPaymentSplit(
+            debt=debt, payment=payment, amount=Money(30, 'EUR')
+        )
+        split.save(using='tenant')
+        debts = models.PersistedCustomerDebt.objects.using('tenant')
+        self.assertTrue(debts.get(pk=debt.pk).is_fully_matched)
+        debt.total_amount = Money(40, 'EUR')
+        debt.save()
+        self.assertEqual(debts.unpaid().get().balance, Money(10, 'EUR'))
+
+    def test_split_bulk_create(self):
+        models.PersistedCustomerPaymentSplit.objects.bulk_create(
+            s for s in [
+                models.PersistedCustomerPaymentSplit(
+                    debt=self.debt, payment=self.payment,
+                    amount=Money(20, 'EUR')
+                )
+            ]
+        )
+        payments = models.PersistedCustomerPayment.objects
+        self.assertEqual(payments.fully_used().count(), 1)
+        self.assertEqual(payments.credit_remaining().count(), 0)
+        debts = models.PersistedCustomerDebt.objects
+        self.assertEqual(debts.unpaid().get().balance, Money(10, 'EUR'))
+
+    def test_filter_without_split_table(self):
+        qs = models.PersistedCustomerDebt.objects.unpaid()
+        split_table = models.PersistedCustomerPaymentSplit._meta.db_table
+        self.assertNotIn(split_table, str(qs.query))
+        self.assertEqual(qs.get().pk, self.debt.pk)
+
+    def test_rebuild(self):
+        models.PersistedCustomerPaymentSplit.objects.create(
+            debt=self.debt, payment=self.payment, amount=Money(20, 'EUR')
+        )
+        # introduce drift
+        models.PersistedCustomerPayment.objects.update(
+            matched_amount=Decimal('0.00'), is_fully_matched=False
+        )
+        out = StringIO()
+        call_command('rebuild_ledger_balances', stdout=out)
+        self.assertIn('tests.PersistedCustomerPayment: 1 stale', out.getvalue())
+        self.assertIn('tests.PersistedCustomerDebt: 0 stale', out.getvalue())
+        payment = models.PersistedCustomerPayment.objects.get()
+        self.assertTrue(payment.is_fully_matched)
+
+    def test_dupcheck_sig_hash(self):
+        payments = models.PersistedCustomerPayment.objects
+        payments.bulk_create([
+            models.PersistedCustomerPayment(
+                creditor=self.customer, total_amount=Money(20, 'EUR'),
+                timestamp=datetime.datetime(2019, 8, 9, 12, 0, tzinfo=pytz.utc)
+            ),
+            models.PersistedCustomerPayment(
+                creditor=self.customer, total_amount=Money(5, 'EUR'),
+                timestamp=datetime.datetime(2019, 8, 9, 12, 0, tzinfo=pytz.utc)
+            ),
+        ])
+        self.assertFalse(payments.filter(dupcheck_sig_hash='').exists())
+        sig = self.payment.dupcheck_signature
+        unseen = sig._replace(date=datetime.date(2018, 1, 1))
+        buckets = payments.dupcheck_buckets_for([sig, unseen])
+        self.assertEqual(buckets[sig], 2)
+        self.assertEqual(buckets[unseen], 0)
+        self.assertEqual(buckets[sig], payments.dupcheck_buckets()[sig])
+        # stored hashes are already up to date
+        self.assertEqual(payments.refresh_dupcheck_sig_hashes(), 0)
+        # all decimal places of the amount are significant
+        hash_sig = models.PersistedCustomerPayment.hash_dupcheck_signature
+        self.assertEqual(
+            hash_sig(sig._replace(amount=Decimal('20.0000'))), hash_sig(sig)
+        )
+        self.assertNotEqual(
+            hash_sig(sig._replace(amount=Decimal('20.0001'))), hash_sig(sig)
+        )
+
+    def test_stored_payment_tracking_no(self):
+        customers = models.PersistedCustomer.objects
+        # coincides with the computed tracking number
+        raw = self.customer.stored_payment_tracking_no
+        self.assertEqual(
+            raw, models.PersistedCustomer(
+                pk=self.customer.pk, hidden_token=self.customer.hidden_token
+            ).raw_payment_tracking_no
+        )
+        ogm = self.customer.payment_tracking_no
+        self.assertEqual(customers.by_payment_tracking_no(ogm), self.customer)
+        with self.assertRaises(models.PersistedCustomer.DoesNotExist):
+            customers.by_payment_tracking_no('+++190/5063/21290+++')
+
+        big = customers.create(pk=10**7 + self.customer.pk, name='John')
+        self.assertNotEqual(big.stored_payment_tracking_no, raw)
+        result, unseen = customers.by_payment_tracking_nos(
+            [ogm, big.payment_tracking_no, 'garbage'], validate_unseen=True
+        )
+        self.assertEqual(set(result), {self.customer, big})
+        self.assertEqual(unseen, {'garbage'})
+
+    def test_backfill_payment_tracking_nos(self):
+        customers = models.PersistedCustomer.objects
+        expected = self.customer.stored_payment_tracking_no
+        customers.update(stored_payment_tracking_no=None)
+        out = StringIO()
+        call_command(
+            'backfill_payment_tracking_nos', 'tests.PersistedCustomer',
+            stdout=out
+        )
+        self.assertIn('1 payment tracking number(s)', out.getvalue())
+        self.assertEqual(
+            customers.get().stored_payment_tracking_no, expected
+        )
+
+
+class TestBalanceCheckpoints(TestCase):
+    fixtures = ['simple.json']
+
+    def setUp(self):
+        def ts(month, day):
+            return datetime.datetime(2019, month, day, 12, 0, tzinfo=pytz.utc)
+        self.dates = [ts(8, 31), ts(9, 15), ts(10, 10)]
+        debt = models.SimpleCustomerDebt.objects.get(pk=FIXTURE_UNPAID_PK)
+        for amount, split_amount, timestamp in ((20, 20, ts(9, 1)),
+                                                (30, 12, ts(10, 1))):
+            payment = models.SimpleCustomerPayment.objects.create(
+                creditor_id=1, total_amount=Money(amount, 'EUR'),
+                timestamp=timestamp
+            )
+            models.SimpleCustomerPaymentSplit.objects.create(
+                payment=payment, debt=debt,
+                amount=Money(split_amount, 'EUR')
+            )
+        models.SimpleCustomerDebt.objects.create(
+            debtor_id=1, total_amount=Money(10, 'EUR'), timestamp=ts(10, 5)
+        )
+
+    def balances(self, as_of):
+        c = models.SimpleCustomer.objects.with_balances_as_of(as_of).get(pk=1)
+        return (
+            c.debt_balance.amount,
+            getattr(c, TransactionPartyQuerySet.CREDIT_BALANCE_FIELD)
+        )
+
+    def test_balances_as_of(self):
+        expected = [
+            (Decimal('32.00'), Decimal('0.00')),
+            (Decimal('12.00'), Decimal('0.00')),
+            (Decimal('10.00'), Decimal('18.00')),
+        ]
+        self.assertEqual([self.balances(d) for d in self.dates], expected)
+        debt = models.SimpleCustomerDebt.objects.with_remote_accounts(
+            as_of=self.dates[1]
+        ).get(pk=FIXTURE_UNPAID_PK)
+        self.assertEqual(debt.balance, Money(12, 'EUR'))
+        with self.assertRaises(ValueError):
+            models.SimpleCustomerDebt.objects.with_remote_accounts()\
+                .with_remote_accounts(as_of=self.dates[1])
+
+        created =models.SimpleCustomerBalanceCheckpoint.create_checkpoints(
+            self.dates[1]
+        )
+        self.assertEqual(created, models.SimpleCustomer.objects.count())
+        checkpoint = models.SimpleCustomerBalanceCheckpoint.objects.get(
+            customer_id=1
+        )
+        self.assertEqual(checkpoint.debt_total, Decimal('32.00'))
+        self.assertEqual(checkpoint.credit_matched, Decimal('20.00'))
+        self.assertEqual([self.balances(d) for d in self.dates], expected)
+
+        # the checkpoint is used as-is
+        models.SimpleCustomerBalanceCheckpoint.objects.filter(
+            customer_id=1
+        ).update(debt_total=Decimal('40.00'))
+        self.assertEqual(self.balances(self.dates[0]), expected[0])
+        self.assertEqual(
+            self.balances(self.dates[2]), (Decimal('18.00'), Decimal('18.00'))
+        )
+
+    def test_balances_as_of_overmatched(self):
+        # match the debt of 10 for 15
+        debt = models.SimpleCustomerDebt.objects.get(
+            total_amount=Money(10, 'EUR')
+        )
+        payment = models.SimpleCustomerPayment.objects.create(
+            creditor_id=1, total_amount=Money(15, 'EUR'),
+            timestamp=datetime.datetime(2019, 10, 6, 12, 0, tzinfo=pytz.utc)
+        )
+        models.SimpleCustomerPaymentSplit.objects.create(
+            payment=payment, debt=debt, amount=Money(15, 'EUR')
+        )
+        expected = (Decimal('0.00'), Decimal('18.00'))
+        self.assertEqual(self.balances(self.dates[2]), expected)
+        current = models.SimpleCustomer.objects.with_debt_balances().get(pk=1)
+        self.assertEqual(current.debt_balance.amount, expected[0])
+
+        # both with and without an overmatched entry in the checkpoint
+        for as_of in self.dates[1:]:
+            models.SimpleCustomerBalanceCheckpoint.create_checkpoints(as_of)
+            self.assertEqual(self.balances(self.dates[2]), expected)
+
+    def test_create_checkpoints_command(self):
+        out = StringIO()
+        call_command(
+            'create_balance_checkpoints', '--as-of', '2019-09-15', stdout=out
+        )
+        self.assertIn(
+            'tests.SimpleCustomerBalanceCheckpoint: %d checkpoint(s)'
+            % models.SimpleCustomer.objects.count(), out.getvalue()
+        )
+        checkpoint = models.SimpleCustomerBalanceCheckpoint.objects.get(
+            customer_id=1
+        )
+        self.assertEqual(checkpoint.debt_matched, Decimal('20.00'))
+
+    def test_backdated_entries(self):
+        checkpoints = models.SimpleCustomerBalanceCheckpoint.objects
+        as_of = self.dates[1]
+
+        def ts(month, day):
+            return datetime.datetime(2019, month, day, 12, 0, tzinfo=pytz.utc)
+
+        def checkpoint_exists():
+            return checkpoints.filter(customer_id=1).exists()
+
+        models.SimpleCustomerBalanceCheckpoint.create_checkpoints(as_of)
+        # recorded after the checkpoint was taken, but dated before it
+        debt = models.SimpleCustomerDebt.objects.create(
+            debtor_id=1, total_amount=Money(7, 'EUR'), timestamp=ts(9, 10)
+        )
+        self.assertFalse(checkpoint_exists())
+        self.assertTrue(checkpoints.exists())
+        self.assertEqual(
+            self.balances(as_of), (Decimal('19.00'), Decimal('0.00'))
+        )
+
+        models.SimpleCustomerBalanceCheckpoint.create_checkpoints(as_of)
+        models.SimpleCustomerPayment.objects.bulk_create([
+            models.SimpleCustomerPayment(
+                creditor_id=1, total_amount=Money(7, 'EUR'),
+                timestamp=ts(9, 12)
+            )
+        ])
+        self.assertFalse(checkpoint_exists())
+        self.assertEqual(
+            self.balances(as_of), (Decimal('19.00'), Decimal('7.00'))
+        )
+
+        models.SimpleCustomerBalanceCheckpoint.create_checkpoints(as_of)
+        # bulk_create doesn't set primary keys on every backend
+        payment = models.SimpleCustomerPayment.objects.get(
+            timestamp=ts(9, 12)
+        )
+        models.SimpleCustomerPaymentSplit.objects.bulk_create([
+            models.SimpleCustomerPaymentSplit(
+                payment=payment, debt=debt, amount=Money(7, 'EUR')
+            )
+        ])
+        self.assertFalse(checkpoint_exists())
+        self.assertEqual(
+            self.balances(as_of), (Decimal('12.00'), Decimal('0.00'))
+        )
+
+        # moving an entry loaded from the database doesn't look up
+        # its old timestamp
+        debt = models.SimpleCustomerDebt.objects.get(pk=debt.pk)
+        debt.timestamp = ts(11, 1)
+        models.SimpleCustomerBalanceCheckpoint.create_checkpoints(as_of)
+        with self.assertNumQueries(2):
+            # update, invalidation
+            debt.save()
+        self.assertFalse(checkpoint_exists())
+        with self.assertNumQueries(2):
+            debt.save(update_fields=['total_amount'])
+
+        # entries dated after the checkpoint don't affect it
+        models.SimpleCustomerBalanceCheckpoint.create_checkpoints(as_of)
+        models.SimpleCustomerDebt.objects.create(
+            debtor_id=1, total_amount=Money(7, 'EUR'), timestamp=ts(11, 1)
+        )
+        self.assertTrue(checkpoint_exists())
+
+
+class TestStatements(TestCase):
+    fixtures = ['simple.json']
+
+    def setUp(self):
+        def ts(month, day):
+            return datetime.datetime(2019, month, day, 12, 0, tzinfo=pytz.utc)
+        debt = models.SimpleCustomerDebt.objects.get(pk=FIXTURE_UNPAID_PK)
+        for amount, split_amount, timestamp in ((20, 20, ts(9, 1)),
+                                                (30, 12, ts(10, 1))):
+            payment = models.SimpleCustomerPayment.objects.create(
+                creditor_id=1, total_amount=Money(amount, 'EUR'),
+                timestamp=timestamp
+            )
+            models.SimpleCustomerPaymentSplit.objects.create(
+                payment=payment, debt=debt,
+                amount=Money(split_amount, 'EUR')
+            )
+        models.SimpleCustomerDebt.objects.create(
+            debtor_id=1, total_amount=Money(10, 'EUR'), timestamp=ts(10, 5)
+        )
+        self.first_payment_ts = ts(9, 1)
+
+    def test_statement(self):
+        customer = models.SimpleCustomer.objects.get(pk=1)
+        windowed = list(customer.statement(chunk_size=2))
+        self.assertEqual(windowed, list(customer.statement(in_database=False)))
+        self.assertEqual(
+            [(line.entry, line.amount, line.balance) for line in windowed], [
+                ('debt', Money(32, 'EUR'), Money(32, 'EUR')),
+                ('payment', Money(20, 'EUR'), Money(12, 'EUR')),
+                ('payment', Money(30, 'EUR'), Money(-18, 'EUR')),
+                ('debt', Money(10, 'EUR'), Money(-8, 'EUR')),
+            ]
+        )
+        self.assertEqual(windowed[1].timestamp, self.first_payment_ts)
+
+    def test_statement_in_database(self):
+        if not supports_window_functions(connection):
+            self.skipTest('window functions are not supported')
+        customer = models.SimpleCustomer.objects.get(pk=1)
+        self.assertEqual(
+            list(customer.statement(in_database=True, chunk_size=2)),
+            list(customer.statement(in_database=False))
+        )
+        # same detection as the reconciliation in the database
+        with mock.patch.object(
+                models.SimpleCustomer, '_statement_in_database') as windowed:
+            customer.statement()
+        windowed.assert_called_once_with(2000, 'default')
@@ -0,0 +1,227 @@
+import datetime
+from decimal import Decimal
+from io import StringIO
+
+import pytz
+from django.core.management import call_command
+from django.test import TestCase
+from djmoney.money import Money
+from hypothesis import given, settings, strategies as st
+from hypothesis.extra import django as hypothesis_django
+
+from double_entry.forms.bulk_utils import make_payment_splits
+from double_entry.reconciliation import reconcile_in_database
+from double_entry.utils import consume_with_result
+from tests import models
+
+
+def day(n):
+    return datetime.datetime(2020, 3, 1, tzinfo=pytz.utc) \
+        + datetime.timedelta(days=n)
+
+
+def fifo_splits(customer):
+    debts = models.SimpleCustomerDebt.objects.filter(
+        debtor=customer
+    ).with_remote_accounts().order_by('timestamp', 'pk')
+    payments = models.SimpleCustomerPayment.objects.filter(
+        creditor=customer
+    ).with_remote_accounts().order_by('timestamp', 'pk')
+    splits, __ = consume_with_result(make_payment_splits(
+        list(payments), list(debts), models.SimpleCustomerPaymentSplit,
+        prioritise_exact_amount_match=False
+    ))
+    return {(s.debt.pk, s.payment.pk, s.amount.amount) for s in splits}
+
+
+def splits_of(customer):
+    return set(
+        models.SimpleCustomerPaymentSplit.objects.filter(
+            debt__debtor=customer
+        ).values_list('debt_id', 'payment_id', 'amount')
+    )
+
+
+class TestReconciliation(TestCase):
+    fixtures = ['simple.json']
+
+    def setUp(self):
+        self.customer = models.SimpleCustomer.objects.create(name='Reconcile')
+        for amount, n in ((10, 0), (25, 1), (5, 5)):
+            models.SimpleCustomerDebt.objects.create(
+                debtor=self.customer, total_amount=Money(amount, 'EUR'),
+                timestamp=day(n)
+            )
+        for amount, n in ((20, 2), (30, 6)):
+            models.SimpleCustomerPayment.objects.create(
+                creditor=self.customer, total_amount=Money(amount, 'EUR'),
+                timestamp=day(n)
+            )
+
+    def test_same_as_fifo(self):
+        expected = fifo_splits(self.customer)
+        self.assertEqual(len(expected), 4)
+
+        created = reconcile_in_database(
+            models.SimpleCustomer, parties=[self.customer.pk]
+        )
+        self.assertEqual(created, 4)
+        self.assertEqual(splits_of(self.customer), expected)
+        self.assertFalse(
+            models.SimpleCustomerDebt.objects.filter(
+                debtor=self.customer
+            ).unpaid().exists()
+        )
+
+    def test_skip_old_payments(self):
+        # the first payment is too old for the debt, the second one pays it
+        customer = models.SimpleCustomer.objects.create(name='Skip')
+        old_payment = models.SimpleCustomerPayment.objects.create(
+            creditor=customer, total_amount=Money(10, 'EUR'),
+            timestamp=day(1)
+        )
+        debt = models.SimpleCustomerDebt.objects.create(
+            debtor=customer, total_amount=Money(10, 'EUR'), timestamp=day(5)
+        )
+        payment = models.SimpleCustomerPayment.objects.create(
+            creditor=customer, total_amount=Money(10, 'EUR'),
+            timestamp=day(6)
+        )
+        expected = fifo_splits(customer)
+        self.assertEqual(expected, {(debt.pk, payment.pk, 10)})
+        self.assertEqual(
+            reconcile_in_database(models.SimpleCustomer, [customer.pk]), 1
+        )
+        self.assertEqual(splits_of(customer), expected)
+        self.assertEqual(
+            reconcile_in_database(models.SimpleCustomer, [customer.pk]), 0
+        )
+        self.assertFalse(old_payment.payment_splits.exists())
+
+    def test_whole_ledger(self):
+        unpaid_before = models.SimpleCustomerDebt.objects.unpaid().count()
+        reconcile_in_database(models.SimpleCustomer)
+        self.assertLess(
+            models.SimpleCustomerDebt.objects.unpaid().count(), unpaid_before
+        )
+        for split in models.SimpleCustomerPaymentSplit.objects.select_related(
+                'debt', 'payment'):
+            self.assertGreaterEqual(
+                split.payment.timestamp, split.debt.timestamp
+            )
+        # nothing is overpaid or overused
+        for model in (models.SimpleCustomerDebt, models.SimpleCustomerPayment):
+            for entry in model.objects.with_remote_accounts():
+                self.assertGreaterEqual(
+                    entry.unmatched_balance, Money(0, 'EUR')
+                )
+        # running it again is a no-op
+        self.assertEqual(reconcile_in_database(models.SimpleCustomer), 0)
+
+    def test_payment_too_old(self):
+        customer = models.SimpleCustomer.objects.create(name='Early')
+        models.SimpleCustomerPayment.objects.create(
+            creditor=customer, total_amount=Money(10, 'EUR'),
+            timestamp=day(0)
+        )
+        models.SimpleCustomerDebt.objects.create(
+            debtor=customer, total_amount=Money(10, 'EUR'), timestamp=day(1)
+        )
+        self.assertEqual(
+            reconcile_in_database(models.SimpleCustomer, [customer.pk]), 0
+        )
+
+    def test_refunds_skipped(self):
+        customer = models.SimpleCustomer.objects.create(name='Refund')
+        models.SimpleCustomerDebt.objects.create(
+            debtor=customer, total_amount=Money(10, 'EUR'), timestamp=day(0),
+            is_refund=True
+        )
+        models.SimpleCustomerPayment.objects.create(
+            creditor=customer, total_amount=Money(10, 'EUR'),
+            timestamp=day(1)
+        )
+        self.assertEqual(
+            reconcile_in_database(models.SimpleCustomer, [customer.pk]), 0
+        )
+
+    def test_persisted_balances(self):
+        customer = models.PersistedCustomer.objects.create(name='Persisted')
+        debt = models.PersistedCustomerDebt.objects.create(
+            debtor=customer, total_amount=Money(10, 'EUR'), timestamp=day(0)
+        )
+        payment = models.PersistedCustomerPayment.objects.create(
+            creditor=customer, total_amount=Money(15, 'EUR'),
+            timestamp=day(1)
+        )
+        self.assertEqual(reconcile_in_database(models.PersistedCustomer), 1)
+        debt.refresh_from_db()
+        payment.refresh_from_db()
+        self.assertTrue(debt.is_fully_matched)
+        self.assertEqual(payment.matched_amount, 10)
+        self.assertFalse(payment.is_fully_matched)
+
+        # entries that were settled before aren't refreshed
+        models.PersistedCustomerDebt.objects.filter(pk=debt.pk).update(
+            matched_amount=Decimal('1.00')
+        )
+        models.PersistedCustomerDebt.objects.create(
+            debtor=customer, total_amount=Money(10, 'EUR'), timestamp=day(0)
+        )
+        self.assertEqual(reconcile_in_database(models.PersistedCustomer), 1)
+        debt.refresh_from_db()
+        self.assertEqual(debt.matched_amount, Decimal('1.00'))
+        payment.refresh_from_db()
+        self.assertTrue(payment.is_fully_matched)
+
+    def test_checkpoints_invalidated(self):
+        models.SimpleCustomerBalanceCheckpoint.create_checkpoints(day(10))
+        reconcile_in_database(
+            models.SimpleCustomer, parties=[self.customer.pk]
+        )
+        checkpoints = models.SimpleCustomerBalanceCheckpoint.objects
+        self.assertFalse(checkpoints.filter(customer=self.customer).exists())
+        self.assertTrue(checkpoints.exists())
+
+    def test_command(self):
+        out = StringIO()
+        call_command(
+            'reconcile_ledger', 'tests.SimpleCustomer',
+            '--party', str(self.customer.pk), stdout=out
+        )
+        self.assertEqual(
+            out.getvalue().strip(), 'tests.SimpleCustomer: created 4 split(s).'
+        )
+
+
+class TestReconciliationFifo(hypothesis_django.TestCase):
+
+    @settings(max_examples=50, deadline=None)
+    @given(
+        debt_specs=st.lists(st.tuples(
+            st.integers(min_value=1, max_value=5000),
+            st.integers(min_value=0, max_value=10)
+        ), max_size=8),
+        payment_specs=st.lists(st.tuples(
+            st.integers(min_value=1, max_value=5000),
+            st.integers(min_value=0, max_value=10)
+        ), max_size=8),
+    )
+    def test_same_as_fifo(self, debt_specs, payment_specs):
+        customer = models.SimpleCustomer.objects.create(name='Random')
+        for cents, n in debt_specs:
+            models.SimpleCustomerDebt.objects.create(
+                debtor=customer, timestamp=day(n),
+                total_amount=Money(Decimal(cents).scaleb(-2), 'EUR')
+            )
+        for cents, n in payment_specs:
+            models.SimpleCustomerPayment.objects.create(
+                creditor=customer, timestamp=day(n),
+                total_amount=Money(Decimal(cents).scaleb(-2), 'EUR')
+            )
+        expected = fifo_splits(customer)
+        self.assertEqual(
+            reconcile_in_database(models.SimpleCustomer, [customer.pk]),
+            len(expected)
+        )
+        self.assertEqual(splits_of(customer), expected)
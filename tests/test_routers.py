@@ -0,0 +1,243 @@
+import datetime
+from unittest import mock
+
+import pytz
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import CASCADE, ForeignKey
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from djmoney.money import Money
+
+from double_entry import routers
+from double_entry.forms import bulk_utils
+from double_entry.forms.bulk_utils import (
+    ResolvedTransactionMessageContext, ResolvedTransaction,
+)
+from double_entry.routers import (
+    read_from_replica, pin_to_primary, tenant_context,
+)
+from double_entry.models import GnuCashCategory
+from . import models
+from .test_csv import SIMPLE_LOOKUP_TEST_RESULT_DATA
+from .test_pipeline import SIMPLE_OVERPAID_CHECK
+
+
+def simple_pipeline(**kwargs):
+    resolved_transaction = ResolvedTransaction(
+        **SIMPLE_LOOKUP_TEST_RESULT_DATA,
+        message_context=ResolvedTransactionMessageContext(),
+        do_not_skip=False
+    )
+    pipeline = bulk_utils.PaymentSubmissionPipeline(
+        [(ResolvedTransaction, models.SimpleGenericPreparator)], **kwargs
+    )
+    pipeline.submit_resolved([
+        (models.SimpleCustomer.objects.all(), [resolved_transaction])
+    ])
+    return pipeline
+
+
+@override_settings(DOUBLE_ENTRY_REPLICA_DATABASE='replica')
+class TestReplicaRouting(TestCase):
+    databases = {'default', 'replica'}
+    fixtures = ['simple.json']
+
+    def test_review_reads_from_replica(self):
+        pipeline = simple_pipeline()
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            pipeline.review()
+        self.assertEqual(len(primary), 0)
+        self.assertTrue(len(replica))
+        pt, = pipeline.prepared[0]
+        self.assertTrue(pt.to_commit)
+
+    def test_commit_stays_on_primary(self):
+        pipeline = simple_pipeline()
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            with read_from_replica():
+                pipeline.commit()
+        self.assertEqual(len(replica), 0)
+        self.assertTrue(len(primary))
+        self.assertTrue(
+            models.SimpleCustomerPayment.objects.using('default').filter(
+                creditor_id=1
+            ).exists()
+        )
+        self.assertFalse(
+            models.SimpleCustomerPayment.objects.using('replica').filter(
+                creditor_id=1
+            ).exists()
+        )
+
+    def test_queryset_hint(self):
+        qs = models.SimpleCustomerDebt.objects.with_remote_accounts()
+        self.assertEqual(qs.on_replica().db, 'replica')
+        customers = models.SimpleCustomer.objects.with_debt_balances()
+        self.assertEqual(customers.on_replica().db, 'replica')
+        with pin_to_primary():
+            self.assertEqual(qs.on_replica().db, 'default')
+            with read_from_replica():
+                self.assertEqual(qs.db, 'default')
+        with read_from_replica():
+            self.assertEqual(qs.db, 'replica')
+        with override_settings(DOUBLE_ENTRY_REPLICA_DATABASE=None):
+            self.assertEqual(qs.on_replica().db, 'default')
+            with read_from_replica():
+                self.assertEqual(qs.db, 'default')
+
+
+@override_settings(
+    DOUBLE_ENTRY_TENANT_DATABASES={'acme': 'tenant', 'other': 'default'},
+    DOUBLE_ENTRY_REPLICA_DATABASE='replica'
+)
+class TestTenantRouting(TestCase):
+    databases = {'default', 'tenant', 'replica'}
+    fixtures = ['simple.json']
+
+    def payment_exists(self, alias):
+        return models.SimpleCustomerPayment.objects.using(alias).filter(
+            creditor_id=1
+        ).exists()
+
+    def test_pipeline_tenant(self):
+        pipeline = simple_pipeline(tenant='acme')
+        with CaptureQueriesContext(connections['replica']) as replica:
+            pipeline.review()
+        # tenant reads never go to the shared replica
+        self.assertEqual(len(replica), 0)
+        with tenant_context('other'):
+            pipeline.commit()
+        self.assertTrue(self.payment_exists('tenant'))
+        self.assertFalse(self.payment_exists('default'))
+
+    def test_pipeline_current_tenant(self):
+        with tenant_context('acme'):
+            pipeline = simple_pipeline()
+        pipeline.commit()
+        self.assertTrue(self.payment_exists('tenant'))
+        self.assertFalse(self.payment_exists('default'))
+
+    def test_fetch_balance(self):
+        balance = models.SimpleCustomer.fetch_balance(1)
+        with tenant_context('acme'):
+            models.SimpleCustomerDebt.objects.create(
+                debtor_id=1, total_amount=Money(10, 'EUR'),
+                timestamp=datetime.datetime(2019, 8, 8, tzinfo=pytz.utc)
+            )
+            self.assertEqual(
+                models.SimpleCustomer.fetch_balance(1), balance + 10
+            )
+        self.assertEqual(models.SimpleCustomer.fetch_balance(1), balance)
+
+    def test_statement(self):
+        debts = models.SimpleCustomerDebt.objects.using('tenant')
+        debt = debts.create(
+            debtor_id=1, total_amount=Money(10, 'EUR'),
+            timestamp=datetime.datetime(2019, 8, 8, tzinfo=pytz.utc)
+        )
+        customer = models.SimpleCustomer.objects.using('tenant').get(pk=1)
+        for in_database in (None, False):
+            lines = list(customer.statement(in_database=in_database))
+            self.assertEqual(
+                [line.entry_id for line in lines if line.entry == 'debt'],
+                list(debts.filter(debtor_id=1).order_by(
+                    'timestamp', 'pk'
+                ).values_list('pk', flat=True))
+            )
+            self.assertIn(debt.pk, [line.entry_id for line in lines])
+
+    def test_refresh_dupcheck_sig_hashes(self):
+        customer = models.PersistedCustomer.objects.using('tenant').create(
+            name='Jane'
+        )
+        payments = models.PersistedCustomerPayment.objects.using('tenant')
+        payments.create(
+            creditor=customer, total_amount=Money(20, 'EUR'),
+            timestamp=datetime.datetime(2019, 8, 9, tzinfo=pytz.utc)
+        )
+        payments.update(dupcheck_sig_hash='')
+        self.assertEqual(payments.refresh_dupcheck_sig_hashes(), 1)
+        self.assertFalse(payments.filter(dupcheck_sig_hash='').exists())
+
+    def test_shared_models(self):
+        # a ledger model referring to a model of another app
+        meta = models.SimpleCustomerDebt._meta
+        owner = ForeignKey(User, on_delete=CASCADE)
+        routers._tenant_models.cache_clear()
+        try:
+            with mock.patch.object(
+                    meta, 'concrete_fields', meta.concrete_fields + (owner,)):
+                self.assertFalse(routers.is_tenant_model(User))
+                self.assertTrue(routers.is_tenant_model(GnuCashCategory))
+        finally:
+            routers._tenant_models.cache_clear()
+
+    def test_ledger_query_set(self):
+        with tenant_context('acme'):
+            qs = models.SimpleCustomerDebt.objects.all()
+            self.assertEqual(qs.db, 'tenant')
+            self.assertEqual(
+                bulk_utils.LedgerQuerySetBuilder.default_ledger_query_set(
+                    models.SimpleCustomer
+                ).db, 'tenant'
+            )
+            # not a ledger model
+            self.assertEqual(User.objects.all().db, 'default')
+        self.assertEqual(qs.db, 'default')
+        with self.assertRaises(ValueError):
+            with tenant_context('nope'):
+                pass
+
+
+@override_settings(
+    DOUBLE_ENTRY_TENANT_DATABASES={'acme': 'tenant'},
+    DOUBLE_ENTRY_REPLICA_DATABASE='replica'
+)
+class TestTenantRefunds(TestCase):
+    databases = {'default', 'tenant', 'replica'}
+    fixtures = ['reservations.json']
+
+    def test_refund(self):
+        resolved_transaction = ResolvedTransaction(
+            **SIMPLE_OVERPAID_CHECK,
+            message_context=ResolvedTransactionMessageContext(),
+            do_not_skip=False
+        )
+        with tenant_context('acme'):
+            customer = models.TicketCustomer.objects.get(pk=1)
+            prep = models.ReservationPreparator(
+                resolved_transactions=[(customer, resolved_transaction)]
+            )
+            prep.commit()
+            refund = models.ReservationDebt.objects.with_payments().get(
+                owner_id=1, is_refund=True
+            )
+            self.assertTrue(refund.fully_matched)
+            self.assertEqual(refund.gnucash_category.name, 'refund')
+            # tickets follow the reservation they belong to
+            reservation = models.Reservation.objects.get(pk=1)
+            self.assertEqual(reservation.tickets.all().db, 'tenant')
+        self.assertEqual(refund._state.db, 'tenant')
+        self.assertEqual(refund.gnucash_category._state.db, 'tenant')
+        self.assertFalse(
+            GnuCashCategory.objects.using('default').filter(
+                name='refund'
+            ).exists()
+        )
+        self.assertFalse(
+            models.ReservationDebt.objects.using('default').filter(
+                is_refund=True
+            ).exists()
+        )
+
+    def test_cross_tenant_relation(self):
+        category = GnuCashCategory.objects.using('default').create(
+            name='shared'
+        )
+        with tenant_context('acme'):
+            debt = models.ReservationDebt.objects.get(pk=1)
+            with self.assertRaises(ValueError):
+                debt.gnucash_category = category
@@ -15,9 +15,20 @@ INSTALLED_APPS = [
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3'
-    }
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3'
+    },
+    'tenant': {
+        'ENGINE': 'django.db.backends.sqlite3'
+    },
 }
 
+DATABASE_ROUTERS = [
+    'double_entry.routers.TenantLedgerRouter',
+    'double_entry.routers.LedgerReplicaRouter',
+]
+
 ROOT_URLCONF = 'tests.urls'
 
 TEMPLATES = [{